@@ -0,0 +1,61 @@
+import os
+import pickle
+import time
+
+import numpy as np
+
+from ann_index import ivf_pq_index
+from embedding_store import embedding_store
+from similarity_engine import top_k_similar
+
+# Recall vs latency of ivf_pq_index against the exact neighbours `similarity.run` finds
+dump_pickle_path = 'public_test.pickle'
+store_path = 'public_test_store'
+synthetic_n = 0  # > 0 benchmarks random clustered vectors instead of public_test
+k = 5
+nprobes = (1, 2, 4, 8, 16, 32)
+
+if synthetic_n:
+    rng = np.random.default_rng(0)
+    centers = rng.random((max(1, synthetic_n // 100), 9176), dtype=np.float32) ** 8
+    matrix = centers[rng.integers(0, len(centers), synthetic_n)]
+    matrix = matrix + 0.05 * rng.random(matrix.shape, dtype=np.float32)
+elif os.path.isdir(store_path):
+    matrix = embedding_store(store_path).matrix()
+else:
+    with open(dump_pickle_path, "rb") as f:
+        matrix = np.stack([x[0] for x in pickle.load(f)])
+
+n = matrix.shape[0]
+k = min(k, n - 1)
+print(f"{n} vectors, dim {matrix.shape[1]}, k={k}")
+
+st = time.time()
+exact, _ = top_k_similar(matrix, k, "cosine")
+exact_time = time.time() - st
+print(f"exact (similarity_engine): {exact_time:.3f}s, {exact_time / n * 1000:.3f} ms/query")
+
+nlist = max(1, int(np.sqrt(n)))
+index = ivf_pq_index(nlist=nlist, m=32)
+st = time.time()
+index.add(matrix)
+print(f"ivf_pq_index nlist={index.nlist} m={index.m}: built in {time.time() - st:.2f}s")
+
+
+def recall(found: np.ndarray) -> float:
+    hits = 0
+    for row, ids in enumerate(found):
+        ids = [x for x in ids if x != row][:k]
+        hits += len(set(ids) & set(exact[row]))
+    return hits / exact.size
+
+
+print(f"{'nprobe':>6} {'rerank':>6} {'recall@' + str(k):>9} {'ms/query':>9}")
+for nprobe in nprobes:
+    if nprobe > index.nlist:
+        break
+    for rerank in (None, matrix):
+        st = time.time()
+        found, _ = index.query(matrix, k + 1, nprobe, rerank=rerank)
+        elapsed = time.time() - st
+        print(f"{nprobe:>6} {str(rerank is not None):>6} {recall(found):>9.3f} {elapsed / n * 1000:>9.3f}")
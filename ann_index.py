@@ -0,0 +1,309 @@
+import json
+from typing import Optional
+
+import numpy as np
+
+
+def _sq_distances(x: np.ndarray, centroids: np.ndarray, c_sq: Optional[np.ndarray] = None) -> np.ndarray:
+    if c_sq is None:
+        c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    dist = x @ centroids.T
+    dist *= -2
+    dist += c_sq[None, :]
+    dist += np.einsum("ij,ij->i", x, x)[:, None]
+    return dist
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, block=8192) -> np.ndarray:
+    """Index of the closest centroid for every row of `x`"""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], block):
+        labels[start:start + block] = np.argmin(_sq_distances(x[start:start + block], centroids, c_sq), axis=1)
+    return labels
+
+
+def cluster_sums(x: np.ndarray, labels: np.ndarray, k: int, block=2048) -> np.ndarray:
+    """Per-cluster sums of the rows of `x`, each block sorted by label and summed with one reduceat"""
+    sums = np.zeros((k, x.shape[1]), dtype=np.float32)
+    for start in range(0, x.shape[0], block):
+        block_labels = labels[start:start + block]
+        order = np.argsort(block_labels, kind="stable")
+        clusters, starts = np.unique(block_labels[order], return_index=True)
+        sums[clusters] += np.add.reduceat(x[start:start + block][order], starts, axis=0)
+    return sums
+
+
+def kmeans(x: np.ndarray, k: int, iters=20, seed=0) -> np.ndarray:
+    """Plain Lloyd k-means, empty clusters are re-seeded from random points"""
+    rng = np.random.default_rng(seed)
+    k = min(k, x.shape[0])
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = cluster_sums(x, labels, k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if not filled.all():
+            centroids[~filled] = x[rng.choice(x.shape[0], int((~filled).sum()))]
+    return centroids
+
+
+class ivf_pq_index:
+    """Inverted-file index with product quantization over recognizer result vectors
+
+    Vectors are routed to the closest of `nlist` coarse centroids, and the
+    residual is compressed to `m` one-byte codes (256 centroids per sub-space),
+    so a 9176-float vector costs `m` bytes plus its id. A query only scans the
+    `nprobe` closest lists and scores codes with per-query lookup tables.
+    Passing the full matrix to `query` re-ranks the candidates exactly.
+
+    Cosine similarity is handled by L2-normalizing vectors, where the
+    euclidean order and the cosine order match.
+
+    The quantizers are trained once. Vectors added before that are buffered
+    until `min_train` of them have arrived, so a small first insert does not
+    fix the clustering for good. `query` and `save` train on whatever is
+    buffered, and `train` can be called explicitly on a representative sample.
+
+    Usage:
+        ```
+        index = ivf_pq_index(nlist=1024, m=32)
+        index.add(store.matrix())           # buffered until `min_train` vectors, then trained
+        ids, scores = index.query(store.rows(0, 10), k=5, nprobe=16)
+        index.save("danbooru.ivfpq.npz")
+        ```
+    """
+    KSUB = 256
+
+    def __init__(self, nlist=1024, m=32, metric="cosine", train_size=65536, seed=0,
+                 min_train: Optional[int] = None) -> None:
+        """
+
+        Args:
+            nlist (int, optional): Number of coarse clusters. Defaults to 1024.
+            m (int, optional): Sub-quantizers (bytes per vector). Defaults to 32.
+            metric (str, optional): "cosine" or "euclidean". Defaults to "cosine".
+            train_size (int, optional): Max vectors sampled for training. Defaults to 65536.
+            seed (int, optional): Defaults to 0.
+            min_train (Optional[int], optional): Vectors buffered by `add` before training.
+                Defaults to 39 per centroid of the larger of nlist and 256, capped by `train_size`.
+        """
+        if metric not in ("cosine", "euclidean"):
+            raise ValueError(f"Unknown metric {metric}")
+        self.nlist = nlist
+        self.m = m
+        self.metric = metric
+        self.train_size = train_size
+        self.seed = seed
+        self.dim: Optional[int] = None
+        self.coarse: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None  # (m, KSUB, dsub)
+        self._codes: list[list[np.ndarray]] = []
+        self._ids: list[list[np.ndarray]] = []
+        self._next_id = 0
+        self.min_train = min_train or min(train_size, max(nlist, self.KSUB) * 39)
+        self._pending: list[tuple[np.ndarray, np.ndarray]] = []  # (vectors, ids) added before training
+        self._pending_rows = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.coarse is not None
+
+    def __len__(self) -> int:
+        return self._next_id
+
+    @property
+    def dsub(self) -> int:
+        return -(-self.dim // self.m)
+
+    def _prepare(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        if self.metric == "cosine":
+            norms = np.linalg.norm(x, axis=1, keepdims=True)
+            x = x / np.maximum(norms, 1e-12)
+        pad = self.m * self.dsub - x.shape[1]
+        if pad:
+            x = np.pad(x, ((0, 0), (0, pad)))
+        return x
+
+    def _split(self, x: np.ndarray) -> np.ndarray:
+        return x.reshape(x.shape[0], self.m, self.dsub)
+
+    def train(self, x: Optional[np.ndarray] = None) -> None:
+        """Fit the quantizers on `x`, or on the buffered vectors, then insert the buffered vectors"""
+        if x is None:
+            if not self._pending:
+                raise ValueError("Nothing to train on, add vectors or pass x")
+            x = self._pending[0][0] if len(self._pending) == 1 else np.concatenate(
+                [vectors for vectors, _ in self._pending])
+        self.dim = x.shape[1]
+        rng = np.random.default_rng(self.seed)
+        if x.shape[0] > self.train_size:
+            x = x[np.sort(rng.choice(x.shape[0], self.train_size, replace=False))]
+        x = self._prepare(x)
+        self.coarse = kmeans(x, self.nlist, seed=self.seed)
+        self.nlist = self.coarse.shape[0]
+        residuals = self._split(x - self.coarse[assign(x, self.coarse)])
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j], self.KSUB, seed=self.seed + j) for j in range(self.m)])
+        if self.codebooks.shape[1] < self.KSUB:
+            # Fewer training points than codewords, pad with unreachable entries
+            pad = self.KSUB - self.codebooks.shape[1]
+            self.codebooks = np.pad(self.codebooks, ((0, 0), (0, pad), (0, 0)), constant_values=np.inf)
+        self._codes = [[] for _ in range(self.nlist)]
+        self._ids = [[] for _ in range(self.nlist)]
+        pending, self._pending, self._pending_rows = self._pending, [], 0
+        for vectors, ids in pending:
+            self._insert(vectors, ids)
+
+    def _ensure_trained(self) -> None:
+        if not self.is_trained:
+            if not self._pending:
+                raise ValueError("The index is empty")
+            print(f"Training on the {self._pending_rows} buffered vectors (min_train is {self.min_train})")
+            self.train()
+
+    def _encode(self, residuals: np.ndarray) -> np.ndarray:
+        sub = self._split(residuals)
+        codes = np.empty((residuals.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            finite = np.isfinite(self.codebooks[j, :, 0])
+            codes[:, j] = assign(sub[:, j], self.codebooks[j][finite])
+        return codes
+
+    def add(self, x: np.ndarray, ids: Optional[np.ndarray] = None, block=16384) -> np.ndarray:
+        """Insert vectors, buffered until `min_train` have arrived if the index is not trained yet
+
+        Args:
+            x (np.ndarray): (N x dim) vectors, memmaps are read block by block.
+            ids (Optional[np.ndarray], optional): Ids to return from `query`. Defaults to
+                consecutive ids continuing from the last insert (store row ids).
+
+        Returns:
+            np.ndarray: Ids of the inserted vectors.
+        """
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + x.shape[0], dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        self._next_id = max(self._next_id, int(ids.max()) + 1) if len(ids) else self._next_id
+        if self.is_trained:
+            self._insert(x, ids, block)
+        else:
+            # Only the first `min_train` rows are copied, the rest is inserted block by block
+            take = min(len(ids), self.min_train - self._pending_rows)
+            self._pending.append((np.array(x[:take], dtype=np.float32), ids[:take]))
+            self._pending_rows += take
+            if self._pending_rows >= self.min_train:
+                self.train()
+                self._insert(x[take:], ids[take:], block)
+        return ids
+
+    def _insert(self, x: np.ndarray, ids: np.ndarray, block=16384) -> None:
+        for start in range(0, x.shape[0], block):
+            chunk = self._prepare(x[start:start + block])
+            chunk_ids = ids[start:start + block]
+            lists = assign(chunk, self.coarse)
+            codes = self._encode(chunk - self.coarse[lists])
+            for lst in np.unique(lists):
+                sel = lists == lst
+                self._codes[lst].append(codes[sel])
+                self._ids[lst].append(chunk_ids[sel])
+
+    def _list(self, lst: int) -> tuple[np.ndarray, np.ndarray]:
+        # Merge chunks from incremental inserts lazily, on first read
+        if len(self._codes[lst]) > 1:
+            self._codes[lst] = [np.concatenate(self._codes[lst])]
+            self._ids[lst] = [np.concatenate(self._ids[lst])]
+        if not self._codes[lst]:
+            return np.empty((0, self.m), dtype=np.uint8), np.empty(0, dtype=np.int64)
+        return self._codes[lst][0], self._ids[lst][0]
+
+    def query(self, q: np.ndarray, k=10, nprobe=8, rerank: Optional[np.ndarray] = None
+              ) -> tuple[np.ndarray, np.ndarray]:
+        """k approximate nearest neighbours for each query row
+
+        Args:
+            q (np.ndarray): (Q x dim) or (dim,) query vectors.
+            k (int, optional): Defaults to 10.
+            nprobe (int, optional): Coarse lists scanned per query. Defaults to 8.
+            rerank (Optional[np.ndarray], optional): Full (N x dim) matrix indexed by id.
+                When given, the best `4 * k` candidates are re-scored exactly.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (Q x k) ids (-1 when fewer are found) and scores,
+                cosine similarity or euclidean distance, best first.
+        """
+        self._ensure_trained()
+        q = self._prepare(q)
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argsort(_sq_distances(q, self.coarse), axis=1)[:, :nprobe]
+        out_ids = np.full((q.shape[0], k), -1, dtype=np.int64)
+        out_scores = np.full((q.shape[0], k), np.nan, dtype=np.float32)
+        sub_index = np.arange(self.m)[None, :]
+        for row, query in enumerate(q):
+            cand_dist = []
+            cand_ids = []
+            for lst in probes[row]:
+                codes, ids = self._list(lst)
+                if not len(ids):
+                    continue
+                residual = self._split((query - self.coarse[lst])[None, :])[0]
+                diff = self.codebooks - residual[:, None, :]
+                tables = np.einsum("jkd,jkd->jk", diff, diff)
+                cand_dist.append(tables[sub_index, codes].sum(axis=1))
+                cand_ids.append(ids)
+            if not cand_ids:
+                continue
+            dist = np.concatenate(cand_dist)
+            ids = np.concatenate(cand_ids)
+            keep = min(len(ids), 4 * k if rerank is not None else k)
+            top = np.argpartition(dist, keep - 1)[:keep]
+            dist, ids = dist[top], ids[top]
+            if rerank is not None:
+                exact = self._prepare(rerank[np.sort(ids)])
+                exact = exact[np.argsort(np.argsort(ids))]
+                dist = np.einsum("ij,ij->i", exact - query, exact - query)
+            order = np.argsort(dist, kind="stable")[:k]
+            out_ids[row, :len(order)] = ids[order]
+            out_scores[row, :len(order)] = dist[order]
+
+        if self.metric == "cosine":
+            out_scores = 1 - out_scores / 2
+        else:
+            out_scores = np.sqrt(np.maximum(out_scores, 0))
+        return out_ids, out_scores
+
+    def save(self, path: str) -> None:
+        self._ensure_trained()
+        lists = [self._list(lst) for lst in range(self.nlist)]
+        meta = {
+            "nlist": self.nlist, "m": self.m, "metric": self.metric, "dim": self.dim,
+            "train_size": self.train_size, "seed": self.seed, "next_id": self._next_id,
+        }
+        np.savez(
+            path,
+            meta=np.array(json.dumps(meta)),
+            coarse=self.coarse,
+            codebooks=self.codebooks,
+            offsets=np.cumsum([0] + [len(ids) for _, ids in lists]),
+            codes=np.concatenate([codes for codes, _ in lists]),
+            ids=np.concatenate([ids for _, ids in lists]),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ivf_pq_index":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            index = cls(meta["nlist"], meta["m"], meta["metric"], meta["train_size"], meta["seed"])
+            index.dim = meta["dim"]
+            index._next_id = meta["next_id"]
+            index.coarse = data["coarse"]
+            index.codebooks = data["codebooks"]
+            offsets, codes, ids = data["offsets"], data["codes"], data["ids"]
+        index._codes = [[codes[a:b]] for a, b in zip(offsets[:-1], offsets[1:])]
+        index._ids = [[ids[a:b]] for a, b in zip(offsets[:-1], offsets[1:])]
+        return index
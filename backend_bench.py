@@ -0,0 +1,37 @@
+import os
+import time
+
+from recognizer import danbooru_recognizer, tag_agreement
+
+# torch vs ONNX Runtime backend: throughput over public_test and tag agreement
+test_folder = "public_test/"
+num_threads = os.cpu_count()
+batch_sizes = (1, 4, 8)
+repeat = 3
+
+file_paths = [os.path.join(test_folder, x) for x in sorted(os.listdir(test_folder))]
+recognizers = {
+    "torch": danbooru_recognizer(num_threads=num_threads),
+    "onnx": danbooru_recognizer(num_threads=num_threads, backend="onnx"),
+}
+for recognizer in recognizers.values():
+    recognizer.load()
+
+print(f"{len(file_paths)} files, {num_threads} threads, best of {repeat} runs")
+results = {}
+for name, recognizer in recognizers.items():
+    for batch_size in batch_sizes:
+        best = float("inf")
+        for _ in range(repeat):
+            st = time.time()
+            res = recognizer.inference_gpu(file_paths, verbose=False, output_dump="", batch_size=batch_size)
+            best = min(best, time.time() - st)
+        results[name] = res
+        print(f"{name:<6} ({recognizer.device}, {recognizer.precision}) batch {batch_size}: "
+              f"{len(file_paths) / best:.2f} files/s")
+
+agreement = tag_agreement(results["torch"], results["onnx"])
+print(f"onnx vs torch: identical {agreement['identical']}/{agreement['files']}, "
+      f"jaccard {agreement['jaccard']:.4f}, max diff {agreement['max_diff']:.4f}")
+for file_path, missing, extra in agreement["changed"]:
+    print(f"    {file_path}: -{missing} +{extra}")
@@ -0,0 +1,208 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable
+
+# Benchmarks the model on CPU even where CUDA is available
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import numpy as np
+
+import frames
+import synthetic
+from classifier import compiled_classifier
+from similarity_engine import top_k_similar
+from sort_to_folder import init_extractors
+
+# Extractors, classification, decode+resize, model forward and similarity on
+# synthetic data. Every metric is the best-of-`repeat` seconds for a fixed
+# workload, so lower is better everywhere and runs compare directly. A single
+# run is too noisy for `tolerance`, so workloads are sized to afford `repeat`
+# runs each.
+output_path = "bench_results.json"
+baseline_path = ""  # an earlier output_path to compare with, or pass it as the first argument
+tolerance = 0.10  # slower than the baseline by more than this is flagged
+sections = ("extractors", "classify", "decode", "inference", "similarity")
+repeat = 3
+seed = 0
+
+names_n = 200_000
+extractor_names_n = 100_000
+image_dir = "bench_data/images"
+images_per_kind = 2
+decode_size = (512, 512)
+batch_sizes = (1, 4, 8, 16)
+forward_rows = 16
+num_threads = os.cpu_count()
+similarity_ns = (1_000, 5_000, 10_000)
+similarity_dim = 9176
+
+
+def best_of(function: Callable[[], object], repeat=repeat) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        st = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+def record(results: dict, name: str, seconds: float, items: int, unit: str):
+    results[name] = {"seconds": seconds, "items": items, "unit": unit}
+    print(f"    {name:<45} {seconds:>9.4f}s  {items / max(seconds, 1e-12):>12.1f} {unit}/s")
+
+
+def bench_extractors(results: dict):
+    names = synthetic.synthetic_names(extractor_names_n, seed)
+    for extr in init_extractors():
+        def test_all():
+            for name in names:
+                try:
+                    extr.test(name)
+                except Exception:
+                    pass
+        record(results, f"extractor/{type(extr).__name__}", best_of(test_all), len(names), "names")
+
+
+def bench_classify(results: dict):
+    names = synthetic.synthetic_names(names_n, seed)
+    extractors = init_extractors()
+    classifier = compiled_classifier(extractors)
+
+    def chain():
+        for name in names:
+            for extr in extractors:
+                try:
+                    if extr.test(name):
+                        break
+                except Exception:
+                    pass
+
+    def compiled():
+        for name in names:
+            try:
+                classifier.match(name)
+            except Exception:
+                pass
+
+    record(results, "classify/chain", best_of(chain), len(names), "names")
+    record(results, "classify/compiled", best_of(compiled), len(names), "names")
+
+
+def bench_decode(results: dict):
+    kinds = synthetic.write_images(image_dir, images_per_kind, seed=seed)
+    for (fmt, size), paths in kinds.items():
+        for reduced in (False, True):
+            if fmt == "gif" and reduced:
+                continue
+            if fmt == "gif":
+                def decode():
+                    for path in paths:
+                        frames.sample_frames(path, size=decode_size)
+            else:
+                def decode():
+                    for path in paths:
+                        frames.load_image(path, decode_size, reduced=reduced)
+            label = f"decode/{fmt}/{size[0]}x{size[1]}" + ("/reduced" if reduced else "")
+            record(results, label, best_of(decode), len(paths), "images")
+
+
+def bench_inference(results: dict):
+    from recognizer import danbooru_recognizer
+
+    recognizer = danbooru_recognizer(num_threads=num_threads)
+    recognizer.load()
+    rng = np.random.default_rng(seed)
+    rows = rng.random((forward_rows, recognizer.SIZE, recognizer.SIZE, 3), dtype=np.float32)
+    recognizer._predict_batch(rows[:1])  # warm up
+    for batch_size in batch_sizes:
+        def forward():
+            for start in range(0, forward_rows, batch_size):
+                recognizer._predict_batch(rows[start:start + batch_size])
+        record(results, f"inference/{recognizer.device}/{recognizer.precision}/batch_{batch_size}",
+               best_of(forward), forward_rows, "images")
+
+
+def bench_similarity(results: dict):
+    for n in similarity_ns:
+        matrix = synthetic.synthetic_results(n, similarity_dim, seed=seed)
+        for metric in ("cosine", "euclidean"):
+            record(results, f"similarity/{metric}/n_{n}", best_of(lambda: top_k_similar(matrix, 1, metric)), n, "rows")
+
+
+SECTIONS = {
+    "extractors": bench_extractors,
+    "classify": bench_classify,
+    "decode": bench_decode,
+    "inference": bench_inference,
+    "similarity": bench_similarity,
+}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance=tolerance) -> list[tuple[str, float]]:
+    """Print every metric against the baseline, returns the (name, ratio) pairs slower than 1 + tolerance"""
+    regressions = []
+    print(f"Against {baseline['environment'].get('commit') or 'baseline'} ({baseline['environment']['time']}):")
+    for name, metric in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"    {name:<45} new")
+            continue
+        ratio = metric["seconds"] / max(baseline["results"][name]["seconds"], 1e-12)
+        if ratio > 1 + tolerance:
+            flag = "REGRESSION"
+            regressions.append((name, ratio))
+        elif ratio < 1 - tolerance:
+            flag = "faster"
+        else:
+            flag = ""
+        print(f"    {name:<45} {ratio:>6.2f}x {flag}")
+    missing = baseline["results"].keys() - current["results"].keys()
+    if missing:
+        print(f"    {len(missing)} baseline metrics were not run")
+    return regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        baseline_path = sys.argv[1]
+    current = {"environment": environment(), "results": {}}
+    print(f"{current['environment']['commit']} on {current['environment']['processor'] or platform.machine()}, "
+          f"{current['environment']['cpu_count']} cpus")
+    for section in sections:
+        print(f"{section}:")
+        try:
+            SECTIONS[section](current["results"])
+        except Exception as e:
+            # A missing model or library only skips its own section
+            print(f"    skipped: {type(e).__name__}: {e}")
+
+    with open(output_path, "w", encoding="utf8") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {output_path}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf8") as f:
+            regressions = compare(json.load(f), current)
+        if regressions:
+            print(f"{len(regressions)} regressions over {tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,310 @@
+import datetime
+import json
+import os
+import sqlite3
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from embedding_cache import hash_file
+from sinks import result_sink
+
+# Extractor result fields copied to indexed columns, by column: result keys in priority order
+PROMOTED = {
+    "post_id": ("post_id", "id"),
+    "page": ("page",),
+    "artist": ("artist",),
+    "timestamp": ("datetime",),
+    "link": ("link",),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id    INTEGER PRIMARY KEY,
+    path  TEXT NOT NULL UNIQUE,
+    size  INTEGER,
+    mtime INTEGER,
+    hash  TEXT
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files(hash);
+
+CREATE TABLE IF NOT EXISTS classifications (
+    file_id      INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    gallery_type TEXT NOT NULL,
+    post_id      TEXT,
+    page         INTEGER,
+    artist       TEXT,
+    timestamp    TEXT,
+    link         TEXT,
+    fields       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS classifications_type_artist ON classifications(gallery_type, artist);
+CREATE INDEX IF NOT EXISTS classifications_type_post ON classifications(gallery_type, post_id);
+CREATE INDEX IF NOT EXISTS classifications_artist ON classifications(artist);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    rating  TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tags (
+    id       INTEGER PRIMARY KEY,
+    name     TEXT NOT NULL UNIQUE,
+    category TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS file_tags (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    tag_id  INTEGER NOT NULL REFERENCES tags(id),
+    PRIMARY KEY (file_id, tag_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS file_tags_tag ON file_tags(tag_id, file_id);
+"""
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _promote(result: dict) -> list:
+    row = []
+    for column, keys in PROMOTED.items():
+        value = next((result[key] for key in keys if result.get(key) not in (None, "", [])), None)
+        if column == "page":
+            value = int(value) if isinstance(value, str) and value.isdigit() else None
+        elif isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        elif isinstance(value, (list, tuple)):
+            value = "_".join(map(str, value))
+        elif value is not None:
+            value = str(value)
+        row.append(value)
+    return row
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class catalog:
+    """Queryable SQLite (WAL) catalog of files, filename classifications and tags
+
+    Every write method takes an iterable and commits it in transactions of
+    `batch_size` rows with `executemany`. The extractor result is kept whole as
+    JSON, and its common fields (post/illust id, page, artist, timestamp, link)
+    are copied to indexed columns, so lookups like all pixiv posts of an artist
+    are index seeks instead of a folder walk.
+
+    Files are keyed by absolute path, so relative and absolute spellings of
+    the same file share one row. `sort_to_folder` records classifications
+    under the path a file is moved to, so tags of a gallery that is going to
+    be sorted should be recorded after sorting. Tags recorded before that stay
+    on the pre-move path until the files are tagged again at their new paths.
+
+    Usage:
+        ```
+        db = catalog("catalog.sqlite")
+        db.add_files(file_paths, hash_files=True)
+        db.add_classifications((path, extr.gallery_type, result) for ...)
+        recognizer.inference_stream(file_paths, sinks=[catalog_sink(db)])
+        db.find("pixiv_id", artist="mineori")
+        db.find(tags=["1girl", "hatsune_miku"])
+        ```
+    """
+    def __init__(self, db_path="catalog.sqlite", batch_size=5000) -> None:
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._tag_ids: dict[str, int] = dict(self._conn.execute("SELECT name, id FROM tags"))
+
+    # Writes
+
+    def _upsert_files(self, rows: list[tuple[str, Optional[int], Optional[int], Optional[str]]]) -> dict[str, int]:
+        """(path, size, mtime, hash) rows in the current transaction, returns {path as given: file id}
+
+        Paths are stored absolute. A known hash is kept while size and mtime are
+        unchanged and dropped otherwise.
+        """
+        paths = [row[0] for row in rows]
+        rows = [(os.path.abspath(path), *rest) for path, *rest in rows]
+        self._conn.executemany("""
+            INSERT INTO files(path, size, mtime, hash) VALUES (?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                hash = CASE
+                    WHEN excluded.hash IS NOT NULL THEN excluded.hash
+                    WHEN excluded.size IS NULL OR (excluded.size IS files.size AND excluded.mtime IS files.mtime)
+                        THEN files.hash
+                    END,
+                size = coalesce(excluded.size, files.size),
+                mtime = coalesce(excluded.mtime, files.mtime)
+        """, rows)
+        ids = {}
+        for chunk in _chunks([row[0] for row in rows], 900):
+            ids.update(self._conn.execute(
+                f"SELECT path, id FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+        return {path: ids[os.path.abspath(path)] for path in paths}
+
+    def add_files(self, file_paths: Iterable[str], hash_files=False) -> int:
+        """Record path, size and mtime, and the SHA-1 with `hash_files` (skipped for unchanged files)"""
+        count = 0
+        for chunk in _chunks(file_paths, self.batch_size):
+            known = {}
+            if hash_files:
+                for sub in _chunks([os.path.abspath(path) for path in chunk], 900):
+                    known.update((path, (size, mtime, hash_)) for path, size, mtime, hash_ in self._conn.execute(
+                        f"SELECT path, size, mtime, hash FROM files WHERE path IN ({','.join('?' * len(sub))})", sub))
+            rows = []
+            for file_path in chunk:
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                file_hash = None
+                if hash_files:
+                    size, mtime, file_hash = known.get(os.path.abspath(file_path), (None, None, None))
+                    if file_hash is None or (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+                        file_hash = hash_file(file_path)
+                rows.append((file_path, stat.st_size, stat.st_mtime_ns, file_hash))
+            with self._conn:
+                self._upsert_files(rows)
+            count += len(rows)
+        return count
+
+    def add_classifications(self, entries: Iterable[tuple[str, Optional[str], dict]],
+                            stats: Optional[dict[str, tuple[int, int]]] = None) -> int:
+        """Record (path, gallery type or None for unmatched, extractor result) entries
+
+        Args:
+            stats (Optional[dict[str, tuple[int, int]]], optional): (size, mtime) by path, for
+                paths that cannot be stat'ed right now (e.g. while being moved).
+        """
+        count = 0
+        for chunk in _chunks(entries, self.batch_size):
+            file_rows = []
+            for path, _, _ in chunk:
+                size, mtime = (stats or {}).get(path, (None, None))
+                if size is None and os.path.exists(path):
+                    stat = os.stat(path)
+                    size, mtime = stat.st_size, stat.st_mtime_ns
+                file_rows.append((path, size, mtime, None))
+            with self._conn:
+                ids = self._upsert_files(file_rows)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(ids[path], gallery_type or "is_unknown", *_promote(result),
+                      json.dumps(result, ensure_ascii=False, default=_json_default))
+                     for path, gallery_type, result in chunk])
+            count += len(chunk)
+        return count
+
+    def _tag_id_rows(self, names: Iterable[tuple[str, str]]) -> None:
+        new = [(name, category) for name, category in set(names) if name not in self._tag_ids]
+        if new:
+            self._conn.executemany("INSERT OR IGNORE INTO tags(name, category) VALUES (?, ?)", new)
+            for chunk in _chunks([name for name, _ in new], 900):
+                self._tag_ids.update(self._conn.execute(
+                    f"SELECT name, id FROM tags WHERE name IN ({','.join('?' * len(chunk))})", chunk))
+
+    def add_tags(self, res_dicts: Iterable[dict]) -> int:
+        """Record recognizer result dicts (Filepath, General, Character, Rating), replacing earlier tags"""
+        count = 0
+        for chunk in _chunks(res_dicts, self.batch_size):
+            with self._conn:
+                ids = self._upsert_files([(res_dict["Filepath"], None, None, None) for res_dict in chunk])
+                self._tag_id_rows((name, category) for res_dict in chunk
+                                  for category in ("General", "Character") for name in res_dict[category])
+                file_ids = [(ids[res_dict["Filepath"]],) for res_dict in chunk]
+                self._conn.executemany("DELETE FROM file_tags WHERE file_id = ?", file_ids)
+                self._conn.executemany("INSERT OR IGNORE INTO file_tags VALUES (?, ?)", [
+                    (ids[res_dict["Filepath"]], self._tag_ids[name]) for res_dict in chunk
+                    for category in ("General", "Character") for name in res_dict[category]])
+                self._conn.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?)", [
+                    (ids[res_dict["Filepath"]], res_dict["Rating"]) for res_dict in chunk])
+            count += len(chunk)
+        return count
+
+    def remove(self, file_paths: Iterable[str]) -> int:
+        count = 0
+        for chunk in _chunks(file_paths, self.batch_size):
+            with self._conn:
+                count += self._conn.executemany("DELETE FROM files WHERE path = ?",
+                                                [(os.path.abspath(path),) for path in chunk]).rowcount
+        return count
+
+    # Reads
+
+    def find(self, gallery_type: Optional[str] = None, tags: Iterable[str] = (),
+             rating: Optional[str] = None, **fields) -> list[tuple[str, dict]]:
+        """(path, extractor result) of files matching every given condition
+
+        Usage:
+            ```
+            db.find("pixiv_id", artist="mineori")
+            db.find("twitter_key", post_id="FxBb8csaAAsRcqm")
+            db.find(tags=["1girl", "smile"], rating="rating:safe")
+            ```
+
+        Args:
+            fields: Equality on the promoted columns: post_id, page, artist, timestamp, link.
+        """
+        unknown = fields.keys() - PROMOTED.keys()
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)}, expected some of {list(PROMOTED)}")
+        where = []
+        params = []
+        if gallery_type is not None:
+            where.append("c.gallery_type = ?")
+            params.append(gallery_type)
+        for column, value in fields.items():
+            where.append(f"c.{column} = ?")
+            params.append(value)
+        if rating is not None:
+            where.append("f.id IN (SELECT file_id FROM ratings WHERE rating = ?)")
+            params.append(rating)
+        for tag in tags:
+            where.append("f.id IN (SELECT file_id FROM file_tags WHERE tag_id = ?)")
+            params.append(self._tag_ids.get(tag, -1))
+        sql = "SELECT f.path, c.fields FROM files f LEFT JOIN classifications c ON c.file_id = f.id"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return [(path, json.loads(result) if result else {}) for path, result in self._conn.execute(sql, params)]
+
+    def tags_of(self, path: str) -> list[str]:
+        return [name for name, in self._conn.execute("""
+            SELECT t.name FROM files f JOIN file_tags ft ON ft.file_id = f.id JOIN tags t ON t.id = ft.tag_id
+            WHERE f.path = ?""", (os.path.abspath(path),))]
+
+    def duplicates(self) -> list[list[str]]:
+        """Paths sharing a content hash"""
+        groups: dict[str, list[str]] = {}
+        for file_hash, path in self._conn.execute("""
+                SELECT hash, path FROM files WHERE hash IN
+                (SELECT hash FROM files WHERE hash IS NOT NULL GROUP BY hash HAVING count(*) > 1)"""):
+            groups.setdefault(file_hash, []).append(path)
+        return list(groups.values())
+
+    def query(self, sql: str, params: Iterable = ()) -> list[tuple]:
+        return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class catalog_sink(result_sink):
+    """Writes `inference_stream` results to a catalog's tag tables"""
+    def __init__(self, db: catalog) -> None:
+        self.db = db
+
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        self.db.add_tags(res_dict for _, _, res_dict in batch)
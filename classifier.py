@@ -0,0 +1,160 @@
+import re
+from typing import Callable, Optional
+
+from extractor import *
+
+
+class candidate_spec:
+    """Cheap necessary condition for an extractor to match
+
+    An extractor is a candidate when the name starts with one of `prefixes`,
+    contains `pattern`, or passes `fallback`, and always passes `guard`.
+    Every spec must be a superset of what the extractor's `test` accepts
+    (and of what makes it raise), so skipping non-candidates never changes
+    the result of the ordered chain.
+    """
+    def __init__(self, prefixes: tuple[str, ...] = (), pattern: Optional[str] = None,
+                 fallback: Optional[Callable[[str], bool]] = None,
+                 guard: Optional[Callable[[str], bool]] = None) -> None:
+        self.prefixes = prefixes
+        self.pattern = pattern
+        self.fallback = fallback
+        self.guard = guard
+
+
+def _escape_all(words) -> str:
+    return "|".join(re.escape(word) for word in words)
+
+
+def spec_for(extr: is_gallery_type) -> Optional[candidate_spec]:
+    """Spec built from the extractor's own prefixes/patterns
+
+    Returns None for any other type, subclasses included, which makes that
+    extractor a candidate for every name.
+    """
+    if type(extr) is is_tagged_string:
+        return candidate_spec(pattern=_escape_all((extr.deviant_art_sep, extr._artist)))
+    if type(extr) is is_4chan_timestamp:
+        # Up to `_delimiter_thres` segments, one of them a 10/13/16 digit timestamp.
+        # str.isnumeric also accepts non-ASCII numerals, so those names always go through.
+        delimiter = re.escape(extr._delimiter)
+        return candidate_spec(
+            pattern=rf"(?:^|{delimiter})(?:\d{{16}}|\d{{13}}|\d{{10}})(?:{delimiter}|$)",
+            fallback=lambda s: not s.isascii(),
+            guard=lambda s: s.count(extr._delimiter) < extr._delimiter_thres)
+    if type(extr) is is_pixiv_post:
+        return candidate_spec(
+            prefixes=(*extr.prefixes["page"], extr.prefixes["illust"]),
+            pattern=r"p\d")  # both page_pattern and pattern need a "p<digit>"
+    if type(extr) in (is_yandere_post, is_gelbooru_post):
+        return candidate_spec(prefixes=(extr.prefix,))
+    if type(extr) is is_hash_string:
+        return candidate_spec(pattern="|".join(regex.pattern for regex in extr.patterns))
+    if type(extr) is is_release_shot:
+        return candidate_spec(pattern=_escape_all(extr.magic_words))
+    if type(extr) is is_soundfile_post:
+        return candidate_spec(pattern=re.escape(extr._dl_prefix))
+    if type(extr) is is_not_ASCII:
+        return candidate_spec(fallback=lambda s: not s.isascii())
+    if type(extr) is is_manga_page:
+        return candidate_spec(pattern=r"\s-\sc\d|" + _escape_all(extr.magic_words))
+    if type(extr) is is_meaningful_text:
+        # Needs at least 3 ASCII letters whichever branch matches
+        return candidate_spec(
+            pattern=r"[A-Za-z](?:[^A-Za-z]*[A-Za-z]){2}",
+            guard=lambda s: not s.startswith(extr.twitter_prefix))
+    if type(extr) is is_photo:
+        return candidate_spec(prefixes=(
+            *extr.prefixes["img"], extr.prefixes["img_dt"], extr.prefixes["fb"], extr.prefixes["photo"]))
+    if type(extr) is is_screen_shot:
+        return candidate_spec(
+            prefixes=tuple(extr.prefixes.values()),
+            pattern=f"(?i:{extr.pattern.pattern.removeprefix('(.*?)')})")
+    if type(extr) is is_date_time:
+        return candidate_spec(pattern="|".join(regex.pattern for regex in extr.patterns.values()))
+    if type(extr) is is_site_from:
+        return candidate_spec(prefixes=tuple(extr.site_prefixes.values()))
+    if type(extr) is is_misc_semirandom:
+        return candidate_spec(
+            prefixes=(*extr.prefixes["sample"], *extr.prefixes["ezgif"], *extr.prefixes["default"]),
+            fallback=lambda s: s[:extr.pixiv_id_len].isnumeric() and s[0] != "0")
+    if type(extr) is is_twitter_key:
+        def fallback(s: str) -> bool:
+            stripped = s.strip()
+            return len(s) >= extr.length \
+                or stripped.startswith(extr.possible_prefix) \
+                or stripped.endswith(extr.possible_suffixes)
+        return candidate_spec(pattern=extr.special_pattern.pattern, fallback=fallback)
+    return None
+
+
+class compiled_classifier:
+    """Single-pass replacement for walking an ordered list of extractors
+
+    All prefixes go into one trie that is walked once per name, and all
+    patterns into one alternation that tells in a single search whether any
+    pattern occurs at all. Each extractor is then only a candidate if its
+    prefix was hit, its own pattern matches (checked only when the alternation
+    hit), or its fallback passes. Only candidates run their detailed `test`,
+    still in chain order, so the first non-empty result is exactly what the
+    ordered chain returns.
+
+    Usage:
+        ```
+        classifier = compiled_classifier(init_extractors())
+        extr, result = classifier.match(filename)
+        ```
+    """
+    def __init__(self, extractors: list[is_gallery_type]) -> None:
+        self.extractors = extractors
+        self.specs = [spec_for(extr) for extr in extractors]
+
+        self.trie: dict = {}
+        for i, spec in enumerate(self.specs):
+            for prefix in spec.prefixes if spec else ():
+                node = self.trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(i)
+
+        patterns = [spec.pattern for spec in self.specs if spec and spec.pattern]
+        self.any_pattern = re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+        self.patterns = [re.compile(spec.pattern) if spec and spec.pattern else None for spec in self.specs]
+
+    def prefix_hits(self, string: str) -> set[int]:
+        found = set()
+        node = self.trie
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            found.update(node.get(None, ()))
+        return found
+
+    def candidates(self, string: str) -> list[int]:
+        """Indices of the extractors that may match, in chain order"""
+        prefix_hits, any_pattern = self._scan(string)
+        return [i for i in range(len(self.extractors))
+                if self._is_candidate(i, string, prefix_hits, any_pattern)]
+
+    def _scan(self, string: str) -> tuple[set[int], bool]:
+        any_pattern = self.any_pattern is not None and self.any_pattern.search(string) is not None
+        return self.prefix_hits(string), any_pattern
+
+    def _is_candidate(self, i: int, string: str, prefix_hits: set[int], any_pattern: bool) -> bool:
+        spec = self.specs[i]
+        if spec is None:
+            return True
+        if spec.guard is not None and not spec.guard(string):
+            return False
+        return i in prefix_hits \
+            or any_pattern and self.patterns[i] is not None and self.patterns[i].search(string) is not None \
+            or spec.fallback is not None and spec.fallback(string)
+
+    def match(self, string: str) -> tuple[Optional[is_gallery_type], dict]:
+        """(matching extractor, its result) or (None, {}) like the end of the chain"""
+        prefix_hits, any_pattern = self._scan(string)
+        for i, extr in enumerate(self.extractors):
+            if self._is_candidate(i, string, prefix_hits, any_pattern) and (result := extr.test(string)):
+                return extr, result
+        return None, {}
@@ -0,0 +1,57 @@
+import os
+import time
+
+from classifier import compiled_classifier
+from sort_to_folder import init_extractors
+from synthetic import synthetic_names
+
+# Ordered extractor chain vs compiled_classifier: identical output check and timing
+dump_file_path = "public_path_dump.txt"
+synthetic_n = 1_000_000
+seed = 0
+
+
+def run_chain(extractors, name):
+    for extr in extractors:
+        if result := extr.test(name):
+            return extr.gallery_type, result
+    return None, {}
+
+
+def run_compiled(classifier, name):
+    extr, result = classifier.match(name)
+    return (extr.gallery_type if extr else None), result
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e).__name__
+
+
+def bench(label: str, names: list[str]):
+    extractors = init_extractors()
+    classifier = compiled_classifier(extractors)
+
+    st = time.time()
+    chain_results = [outcome(run_chain, extractors, name) for name in names]
+    chain_time = time.time() - st
+
+    st = time.time()
+    compiled_results = [outcome(run_compiled, classifier, name) for name in names]
+    compiled_time = time.time() - st
+
+    mismatches = [(name, a, b) for name, a, b in zip(names, chain_results, compiled_results) if a != b]
+    print(f"{label}: {len(names)} names")
+    print(f"    chain:    {chain_time:.2f}s ({len(names) / max(chain_time, 1e-9):.0f} names/s)")
+    print(f"    compiled: {compiled_time:.2f}s ({len(names) / max(compiled_time, 1e-9):.0f} names/s)")
+    print(f"    speedup:  {chain_time / max(compiled_time, 1e-9):.2f}x, mismatches: {len(mismatches)}")
+    for name, a, b in mismatches[:10]:
+        print(f"        {name!r}: chain={a} compiled={b}")
+
+
+if os.path.isfile(dump_file_path):
+    with open(dump_file_path, "r", encoding="utf8") as f:
+        bench(dump_file_path, [os.path.splitext(x.strip())[0] for x in f.readlines()])
+bench("synthetic", synthetic_names(synthetic_n, seed))
@@ -0,0 +1,43 @@
+import os
+import time
+
+from recognizer import danbooru_recognizer, tag_agreement
+from torch_backend import cpu_supports_bf16
+
+# CPU execution settings vs the fp32 reference: throughput and tag agreement
+test_folder = "public_test/"
+num_threads = os.cpu_count()
+batch_size = 4
+calibration_n = 8  # int8 is calibrated on the first files and evaluated on the rest
+settings = [
+    # (precision, channels_last)
+    ("fp32", False),
+    ("fp32", True),
+    ("bf16", True),
+    ("int8", True),
+]
+
+all_paths = [os.path.join(test_folder, x) for x in sorted(os.listdir(test_folder))]
+assert len(all_paths) > calibration_n, f"Needs more than {calibration_n} files in {test_folder}"
+calibration_paths, file_paths = all_paths[:calibration_n], all_paths[calibration_n:]
+print(f"{len(file_paths)} files ({len(calibration_paths)} more for calibration), {num_threads} threads, batch {batch_size}, native bf16: {cpu_supports_bf16()}")
+
+
+def run(precision: str, channels_last: bool):
+    recognizer = danbooru_recognizer(precision=precision, num_threads=num_threads, channels_last=channels_last)
+    assert recognizer.device == "cpu", "cpu_bench needs a CPU-only torch or CUDA_VISIBLE_DEVICES="
+    recognizer.load(calibration_paths=calibration_paths)
+    st = time.time()
+    res = recognizer.inference_gpu(file_paths, verbose=False, output_dump="", batch_size=batch_size)
+    return res, time.time() - st
+
+
+reference, reference_time = run("fp32", False)
+for precision, channels_last in settings:
+    res, elapsed = run(precision, channels_last)
+    agreement = tag_agreement(reference, res)
+    print(f"{precision:<12} channels_last={channels_last!s:<5} {len(file_paths) / elapsed:6.2f} files/s "
+          f"({reference_time / elapsed:.2f}x) identical {agreement['identical']}/{agreement['files']} "
+          f"jaccard {agreement['jaccard']:.4f} max diff {agreement['max_diff']:.4f}")
+    for file_path, missing, extra in agreement["changed"]:
+        print(f"    {file_path}: -{missing} +{extra}")
@@ -0,0 +1,42 @@
+import os
+import time
+
+import frames
+from recognizer import danbooru_recognizer, tag_agreement
+
+# Full-resolution decode vs reduced (JPEG draft) decode: timing and tag agreement
+test_folder = "public_test/"
+repeat = 5
+video_ext = ("gif", "webm", "mp4", "mov")
+
+file_paths = [os.path.join(test_folder, x) for x in sorted(os.listdir(test_folder))
+              if not x.endswith(video_ext)]
+
+
+def time_decode(reduced: bool) -> float:
+    st = time.time()
+    for _ in range(repeat):
+        for file_path in file_paths:
+            frames.load_image(file_path, reduced=reduced)
+    return (time.time() - st) / repeat
+
+
+full_time = time_decode(False)
+reduced_time = time_decode(True)
+print(f"{len(file_paths)} images, mean of {repeat} runs")
+print(f"    full:    {full_time:.3f}s ({len(file_paths) / max(full_time, 1e-9):.1f} images/s)")
+print(f"    reduced: {reduced_time:.3f}s ({len(file_paths) / max(reduced_time, 1e-9):.1f} images/s)")
+print(f"    speedup: {full_time / max(reduced_time, 1e-9):.2f}x")
+
+full = danbooru_recognizer(reduced_decode=False)
+full.load()
+reduced = danbooru_recognizer(reduced_decode=True)
+reduced.backend = full.backend
+full_res = full.inference_gpu(file_paths, verbose=False, output_dump="")
+reduced_res = reduced.inference_gpu(file_paths, verbose=False, output_dump="")
+
+agreement = tag_agreement(full_res, reduced_res)
+for file_path, missing, extra in agreement["changed"]:
+    print(f"    {file_path}: -{missing} +{extra}")
+print(f"identical tags: {agreement['identical']}/{agreement['files']}, mean jaccard {agreement['jaccard']:.4f}, "
+      f"max probability diff {agreement['max_diff']:.4f}")
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+from typing import Iterable, Optional
+
+import numpy as np
+from PIL import Image
+
+import frames
+
+HASH_KINDS = ("ahash", "dhash", "phash")
+VIDEO_EXT = ("webm", "mp4", "mov")
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.reshape(-1)).tobytes(), "big")
+
+
+def _grayscale(image: Image.Image, size: tuple[int, int]) -> np.ndarray:
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n)).astype(np.float32)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def ahash(image: Image.Image) -> int:
+    """64-bit average hash: 8x8 grayscale pixels above their mean"""
+    pixels = _grayscale(image, (8, 8))
+    return _bits_to_int(pixels > pixels.mean())
+
+
+def dhash(image: Image.Image) -> int:
+    """64-bit difference hash: horizontal gradient signs of a 9x8 grayscale image"""
+    pixels = _grayscale(image, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Image.Image) -> int:
+    """64-bit perceptual hash: 8x8 lowest DCT frequencies of a 32x32 grayscale image above their median"""
+    pixels = _grayscale(image, (32, 32))
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8]
+    return _bits_to_int(low > np.median(low))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def hash_image(image: Image.Image) -> dict[str, int]:
+    return {
+        "ahash": ahash(image),
+        "dhash": dhash(image),
+        "phash": phash(image),
+    }
+
+
+def hash_file(file_path: str, n_frames=5) -> dict[str, int]:
+    """Hashes of an image, or of the mean of `n_frames` sampled frames for gifs and videos"""
+    if not file_path.endswith("gif") and not any(file_path.endswith(ext) for ext in VIDEO_EXT):
+        with Image.open(file_path) as img:
+            return hash_image(img)
+    sampled = frames.sample_frames(file_path, n_frames, (256, 256))
+    mean_frame = np.mean(sampled, axis=0).astype(np.uint8)
+    return hash_image(Image.fromarray(mean_frame))
+
+
+class bk_tree:
+    """Burkhard-Keller tree over 64-bit hashes with hamming distance
+
+    A radius search only descends into children whose edge distance is within
+    `radius` of the query distance (triangle inequality), so lookups touch a
+    small part of the tree instead of every stored hash.
+    """
+    def __init__(self) -> None:
+        self.root: Optional[list] = None  # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, value: int, item) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list[tuple[int, object]]:
+        """(distance, item) for every stored hash within `radius` of `value`"""
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def find_duplicates(hashes: Iterable[tuple[str, int]], radius=6) -> list[list[str]]:
+    """Group paths whose hashes are within `radius` bits of each other
+
+    Each hash is searched against the tree before being inserted, so every
+    candidate pair is found once and no all-pairs comparison is made.
+    Groups are the connected components of the near-duplicate pairs.
+
+    Returns:
+        list[list[str]]: Groups of two or more paths.
+    """
+    tree = bk_tree()
+    parent: dict[str, str] = {}
+
+    def find(x: str) -> str:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for path, value in hashes:
+        parent[path] = path
+        for _, other in tree.search(value, radius):
+            root_a, root_b = find(path), find(other)
+            if root_a != root_b:
+                parent[root_a] = root_b
+        tree.add(value, path)
+
+    groups: dict[str, list[str]] = {}
+    for path in parent:
+        groups.setdefault(find(path), []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+class hash_db:
+    """Persistent per-file hashes, recomputed only when (size, mtime) changes
+
+    Usage:
+        ```
+        db = hash_db("hashes.sqlite")
+        db.update(file_paths)
+        db.prune()                          # forget files moved or deleted since
+        groups = find_duplicates(db.items("phash"), radius=6)
+        ```
+    """
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path  TEXT PRIMARY KEY,
+                size  INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                ahash TEXT NOT NULL,
+                dhash TEXT NOT NULL,
+                phash TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def update(self, file_paths: Iterable[str], verbose=False) -> int:
+        """Hash new or changed files, returns how many were hashed"""
+        known = {path: (size, mtime) for path, size, mtime
+                 in self._conn.execute("SELECT path, size, mtime FROM hashes")}
+        rows, missing = [], []
+        for file_path in file_paths:
+            path = os.path.abspath(file_path)
+            try:
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                hashes = hash_file(path)
+            except FileNotFoundError:
+                if path in known:
+                    missing.append((path,))
+                continue
+            except Exception as e:
+                print(f"Could not hash {path}: {e}")
+                continue
+            if verbose:
+                print(f"{len(rows):<3}| {path} {hashes}")
+            rows.append((path, stat.st_size, stat.st_mtime_ns,
+                         *(f"{hashes[kind]:016x}" for kind in HASH_KINDS)))
+        self._conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._conn.executemany("DELETE FROM hashes WHERE path = ?", missing)
+        self._conn.commit()
+        return len(rows)
+
+    def prune(self) -> int:
+        """Drop the rows of files that no longer exist, returns how many were dropped"""
+        missing = [(path,) for (path,) in self._conn.execute("SELECT path FROM hashes")
+                   if not os.path.isfile(path)]
+        self._conn.executemany("DELETE FROM hashes WHERE path = ?", missing)
+        self._conn.commit()
+        return len(missing)
+
+    def items(self, kind="phash") -> list[tuple[str, int]]:
+        if kind not in HASH_KINDS:
+            raise ValueError(f"Unknown hash {kind}, expected one of {HASH_KINDS}")
+        return [(path, int(value, 16)) for path, value
+                in self._conn.execute(f"SELECT path, {kind} FROM hashes")]
+
+    def close(self) -> None:
+        self._conn.close()
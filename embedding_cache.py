@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+def hash_file(file_path: str, chunk_size=1 << 20) -> str:
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class embedding_cache:
+    """On-disk cache of recognizer result vectors keyed by file content
+
+    Files are first matched on (path, size, mtime), which only costs a `stat`.
+    When that misses the content is hashed, so renamed/copied files and touched
+    but unchanged files still hit. Results are stored once per content hash.
+
+    Usage:
+        ```
+        cache = embedding_cache("danbooru_cache.sqlite")
+        res = recognizer.inference_gpu(file_paths, cache=cache)
+        cache.evict_missing()
+        cache.close()
+        ```
+    """
+    def __init__(self, db_path: str, commit_every=256) -> None:
+        """
+
+        Args:
+            db_path (str): SQLite file, created if missing.
+            commit_every (int, optional): Number of `put` calls between commits. Defaults to 256.
+        """
+        self.db_path = db_path
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._pending_hashes: dict[str, tuple[int, int, str]] = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path  TEXT PRIMARY KEY,
+                size  INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash  TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                hash  TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                data  BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_hash ON files(hash);
+        """)
+        self._conn.commit()
+
+    def _identity(self, file_path: str) -> tuple[str, int, int]:
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+    def _load_result(self, content_hash: str) -> Optional[np.ndarray]:
+        row = self._conn.execute(
+            "SELECT dtype, data FROM results WHERE hash = ?", (content_hash,)).fetchone()
+        if row is None:
+            return None
+        dtype, data = row
+        return np.frombuffer(data, dtype=dtype).copy()
+
+    def get(self, file_path: str) -> Optional[np.ndarray]:
+        """Cached result for `file_path`, or None when it has to be recognized"""
+        path, size, mtime = self._identity(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime)).fetchone()
+            if row is not None:
+                result = self._load_result(row[0])
+                if result is not None:
+                    return result
+
+        content_hash = hash_file(file_path)
+        with self._lock:
+            result = self._load_result(content_hash)
+            if result is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (path, size, mtime, content_hash))
+                self._tick()
+            else:
+                # Remember the hash so `put` does not read the file again
+                self._pending_hashes[path] = (size, mtime, content_hash)
+            return result
+
+    def put(self, file_path: str, result: np.ndarray) -> None:
+        path, size, mtime = self._identity(file_path)
+        with self._lock:
+            pending = self._pending_hashes.pop(path, None)
+        if pending is not None and pending[:2] == (size, mtime):
+            content_hash = pending[2]
+        else:
+            content_hash = hash_file(file_path)
+        result = np.ascontiguousarray(result)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (content_hash, result.dtype.str, result.tobytes()))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, size, mtime, content_hash))
+            self._tick()
+
+    def _tick(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def evict_missing(self) -> int:
+        """Drop entries for files that no longer exist and results no file points to
+
+        Returns:
+            int: Number of file entries removed.
+        """
+        with self._lock:
+            paths = [path for path, in self._conn.execute("SELECT path FROM files")]
+            missing = [(path,) for path in paths if not os.path.exists(path)]
+            self._conn.executemany("DELETE FROM files WHERE path = ?", missing)
+            self._conn.execute(
+                "DELETE FROM results WHERE hash NOT IN (SELECT hash FROM files)")
+            self._conn.commit()
+            self._uncommitted = 0
+        return len(missing)
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
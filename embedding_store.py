@@ -0,0 +1,234 @@
+import json
+import os
+import pickle
+import shutil
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+
+class embedding_store:
+    """Append-only columnar store for recognizer results
+
+    Replaces the single `list[tuple[np.ndarray, dict]]` pickle. The result
+    vectors live in one contiguous (N x dim) raw matrix that readers open with
+    `np.memmap`, so slicing rows does not copy or load the whole file. The
+    result dicts (Filepath, Character, General, Rating) go to a JSON Lines
+    sidecar with one line per row.
+
+    Layout of `store_dir`:
+        meta.json         {"dim": 9176, "dtype": "float16"}
+        embeddings.bin    raw row-major matrix
+        index.jsonl       one result dict per row
+
+    Usage:
+        ```
+        store = embedding_store("public_test_store", dtype="float16")
+        recognizer.inference_gpu(file_paths, store=store)
+        matrix = store.matrix()          # read-only memmap, zero copy
+        for result, res_dict in store.items():
+            ...
+        ```
+    """
+    META = "meta.json"
+    DATA = "embeddings.bin"
+    INDEX = "index.jsonl"
+
+    def __init__(self, store_dir: str, dim: Optional[int] = None, dtype="float32") -> None:
+        """
+
+        Args:
+            store_dir (str): Directory of the store, created if missing.
+            dim (Optional[int], optional): Row length. Taken from the first appended row
+                (or the existing store) when None.
+            dtype (str, optional): Storage dtype, "float32" or "float16". Ignored when the
+                store already exists. Defaults to "float32".
+        """
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.meta_path = os.path.join(store_dir, self.META)
+        self.data_path = os.path.join(store_dir, self.DATA)
+        self.index_path = os.path.join(store_dir, self.INDEX)
+
+        if os.path.isfile(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+        else:
+            self.dim = dim
+            self.dtype = np.dtype(dtype)
+            if dim is not None:
+                self._write_meta()
+
+        self._records: Optional[list[dict]] = None
+        self._count = self._recover()
+
+    def _write_meta(self) -> None:
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def _recover(self) -> int:
+        """Row count, trimming a row or index line left half-written by an interrupted append"""
+        if self.dim is None:
+            return 0
+        lines = [b""]
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "rb") as f:
+                lines = f.read().split(b"\n")
+        complete = lines[:-1]  # everything before the last newline
+        data_rows = os.path.getsize(self.data_path) // self.row_bytes if os.path.isfile(self.data_path) else 0
+        count = min(len(complete), data_rows)
+        if os.path.isfile(self.index_path) and (count != len(complete) or lines[-1]):
+            with open(self.index_path, "wb") as f:
+                f.write(b"".join(line + b"\n" for line in complete[:count]))
+        if os.path.isfile(self.data_path) and os.path.getsize(self.data_path) != count * self.row_bytes:
+            with open(self.data_path, "r+b") as f:
+                f.truncate(count * self.row_bytes)
+        return count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, result: np.ndarray, res_dict: dict) -> int:
+        """Append one result, returns its row id"""
+        return self.extend([(result, res_dict)])
+
+    def extend(self, results: Iterable[tuple[np.ndarray, dict]]) -> int:
+        """Append many results in one write, returns the row id of the last one"""
+        rows = []
+        lines = []
+        for result, res_dict in results:
+            result = np.asarray(result).reshape(-1)
+            if self.dim is None:
+                self.dim = result.shape[0]
+                self._write_meta()
+            if result.shape[0] != self.dim:
+                raise ValueError(f"Expected {self.dim} values, got {result.shape[0]}")
+            rows.append(result.astype(self.dtype, copy=False))
+            lines.append(json.dumps(res_dict, ensure_ascii=False))
+        if not rows:
+            return self._count - 1
+
+        with open(self.data_path, "ab") as data_file:
+            data_file.write(np.stack(rows).tobytes())
+        with open(self.index_path, "a", encoding="utf8") as index_file:
+            index_file.write("".join(line + "\n" for line in lines))
+
+        if self._records is not None:
+            self._records.extend(json.loads(line) for line in lines)
+        self._count += len(rows)
+        return self._count - 1
+
+    def sync(self) -> None:
+        """fsync the matrix and index so every appended row survives a crash or power loss"""
+        for path in (self.data_path, self.index_path):
+            if os.path.isfile(path):
+                with open(path, "rb+") as f:
+                    os.fsync(f.fileno())
+
+    def truncate(self, rows: int) -> None:
+        """Drop every row from `rows` on, e.g. results written after the last checkpoint"""
+        if rows >= self._count:
+            return
+        with open(self.index_path, "rb") as f:
+            lines = f.read().split(b"\n")[:rows]
+        with open(self.index_path, "wb") as f:
+            f.write(b"".join(line + b"\n" for line in lines))
+        with open(self.data_path, "r+b") as f:
+            f.truncate(rows * self.row_bytes)
+        self._count = rows
+        self._records = None
+
+    def matrix(self) -> np.ndarray:
+        """Read-only (N x dim) memmap over every stored row"""
+        if self._count == 0:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(self._count, self.dim))
+
+    def rows(self, start: int, stop: Optional[int] = None) -> np.ndarray:
+        """Zero-copy view of rows [start, stop)"""
+        return self.matrix()[start:stop]
+
+    def records(self) -> list[dict]:
+        if self._records is None:
+            if self._count == 0:
+                self._records = []
+                return self._records
+            with open(self.index_path, "r", encoding="utf8") as f:
+                self._records = [json.loads(line) for _, line in zip(range(self._count), f)]
+        return self._records
+
+    def file_paths(self) -> list[str]:
+        return [record["Filepath"] for record in self.records()]
+
+    def __getitem__(self, row: int) -> tuple[np.ndarray, dict]:
+        return self.matrix()[row], self.records()[row]
+
+    def items(self) -> Iterator[tuple[np.ndarray, dict]]:
+        """Same pairs as the old pickle, with the arrays being memmap views"""
+        matrix = self.matrix()
+        for row, record in enumerate(self.records()):
+            yield matrix[row], record
+
+    @classmethod
+    def from_pickle(cls, pickle_path: str, store_dir: str, dtype="float32") -> "embedding_store":
+        """Convert a pickle written by `danbooru_recognizer.dump_pickle`"""
+        with open(pickle_path, "rb") as f:
+            results = pickle.load(f)
+        store = cls(store_dir, dtype=dtype)
+        store.extend(results)
+        return store
+
+    @classmethod
+    def merge(cls, store_dirs: Iterable[str], out_dir: str, order: Optional[list[str]] = None,
+              chunk_rows=65536) -> "embedding_store":
+        """Consolidate stores of the same dim and dtype into a new store at `out_dir`
+
+        Without `order`, matrices and index lines are concatenated as raw bytes.
+        With `order`, rows are written in that Filepath order, gathered from the
+        memmaps `chunk_rows` at a time. Paths found in no store are skipped, and
+        for paths stored more than once the last store wins.
+        """
+        stores = [cls(store_dir) for store_dir in store_dirs]
+        stores = [store for store in stores if len(store)]
+        if not stores:
+            return cls(out_dir)
+        dim, dtype = stores[0].dim, stores[0].dtype
+        for store in stores:
+            if (store.dim, store.dtype) != (dim, dtype):
+                raise ValueError(f"{store.store_dir} is {store.dim}x{store.dtype}, expected {dim}x{dtype}")
+        merged = cls(out_dir, dim=dim, dtype=dtype.name)
+        if len(merged):
+            raise ValueError(f"{out_dir} already has {len(merged)} rows")
+
+        with open(merged.data_path, "ab") as data_file, open(merged.index_path, "ab") as index_file:
+            if order is None:
+                for store in stores:
+                    with open(store.data_path, "rb") as f:
+                        shutil.copyfileobj(f, data_file, 1 << 24)
+                    with open(store.index_path, "rb") as f:
+                        shutil.copyfileobj(f, index_file, 1 << 24)
+            else:
+                location = {}
+                for store_id, store in enumerate(stores):
+                    for row, file_path in enumerate(store.file_paths()):
+                        location[file_path] = (store_id, row)
+                found = [location[file_path] for file_path in order if file_path in location]
+                for start in range(0, len(found), chunk_rows):
+                    chunk = np.array(found[start:start + chunk_rows], dtype=np.int64).reshape(-1, 2)
+                    out = np.empty((len(chunk), dim), dtype=dtype)
+                    for store_id, store in enumerate(stores):
+                        mask = chunk[:, 0] == store_id
+                        if mask.any():
+                            out[mask] = store.matrix()[chunk[mask, 1]]
+                    data_file.write(out.tobytes())
+                    index_file.write("".join(json.dumps(stores[store_id].records()[row], ensure_ascii=False) + "\n"
+                                             for store_id, row in chunk).encode("utf8"))
+        return cls(out_dir)
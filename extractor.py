@@ -1,5 +1,8 @@
 import re
+import os
+import math
 import datetime
+from collections import OrderedDict
 from urllib.parse import unquote
 from typing import Optional
 
@@ -33,6 +36,68 @@ class datetime_processor:
             return ""
         return dt.strftime(self.date_format)
 
+class ngram_scorer:
+    """Letter-bigram log-probability of a name, learned from the DeepDanbooru tag lists
+    
+    Tags and character names (mostly English and romanized Japanese) give the
+    bigram table once at construction. A name scoring above `meaningful_thres`
+    or below `nonsense_thres` is settled here, anything in between (or with
+    fewer than `min_bigrams`) is left to nostril.
+
+    The default thresholds are a starting point, not a measured result: check
+    them with `meaningful_bench.py` (agreement with nostril on the names the
+    scorer settles) on real, held-out names before relying on them.
+    """
+    CORPUS = (
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "DeepDanbooru", "tags-general.txt"),
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "DeepDanbooru", "tags-character.txt"),
+    )
+    ALPHABET = "^abcdefghijklmnopqrstuvwxyz$"
+    
+    def __init__(self, corpus_paths: tuple[str, ...] = CORPUS,
+                 meaningful_thres=-3.4, nonsense_thres=-5.0, min_bigrams=8) -> None:
+        self.meaningful_thres = meaningful_thres
+        self.nonsense_thres = nonsense_thres
+        self.min_bigrams = min_bigrams
+        self.word_pattern = re.compile(r"[a-z]+")
+        
+        counts = {a + b: 0 for a in self.ALPHABET for b in self.ALPHABET}
+        totals = {a: 0 for a in self.ALPHABET}
+        for path in corpus_paths:
+            with open(path, "r", encoding="utf8") as f:
+                for word in self.word_pattern.findall(f.read().lower()):
+                    word = f"^{word}$"
+                    for bigram in zip(word, word[1:]):
+                        counts[bigram[0] + bigram[1]] += 1
+                        totals[bigram[0]] += 1
+        smoothing = 0.5
+        self.table = {
+            bigram: math.log2((count + smoothing) / (totals[bigram[0]] + smoothing * len(self.ALPHABET)))
+            for bigram, count in counts.items()
+        }
+    
+    def score(self, string: str) -> tuple[float, int]:
+        """(mean bigram log2-probability, number of bigrams)"""
+        total = 0.0
+        n = 0
+        for word in self.word_pattern.findall(string.lower()):
+            word = f"^{word}$"
+            for a, b in zip(word, word[1:]):
+                total += self.table[a + b]
+            n += len(word) - 1
+        return (total / n if n else 0.0), n
+    
+    def nonsense(self, string: str) -> Optional[bool]:
+        """True/False when the score is clear-cut, None when nostril has to decide"""
+        score, n = self.score(string)
+        if n < self.min_bigrams:
+            return None
+        if score >= self.meaningful_thres:
+            return False
+        if score <= self.nonsense_thres:
+            return True
+        return None
+
 class is_gallery_type:
     def __init__(self, gallery_type: str) -> None:
         self.gallery_type = gallery_type
@@ -183,12 +248,20 @@ class is_pixiv_post(is_gallery_type):
         match = re.search(self.page_pattern, string)
         if match:
             before, page, after = match.groups()
-            return {
+            result = {
                 "type": self.gallery_type,
                 "raw": string,
                 "page": page,
                 "extra": (" ".join((before, after))).strip()
             }
+            # "{artist}_{illust id}_p{page}" and "{illust id}_p{page}"
+            artist, _, illust_id = before.rpartition("_")
+            if illust_id.isnumeric() and int(illust_id) > self.page_thres:
+                result["id"] = illust_id
+                result["link"] = self.link_template + illust_id
+                if artist:
+                    result["artist"] = artist
+            return result
 
     def parse_illust_prefix(self, string: str):
         if string.startswith(self.prefixes["illust"]):
@@ -397,7 +470,18 @@ class is_manga_page(is_gallery_type):
         return {}
 
 class is_meaningful_text(is_gallery_type):
-    def __init__(self) -> None:
+    def __init__(self, scorer: Optional[ngram_scorer] = None, use_scorer=False, memo_size=65536) -> None:
+        """
+
+        Args:
+            scorer (Optional[ngram_scorer], optional): Fast pre-filter in front of nostril.
+                Built from the DeepDanbooru tag lists when None and they exist.
+            use_scorer (bool, optional): Settle clear-cut names with `scorer` before nostril.
+                Off until its agreement with nostril is measured, see `meaningful_bench.py`.
+                Defaults to False.
+            memo_size (int, optional): Max remembered nostril verdicts, keyed by the ASCII
+                letters of the name so "image (1)" and "image (2)" share one call. Defaults to 65536.
+        """
         super().__init__("meaningful")
         from nostril import nonsense
         self.nonsense = nonsense
@@ -405,6 +489,30 @@ class is_meaningful_text(is_gallery_type):
         self.alpha_thres = 2
         self.twitter_prefix = is_twitter_key().possible_prefix
         
+        if scorer is None and use_scorer and all(os.path.isfile(path) for path in ngram_scorer.CORPUS):
+            scorer = ngram_scorer()
+        self.scorer = scorer if use_scorer else None
+        self.memo_size = memo_size
+        self._memo: OrderedDict[str, bool] = OrderedDict()
+        self.stats = {"scorer": 0, "memo": 0, "nostril": 0}
+    
+    def is_nonsense(self, string: str, alpha: str) -> bool:
+        if self.scorer is not None:
+            verdict = self.scorer.nonsense(string)
+            if verdict is not None:
+                self.stats["scorer"] += 1
+                return verdict
+        verdict = self._memo.get(alpha)
+        if verdict is not None:
+            self._memo.move_to_end(alpha)
+            self.stats["memo"] += 1
+            return verdict
+        verdict = self.nonsense(string)
+        self.stats["nostril"] += 1
+        self._memo[alpha] = verdict
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return verdict
     
     def test(self, string: str) -> dict:
         if string.startswith(self.twitter_prefix):
@@ -413,7 +521,7 @@ class is_meaningful_text(is_gallery_type):
         alpha_trim = alpha.replace(" ", "")
         trim_len = len(alpha_trim)
         if trim_len < self.min_length and trim_len - len(num) > self.alpha_thres \
-            or trim_len >= self.min_length and not self.nonsense(string):
+            or trim_len >= self.min_length and not self.is_nonsense(string, alpha):
             return {
                 "type": self.gallery_type,
                 "raw" : string,
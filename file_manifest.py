@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterator, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path   TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime  INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+
+CREATE TABLE IF NOT EXISTS files (
+    path  TEXT PRIMARY KEY,
+    dir   TEXT NOT NULL,
+    size  INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    inode INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+"""
+
+# A directory modified this close to the scan may still change within its mtime
+# granularity (2s on FAT, 1s on some NAS shares), so it is not trusted next time
+RACY_SECONDS = 2.0
+
+
+def _scan_dir(root: str, rel_dir: str, known_mtime: Optional[int]):
+    """("unchanged", mtime, None) or ("scanned", mtime, (files, subdirs)) for one directory
+
+    `files` is {relative path: (size, mtime_ns, inode)}, `subdirs` relative paths.
+    """
+    full_dir = os.path.join(root, rel_dir) if rel_dir else root
+    mtime = os.stat(full_dir).st_mtime_ns
+    if known_mtime is not None and mtime == known_mtime:
+        return "unchanged", mtime, None
+    files: dict[str, tuple[int, int, int]] = {}
+    subdirs: list[str] = []
+    with os.scandir(full_dir) as entries:
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(rel_path)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files[rel_path] = (st.st_size, st.st_mtime_ns, entry.inode())
+            except OSError:
+                continue
+    return "scanned", mtime, (files, subdirs)
+
+
+class manifest_delta:
+    """Relative paths that were added, changed (size/mtime/inode) or removed since the last scan"""
+    def __init__(self) -> None:
+        self.added: list[str] = []
+        self.changed: list[str] = []
+        self.removed: list[str] = []
+        self.dirs_scanned = 0
+        self.dirs_skipped = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self) -> str:
+        return (f"manifest_delta(added={len(self.added)}, changed={len(self.changed)}, "
+                f"removed={len(self.removed)}, dirs_scanned={self.dirs_scanned}, "
+                f"dirs_skipped={self.dirs_skipped})")
+
+
+class file_manifest:
+    """Persistent (path, size, mtime, inode) list of a folder, refreshed incrementally
+
+    `refresh` walks the tree with `os.scandir` on `workers` threads. A directory
+    whose mtime is the same as in the manifest had no file added, removed or
+    renamed in it, so it is not listed again: only its known subdirectories are
+    visited. The manifest is updated in one transaction and the differences are
+    returned as a `manifest_delta`, so later stages only handle what moved.
+
+    A file rewritten in place does not touch its directory's mtime. Pass
+    `full=True` to list every directory and stat every file again. A directory
+    that cannot be read keeps its known files and is retried on the next refresh.
+
+    Paths are relative to `root`, like `util.get_file_paths`. Keep the manifest
+    file outside of `root`, or it shows up in its own scan.
+
+    Usage:
+        ```
+        manifest = file_manifest("D:/gallery", "gallery_manifest.sqlite")
+        delta = manifest.refresh()
+        tag(delta.added + delta.changed)
+        catalog.remove(delta.removed)
+        ```
+    """
+    def __init__(self, root: str, manifest_path: str, workers=16) -> None:
+        if not os.path.isdir(root):
+            raise ValueError("Invalid directory path")
+        self.root = root
+        self.workers = workers
+        self._conn = sqlite3.connect(manifest_path)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def refresh(self, full=False) -> manifest_delta:
+        st = time.time()
+        delta = manifest_delta()
+        known_dirs: dict[str, tuple[Optional[str], Optional[int]]] = {
+            path: (parent, mtime) for path, parent, mtime in self._conn.execute("SELECT path, parent, mtime FROM dirs")}
+        children: dict[str, list[str]] = {}
+        for path, (parent, _) in known_dirs.items():
+            if parent is not None:
+                children.setdefault(parent, []).append(path)
+
+        visited: dict[str, tuple[Optional[str], Optional[int]]] = {}
+        scanned: dict[str, dict[str, tuple[int, int, int]]] = {}
+        racy_after = (st - RACY_SECONDS) * 1e9
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending: dict[Future, tuple[str, Optional[str]]] = {}
+
+            def submit(rel_dir: str, parent: Optional[str]):
+                known_mtime = None if full or rel_dir not in known_dirs else known_dirs[rel_dir][1]
+                pending[pool.submit(_scan_dir, self.root, rel_dir, known_mtime)] = (rel_dir, parent)
+
+            submit("", None)
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    rel_dir, parent = pending.pop(future)
+                    try:
+                        kind, mtime, listing = future.result()
+                    except OSError as e:
+                        # Unreadable right now (or removed mid-scan): keep what is known of it and
+                        # its subtree, and store no mtime so the next refresh lists it again.
+                        # A directory that is really gone disappears from its parent's listing.
+                        print(f"Skipped {rel_dir or self.root}: {e}")
+                        if rel_dir in known_dirs:
+                            visited[rel_dir] = (parent, None)
+                            for subdir in children.get(rel_dir, []):
+                                submit(subdir, rel_dir)
+                        continue
+                    visited[rel_dir] = (parent, None if mtime > racy_after else mtime)
+                    if kind == "unchanged":
+                        delta.dirs_skipped += 1
+                        subdirs = children.get(rel_dir, [])
+                    else:
+                        delta.dirs_scanned += 1
+                        files, subdirs = listing
+                        scanned[rel_dir] = files
+                    for subdir in subdirs:
+                        submit(subdir, rel_dir)
+
+        with self._conn:
+            for rel_dir, files in scanned.items():
+                old = {path: (size, mtime, inode) for path, size, mtime, inode in self._conn.execute(
+                    "SELECT path, size, mtime, inode FROM files WHERE dir = ?", (rel_dir,))}
+                for path, stat in files.items():
+                    if path not in old:
+                        delta.added.append(path)
+                    elif old[path] != stat:
+                        delta.changed.append(path)
+                removed = [path for path in old if path not in files]
+                delta.removed.extend(removed)
+                self._conn.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                    ((path, rel_dir, *files[path]) for path in files if old.get(path) != files[path]))
+
+            gone = [path for path in known_dirs if path not in visited]
+            for rel_dir in gone:
+                delta.removed.extend(path for path, in self._conn.execute(
+                    "SELECT path FROM files WHERE dir = ?", (rel_dir,)))
+                self._conn.execute("DELETE FROM files WHERE dir = ?", (rel_dir,))
+            self._conn.executemany("DELETE FROM dirs WHERE path = ?", ((path,) for path in gone))
+            self._conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                                   ((path, parent, mtime) for path, (parent, mtime) in visited.items()))
+
+        print(f"Rescanned {self.root} in {time.time() - st:.2f}s: {delta}")
+        return delta
+
+    def file_paths(self, absolute=False) -> Iterator[str]:
+        """Every file in the manifest, as of the last `refresh`"""
+        root = os.path.abspath(self.root)
+        for path, in self._conn.execute("SELECT path FROM files ORDER BY path"):
+            yield os.path.join(root, path) if absolute else path
+
+    def stat(self, path: str) -> Optional[tuple[int, int, int]]:
+        """(size, mtime_ns, inode) of a relative path from the manifest"""
+        return self._conn.execute("SELECT size, mtime, inode FROM files WHERE path = ?", (path,)).fetchone()
+
+    def close(self) -> None:
+        self._conn.close()
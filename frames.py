@@ -0,0 +1,220 @@
+import os
+import subprocess
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+import cv2
+import imageio.v3 as iio
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+import metrics
+from media_probe import media_prober
+
+
+prober = media_prober()
+
+
+def get_video_info(video_path: str):
+    """(duration, fps) through the shared in-memory `prober`"""
+    duration, fps = prober.get(video_path)
+    if duration is None or fps is None:
+        raise ValueError(f"Could not probe {video_path}: {duration=}, {fps=}")
+    return duration, fps
+
+
+def pil_to_rgb(image: Image.Image, size: Optional[tuple[int, int]] = None) -> np.ndarray:
+    image = image.convert("RGB")
+    if size is not None:
+        image = image.resize(size)
+    return np.asarray(image)
+
+
+class pixel_budget:
+    """Caps the decoded pixels held at once across loader threads
+
+    A decode waits until its pixels fit under `max_pixels` next to the decodes
+    already in flight. A single image larger than the budget still runs, alone.
+
+    Usage:
+        ```
+        budget = pixel_budget(100_000_000)
+        with budget.acquire(width * height):
+            ...
+        ```
+    """
+    def __init__(self, max_pixels=100_000_000) -> None:
+        self.max_pixels = max_pixels
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def acquire(self, pixels: int):
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight == 0 or self.in_flight + pixels <= self.max_pixels)
+            self.in_flight += pixels
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= pixels
+                self._cond.notify_all()
+
+
+def load_image(image_path: str, size: tuple[int, int] = (512, 512),
+               budget: Optional[pixel_budget] = None, reduced=True) -> np.ndarray:
+    """RGB uint8 image resized to `size`, decoded at reduced resolution where the format allows
+
+    With `reduced`, JPEGs are opened with `draft`, so libjpeg scales the DCT by
+    1/2, 1/4 or 1/8 while decoding, to the smallest scale still at least `size`.
+    Other formats are decoded at full size and shrunk with a box reduce before the
+    final resize. The decoded pixel count is reserved from `budget` while held.
+    """
+    if metrics.enabled:
+        metrics.count("bytes_read_total", os.path.getsize(image_path))
+    with Image.open(image_path) as im:
+        if reduced and im.format == "JPEG":
+            im.draft("RGB", size)
+        width, height = im.size
+        with budget.acquire(width * height) if budget is not None else nullcontext():
+            with metrics.timer("decode"):
+                image = im.convert("RGB")
+            with metrics.timer("resize"):
+                if reduced:
+                    image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=3.0)
+                else:
+                    image = image.resize(size)
+            return np.asarray(image)
+
+
+def extract_frames_iio(video_path: str, n=5, size: Optional[tuple[int, int]] = None,
+                       duration=None, fps=None) -> list[np.ndarray]:
+    """`n` evenly spaced RGB uint8 frames read with ImageIO-ffmpeg"""
+    if duration is None or fps is None:
+        duration, fps = get_video_info(video_path)
+    frames = []
+    for i in tqdm(range(n), desc=f'IIO: Reading frames from {os.path.basename(video_path)}'):
+        t = (i+1) * duration / (n+1)
+        frame_idx = int(t * fps)
+        frame = iio.imread(video_path, index=frame_idx)
+        frames.append(pil_to_rgb(Image.fromarray(frame), size))
+    return frames
+
+
+def extract_frames(video_path: str, n=5, size: Optional[tuple[int, int]] = None) -> list[np.ndarray]:
+    """`n` evenly spaced RGB uint8 frames read with OpenCV, falls back to ImageIO-ffmpeg"""
+    duration, fps = get_video_info(video_path)
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    for i in tqdm(range(n), desc=f'CV2: Reading frames from {os.path.basename(video_path)}'):
+        t = (i + 1) * duration / (n + 1)
+        frame_idx = int(t * fps)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        ret, frame = cap.read()
+        if ret:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if size is not None:
+                frame = cv2.resize(frame, size)
+            frames.append(frame)
+        else:
+            print(f"CV2 Error. {duration=}, {fps=}  Switching to ImageIO-ffmpeg")
+            break
+
+    cap.release()
+    if frames:
+        return frames
+    return extract_frames_iio(video_path, n, size, duration=duration, fps=fps)
+
+
+def extract_frames_gif(gif_path: str, n=5, size: Optional[tuple[int, int]] = None) -> list[np.ndarray]:
+    """`n` evenly spaced RGB uint8 frames of a gif"""
+    frames = []
+    with Image.open(gif_path) as im:
+        for i in tqdm(range(n), desc=f'PIL: Reading frames from {os.path.basename(gif_path)}'):
+            im.seek(im.n_frames // n * i)
+            frames.append(pil_to_rgb(im, size))
+    return frames
+
+
+def sample_video(video_path: str, n=5, size: tuple[int, int] = (512, 512),
+                 duration: Optional[float] = None) -> np.ndarray:
+    """`n` evenly spaced frames from one ffmpeg process piping rawvideo
+
+    Every sample is an input of the same process opened with an input-side
+    `-ss` and `-noaccurate_seek`, so each one jumps straight to the keyframe
+    at or before its timestamp instead of decoding from the previous sample.
+    The frames are scaled to `size` inside ffmpeg.
+
+    Returns:
+        np.ndarray: (frames, height, width, 3) uint8, frames <= n.
+    """
+    if duration is None:
+        duration = get_video_info(video_path)[0]
+    width, height = size
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+    for i in range(n):
+        t = (i + 1) * duration / (n + 1)
+        cmd += ['-noaccurate_seek', '-ss', f'{t:.3f}', '-i', video_path]
+    chains = [f'[{i}:v:0]trim=end_frame=1,setpts=PTS-STARTPTS,scale={width}:{height}:flags=bilinear,setsar=1[v{i}]'
+              for i in range(n)]
+    inputs = ''.join(f'[v{i}]' for i in range(n))
+    graph = ';'.join(chains) + f';{inputs}concat=n={n}:v=1:a=0,format=rgb24[out]'
+    cmd += ['-filter_complex', graph, '-map', '[out]', '-fps_mode', 'passthrough', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1']
+
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frame_bytes = width * height * 3
+    count = min(n, len(result.stdout) // frame_bytes)
+    if count == 0:
+        raise RuntimeError(f"ffmpeg returned no frames for {video_path}: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout[:count * frame_bytes], dtype=np.uint8).reshape(count, height, width, 3)
+
+
+def sample_gif(gif_path: str, n=5, size: Optional[tuple[int, int]] = (512, 512)) -> np.ndarray:
+    """`n` evenly spaced frames of a gif in one sequential pass, without `n_frames`
+
+    Frames at every `stride`-th index are kept in a buffer of at most `2 * n`.
+    When it fills up, every other frame is dropped and the stride doubles, so
+    the buffer always spans the frames seen so far evenly. Only kept frames are
+    converted and resized.
+
+    Returns:
+        np.ndarray: (frames, height, width, 3) uint8, frames <= n.
+    """
+    kept: list[np.ndarray] = []
+    stride = 1
+    with Image.open(gif_path) as im:
+        index = 0
+        while True:
+            if index % stride == 0:
+                kept.append(pil_to_rgb(im, size))
+                if len(kept) >= 2 * n:
+                    kept = kept[::2]
+                    stride *= 2
+            index += 1
+            try:
+                im.seek(index)
+            except EOFError:
+                break
+    if len(kept) > n:
+        kept = [kept[i * len(kept) // n] for i in range(n)]
+    return np.stack(kept)
+
+
+def sample_frames(file_path: str, n=5, size: tuple[int, int] = (512, 512),
+                  duration: Optional[float] = None) -> np.ndarray:
+    """Sampled frames of a gif or video, falling back to the per-frame readers on failure"""
+    with metrics.timer("sample_frames"):
+        if file_path.endswith("gif"):
+            sampled = sample_gif(file_path, n, size)
+        else:
+            try:
+                sampled = sample_video(file_path, n, size, duration)
+            except (RuntimeError, ValueError, KeyError, OSError) as e:
+                print(f"ffmpeg sampling failed ({e}). Switching to CV2")
+                metrics.count("failures_total", stage="sample_video", type=type(e).__name__)
+                sampled = np.stack(extract_frames(file_path, n, size))
+    metrics.count("frames_sampled_total", len(sampled))
+    return sampled
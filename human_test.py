@@ -1,6 +1,8 @@
 import os
 import time
 from extractor import *
+from classifier import compiled_classifier
+from catalog import catalog
 
 test_folder = "test/raw"
 
@@ -46,7 +48,8 @@ tests = [
     # is random (default case)
 ]
 
-def run_test(tests: list[is_gallery_type], dump_file_path: str, output_path:str, dump=False):
+def run_test(tests: list[is_gallery_type], dump_file_path: str, output_path:str, dump=False,
+             catalog_path: Optional[str] = None):
     dump_file = open(dump_file_path, "r", encoding="utf8")
     file_lists = [x.strip() for x in dump_file.readlines()]
 
@@ -56,15 +59,18 @@ def run_test(tests: list[is_gallery_type], dump_file_path: str, output_path:str,
     if dump:
         output_dump = open(output_path, "w", encoding="utf8")
         
+    classifier = compiled_classifier(tests)
+    entries = []
     for i, file_path in enumerate(file_lists):
         file_raw = os.path.splitext(file_path.strip())
         filename = file_raw[0]
-        for test_type in tests:
-            if tmp:= test_type.test(filename):
-                if output_dump is not None:
-                    output_dump.write(f"{i:<3}| Match {test_type.gallery_type} {tmp}\n")
-                print(f"{i:<3}| Match {test_type.gallery_type} {tmp}")
-                break
+        test_type, tmp = classifier.match(filename)
+        if catalog_path is not None:
+            entries.append((file_path, test_type.gallery_type if test_type else None, tmp))
+        if tmp:
+            if output_dump is not None:
+                output_dump.write(f"{i:<3}| Match {test_type.gallery_type} {tmp}\n")
+            print(f"{i:<3}| Match {test_type.gallery_type} {tmp}")
         else:
             if output_dump is not None:
                 output_dump.write(f"{i:<3}| No match found (random) {repr(filename)}\n")
@@ -72,6 +78,10 @@ def run_test(tests: list[is_gallery_type], dump_file_path: str, output_path:str,
 
     if output_dump is not None:
         output_dump.close()
+    if catalog_path is not None:
+        db = catalog(catalog_path)
+        db.add_classifications(entries)
+        db.close()
 
 run_test(tests, 
          "dump_files/file_path_dump.txt", 
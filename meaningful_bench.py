@@ -0,0 +1,100 @@
+import os
+import random
+import string
+import tempfile
+import time
+
+from extractor import is_meaningful_text, ngram_scorer
+
+# is_meaningful_text with the n-gram pre-filter and memo vs nostril alone.
+# labelled_path lines: "meaningful<TAB>name" or "nonsense<TAB>name", real file
+# names labelled by hand. Without it, meaningful names are built from tags held
+# out of the scorer's bigram training, so the scorer never sees them. Either
+# way, the scorer's thresholds only count as checked once the names it
+# settles agree with nostril here.
+labelled_path = "labelled_names.txt"
+synthetic_n = 20_000
+holdout_every = 5  # every n-th tag is kept out of the bigram training
+seed = 0
+
+
+def split_tags(holdout_every: int) -> tuple[list[str], list[str]]:
+    """(training tags, held-out tags) from the scorer's corpus"""
+    train, held_out = [], []
+    for path in ngram_scorer.CORPUS:
+        with open(path, "r", encoding="utf8") as f:
+            for i, tag in enumerate(x.strip() for x in f):
+                if tag:
+                    (held_out if i % holdout_every == 0 else train).append(tag)
+    return train, held_out
+
+
+def synthetic_corpus(n: int, tags: list[str], seed=0) -> list[tuple[str, str]]:
+    """Names built from `tags` labelled meaningful, random keys/hashes/letters labelled nonsense"""
+    rng = random.Random(seed)
+    tags = [tag for tag in tags if len(tag) > 3]
+    corpus = []
+    for _ in range(n // 2):
+        name = " ".join(rng.sample(tags, rng.randint(1, 3)))
+        if rng.random() < 0.3:
+            name += f" ({rng.randint(1, 20)})"
+        corpus.append(("meaningful", name))
+    noise = (
+        lambda: "".join(rng.choices(string.ascii_letters + string.digits + "-_", k=15)),
+        lambda: "".join(rng.choices("0123456789abcdef", k=32)),
+        lambda: "".join(rng.choices(string.ascii_lowercase, k=rng.randint(6, 14))),
+    )
+    for _ in range(n - n // 2):
+        corpus.append(("nonsense", rng.choice(noise)()))
+    rng.shuffle(corpus)
+    return corpus
+
+
+def decide(extr: is_meaningful_text, name: str) -> str:
+    try:
+        return "meaningful" if extr.test(name) else "nonsense"
+    except Exception as e:
+        return type(e).__name__
+
+
+if os.path.isfile(labelled_path):
+    with open(labelled_path, "r", encoding="utf8") as f:
+        corpus = [tuple(line.rstrip("\n").split("\t", 1)) for line in f if "\t" in line]
+    scorer = ngram_scorer()
+else:
+    print(f"{labelled_path} not found, using {synthetic_n} synthetic names from held-out tags")
+    train_tags, held_out_tags = split_tags(holdout_every)
+    corpus = synthetic_corpus(synthetic_n, held_out_tags, seed)
+    with tempfile.NamedTemporaryFile("w", encoding="utf8", suffix=".txt", delete=False) as f:
+        f.write("\n".join(train_tags))
+    try:
+        scorer = ngram_scorer((f.name,))
+    finally:
+        os.remove(f.name)
+names = [name for _, name in corpus]
+
+reference = is_meaningful_text(use_scorer=False, memo_size=0)
+st = time.time()
+reference_decisions = [decide(reference, name) for name in names]
+reference_time = time.time() - st
+
+fast = is_meaningful_text(scorer=scorer, use_scorer=True)
+st = time.time()
+fast_decisions = [decide(fast, name) for name in names]
+fast_time = time.time() - st
+
+agreement = sum(a == b for a, b in zip(reference_decisions, fast_decisions)) / len(names)
+reference_acc = sum(d == label for d, (label, _) in zip(reference_decisions, corpus)) / len(names)
+fast_acc = sum(d == label for d, (label, _) in zip(fast_decisions, corpus)) / len(names)
+print(f"{len(names)} names")
+print(f"nostril only:      {reference_time:.2f}s, label accuracy {reference_acc:.3f}")
+print(f"pre-filter + memo: {fast_time:.2f}s, label accuracy {fast_acc:.3f}")
+print(f"agreement with nostril: {agreement:.4f}, speedup {reference_time / max(fast_time, 1e-9):.2f}x")
+print(f"decided by: {fast.stats}")
+
+# The part the thresholds are responsible for: names the scorer settles alone
+settled = [i for i, name in enumerate(names) if scorer.nonsense(name) is not None]
+if settled:
+    settled_agreement = sum(reference_decisions[i] == fast_decisions[i] for i in settled) / len(settled)
+    print(f"scorer settled {len(settled)} names, agreement with nostril on those: {settled_agreement:.4f} "
+          f"(meaningful_thres {scorer.meaningful_thres}, nonsense_thres {scorer.nonsense_thres})")
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+from fractions import Fraction
+from typing import Iterable, Optional
+
+import metrics
+
+PROBE_CMD = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', '-show_format']
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float(value) if value else None
+
+
+def _parse_clock(clock: str) -> float:
+    hours, minutes, seconds = map(float, clock.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_probe(info: dict) -> tuple[Optional[float], Optional[float]]:
+    """(duration seconds, fps) from ffprobe's JSON
+
+    The duration comes from the stream `DURATION` tag (mkv/webm), then the
+    stream header, then the container header, all from the same output.
+    """
+    streams = info.get('streams', [])
+    video = [stream for stream in streams if stream.get('codec_type') == 'video'] or streams
+    stream = video[0] if video else {}
+
+    duration = None
+    tag = stream.get('tags', {}).get('DURATION')
+    if tag:
+        duration = _parse_clock(tag)
+    else:
+        for source in (stream, info.get('format', {})):
+            try:
+                duration = float(source['duration'])
+                break
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    fps = _parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate'))
+    return duration, fps
+
+
+class media_prober:
+    """Duration/fps of media files from ffprobe, run concurrently and cached
+
+    `probe_many` runs up to `concurrency` ffprobe processes at once on an
+    asyncio loop. Results are kept in memory and, with `cache_path`, in SQLite
+    keyed by (path, size, mtime) so later runs spawn nothing for unchanged files.
+    Safe to share between the prefetch loader's threads.
+
+    Usage:
+        ```
+        prober = media_prober("probe_cache.sqlite")
+        prober.probe_many(video_paths)
+        duration, fps = prober.get(video_paths[0])
+        ```
+    """
+    def __init__(self, cache_path: Optional[str] = None, concurrency=8) -> None:
+        self.concurrency = concurrency
+        self._memory: dict[tuple[str, int, int], tuple[Optional[float], Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if cache_path is not None:
+            self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS probes (
+                    path     TEXT PRIMARY KEY,
+                    size     INTEGER NOT NULL,
+                    mtime    INTEGER NOT NULL,
+                    duration REAL,
+                    fps      REAL
+                )
+            """)
+            self._conn.commit()
+
+    def _key(self, path: str) -> tuple[str, int, int]:
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def _cached(self, key: tuple[str, int, int]) -> Optional[tuple[Optional[float], Optional[float]]]:
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT duration, fps FROM probes WHERE path = ? AND size = ? AND mtime = ?", key).fetchone()
+                if row is not None:
+                    self._memory[key] = row
+                    return row
+        return None
+
+    def _store(self, results: list[tuple[tuple[str, int, int], tuple[Optional[float], Optional[float]]]]) -> None:
+        # Failed probes stay in memory only, so a missing ffprobe is not remembered across runs
+        rows = [(*key, *value) for key, value in results if value != (None, None)]
+        with self._lock:
+            for key, value in results:
+                self._memory[key] = value
+            if self._conn is not None and rows:
+                self._conn.executemany("INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.commit()
+
+    async def _probe_async(self, path: str, semaphore: asyncio.Semaphore
+                           ) -> tuple[Optional[float], Optional[float]]:
+        async with semaphore:
+            with metrics.timer("ffprobe"):
+                try:
+                    proc = await asyncio.create_subprocess_exec(
+                        *PROBE_CMD, path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+                except OSError as e:
+                    metrics.count("failures_total", stage="ffprobe", type=type(e).__name__)
+                    return None, None
+                stdout, _ = await proc.communicate()
+        try:
+            return parse_probe(json.loads(stdout))
+        except json.JSONDecodeError as e:
+            metrics.count("failures_total", stage="ffprobe", type=type(e).__name__)
+            return None, None
+
+    async def _probe_all(self, keys: list[tuple[str, int, int]]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self._probe_async(key[0], semaphore) for key in keys))
+
+    def probe_many(self, paths: Iterable[str]) -> dict[str, tuple[Optional[float], Optional[float]]]:
+        """Probe every uncached path concurrently
+
+        Returns:
+            dict[str, tuple[Optional[float], Optional[float]]]: path to (duration, fps),
+                None where ffprobe could not tell.
+        """
+        results = {}
+        missing = []
+        for path in paths:
+            key = self._key(path)
+            cached = self._cached(key)
+            if cached is None:
+                missing.append((path, key))
+            else:
+                results[path] = cached
+        if missing:
+            probed = asyncio.run(self._probe_all([key for _, key in missing]))
+            self._store([(key, value) for (_, key), value in zip(missing, probed)])
+            for (path, _), value in zip(missing, probed):
+                results[path] = value
+        return results
+
+    def get(self, path: str) -> tuple[Optional[float], Optional[float]]:
+        """(duration, fps) of one file, probing it synchronously on a cache miss"""
+        key = self._key(path)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        try:
+            result = subprocess.run([*PROBE_CMD, path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            value = parse_probe(json.loads(result.stdout))
+        except (OSError, json.JSONDecodeError):
+            value = (None, None)
+        self._store([(key, value)])
+        return value
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
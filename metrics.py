@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Optional
+
+# Stage timers and counters for the tagging and sorting pipelines.
+# Off by default: every call returns right after checking `enabled`, so the
+# instrumented code pays one global lookup per call. Turn on with `enable()`
+# or by setting GALLERY_METRICS=1.
+
+PREFIX = "gallery_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HELP = {
+    "stage_seconds": "Time spent per call in each pipeline stage",
+    "bytes_read_total": "Bytes of image files opened for decoding",
+    "frames_sampled_total": "Frames sampled from gifs and videos",
+    "files_total": "Files tagged",
+    "rows_total": "Rows (images or frames) run through the model",
+    "cache_hits_total": "Files whose result came from the embedding cache",
+    "failures_total": "Files that failed, by stage and exception type",
+    "files_sorted_total": "Files sorted, by folder",
+}
+
+enabled = os.environ.get("GALLERY_METRICS", "") not in ("", "0")
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple], float] = {}
+_histograms: dict[tuple[str, tuple], list] = {}  # key: [bucket counts, sum, count]
+_NULL = nullcontext()
+
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Add `value` to the histogram `name`, bucketed by `LATENCY_BUCKETS`"""
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        i = bisect_left(LATENCY_BUCKETS, value)
+        if i < len(LATENCY_BUCKETS):
+            histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+class _timer:
+    __slots__ = ("labels", "start")
+
+    def __init__(self, labels: dict) -> None:
+        self.labels = labels
+
+    def __enter__(self) -> "_timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        observe("stage_seconds", time.perf_counter() - self.start, **self.labels)
+
+
+def timer(stage: str, **labels):
+    """Context manager adding its wall time to `stage_seconds{stage=...}`
+
+    Usage:
+        ```
+        with metrics.timer("decode"):
+            image = im.convert("RGB")
+        ```
+    """
+    if not enabled:
+        return _NULL
+    return _timer({"stage": stage, **labels})
+
+
+def snapshot() -> dict:
+    """Current values: {"time", "counters": [{name, labels, value}], "histograms": [{name, labels, buckets, sum, count}]}
+
+    Histogram buckets are cumulative, as in Prometheus.
+    """
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+        histograms = []
+        for (name, labels), (buckets, total, n) in sorted(_histograms.items()):
+            cumulative, running = {}, 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                running += bucket
+                cumulative[str(bound)] = running
+            cumulative["+Inf"] = n
+            histograms.append({"name": name, "labels": dict(labels), "buckets": cumulative, "sum": total, "count": n})
+    return {"time": time.time(), "counters": counters, "histograms": histograms}
+
+
+def print_summary() -> None:
+    """Calls, total and mean time of every stage"""
+    if not enabled:
+        return
+    stages = [x for x in snapshot()["histograms"] if x["name"] == "stage_seconds"]
+    for stage in sorted(stages, key=lambda x: x["sum"], reverse=True):
+        label = ",".join(str(value) for value in stage["labels"].values())
+        print(f"    {label:<30} {stage['count']:>8} calls {stage['sum']:>9.3f}s "
+              f"{stage['sum'] / max(stage['count'], 1) * 1000:>9.3f} ms/call")
+
+
+def _labels_text(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def prometheus_text(snap: Optional[dict] = None) -> str:
+    """The snapshot in the Prometheus text exposition format"""
+    snap = snap or snapshot()
+    lines = []
+    described = set()
+
+    def describe(name: str, kind: str):
+        if name not in described:
+            described.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {PREFIX}{name} {HELP[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for counter in snap["counters"]:
+        describe(counter["name"], "counter")
+        lines.append(f"{PREFIX}{counter['name']}{_labels_text(counter['labels'])} {counter['value']}")
+    for histogram in snap["histograms"]:
+        name, labels = histogram["name"], histogram["labels"]
+        describe(name, "histogram")
+        for bound, value in histogram["buckets"].items():
+            lines.append(f"{PREFIX}{name}_bucket{_labels_text({**labels, 'le': bound})} {value}")
+        lines.append(f"{PREFIX}{name}_sum{_labels_text(labels)} {histogram['sum']}")
+        lines.append(f"{PREFIX}{name}_count{_labels_text(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # The textfile collector may read at any time, so never leave a partial file under `path`
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_json(path: str) -> None:
+    _write_atomic(path, json.dumps(snapshot(), indent=2))
+
+
+def write_prometheus(path: str) -> None:
+    """Write for node-exporter's textfile collector, which only reads files ending in .prom"""
+    _write_atomic(path, prometheus_text())
+
+
+class exporter:
+    """Writes the metrics every `interval` seconds on a background thread, and once more on `stop`
+
+    Usage:
+        ```
+        metrics.enable()
+        with metrics.exporter("metrics.json", "/var/lib/node_exporter/gallery.prom"):
+            recognizer.inference_gpu(file_paths)
+        ```
+    """
+    def __init__(self, json_path: Optional[str] = None, prom_path: Optional[str] = None, interval=15.0) -> None:
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self) -> None:
+        if self.json_path:
+            write_json(self.json_path)
+        if self.prom_path:
+            write_prometheus(self.prom_path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self) -> "exporter":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def __enter__(self) -> "exporter":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
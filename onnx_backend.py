@@ -0,0 +1,76 @@
+import json
+import os
+import time
+from contextlib import nullcontext
+from typing import Optional
+
+import numpy as np
+import onnxruntime as ort
+
+import metrics
+
+TAGS_KEY = "tags"
+
+
+class onnx_backend:
+    """DeepDanbooru graph exported by `onnx_export.py`, run by ONNX Runtime on CPU
+
+    Neither torch nor TorchDeepDanbooru is imported. The tag names are read
+    from the graph's metadata, written there at export time. `to_tensor` and
+    `predict_tensor` mirror `torch_backend`, with numpy arrays as the tensors.
+
+    Usage:
+        ```
+        backend = onnx_backend("model\\DeepDanbooru\\model-resnet_custom_v3.onnx", num_threads=8)
+        backend.load()
+        probabilities = backend.predict(arrays)
+        ```
+    """
+    def __init__(self, model_path: str, num_threads: Optional[int] = None,
+                 providers: Optional[list[str]] = None) -> None:
+        """
+
+        Args:
+            num_threads (Optional[int], optional): Intra-op threads. Defaults to ONNX Runtime's choice.
+            providers (Optional[list[str]], optional): Execution providers in priority order.
+                Defaults to ["CPUExecutionProvider"].
+        """
+        assert os.path.isfile(model_path), "ONNX model not found, export it with onnx_export.py"
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.providers = providers or ["CPUExecutionProvider"]
+        self.device = "cpu"
+        self.precision = "fp32"
+        self.session: Optional[ort.InferenceSession] = None
+        self._tags: list[str] = []
+
+    @property
+    def tags(self) -> list[str]:
+        return self._tags
+
+    def load(self, is_eval=True, calibration_arrays=None):
+        st = time.time()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads is not None:
+            options.intra_op_num_threads = self.num_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=self.providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self._tags = json.loads(self.session.get_modelmeta().custom_metadata_map[TAGS_KEY])
+        print(f"Model loaded in {time.time() - st:.2f}s ({self.session.get_providers()[0]}, "
+              f"{self.num_threads or 'default'} threads)")
+
+    def inference_context(self):
+        return nullcontext()
+
+    def to_tensor(self, array: np.ndarray) -> np.ndarray:
+        """The session takes numpy input, so the "tensor" of this backend is a contiguous float32 array"""
+        return np.ascontiguousarray(array, dtype=np.float32)
+
+    def predict_tensor(self, tensor: np.ndarray) -> np.ndarray:
+        with metrics.timer("forward"):
+            return self.session.run(None, {self.input_name: tensor})[0]
+
+    def predict(self, array: np.ndarray) -> np.ndarray:
+        """One forward pass over a stacked (N, 512, 512, 3) array, returns (N, tags)"""
+        return self.predict_tensor(self.to_tensor(array))
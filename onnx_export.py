@@ -0,0 +1,57 @@
+import json
+import os
+
+import numpy as np
+import onnx
+import torch
+
+import frames
+from onnx_backend import TAGS_KEY, onnx_backend
+from torch_backend import torch_backend
+
+# Export DeepDanbooru to ONNX with a dynamic batch axis, then check ONNX Runtime against torch tag by tag
+model_path = "model\\DeepDanbooru\\model-resnet_custom_v3.pt"
+onnx_path = "model\\DeepDanbooru\\model-resnet_custom_v3.onnx"
+opset = 17
+check_folder = "public_test/"
+tolerance = 1e-3
+seed = 0
+
+reference = torch_backend(model_path, precision="fp32", channels_last=False)
+reference.load()
+dummy = torch.zeros((1, 512, 512, 3), device=reference.device)
+torch.onnx.export(reference.model, dummy, onnx_path, opset_version=opset,
+                  input_names=["input"], output_names=["probabilities"],
+                  dynamic_axes={"input": {0: "batch"}, "probabilities": {0: "batch"}})
+model = onnx.load(onnx_path)
+onnx.helper.set_model_props(model, {TAGS_KEY: json.dumps(reference.tags)})
+onnx.save(model, onnx_path)
+print(f"Exported {onnx_path} ({os.path.getsize(onnx_path) / 2**20:.1f}MB, opset {opset})")
+
+exported = onnx_backend(onnx_path)
+exported.load()
+assert exported.tags == reference.tags, "Tag names in the ONNX metadata differ from model.tags"
+
+rng = np.random.default_rng(seed)
+checks = [("random batch of 3", rng.random((3, 512, 512, 3), dtype=np.float32))]
+images = [os.path.join(check_folder, x) for x in sorted(os.listdir(check_folder))
+          if not x.endswith(("gif", "webm", "mp4", "mov"))]
+if images:
+    batch = np.stack([frames.load_image(x) for x in images]).astype(np.float32) / 255
+    checks.append((f"{check_folder} batch of {len(images)}", batch))
+
+worst = 0.0
+for label, batch in checks:
+    with reference.inference_context():
+        expected = reference.predict(batch)
+    actual = exported.predict(batch)
+    diff = np.abs(expected - actual)
+    row, col = np.unravel_index(np.argmax(diff), diff.shape)
+    flipped = int(np.sum((expected >= 0.5) != (actual >= 0.5)))
+    worst = max(worst, float(diff.max()))
+    print(f"{label}: max diff {diff.max():.2e} at {reference.tags[col]!r} (row {row}), "
+          f"mean diff {diff.mean():.2e}, tags flipped at 0.5: {flipped}")
+
+if worst > tolerance:
+    raise SystemExit(f"ONNX output differs from torch by {worst:.2e} > {tolerance}")
+print("ONNX Runtime output matches torch")
@@ -3,12 +3,17 @@ import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
 import os
+from embedding_store import embedding_store
 dump_pickle_path = 'public_test.pickle'
+store_path = 'public_test_store'
 # for result, res_dict in res:
 #     print(res_dict, result)
 # danbooru.dump_pickle(res, dump_pickle_path)
-with open(dump_pickle_path, "rb") as f:
-    unpickled = pickle.load(f)
+if os.path.isdir(store_path):
+    unpickled = embedding_store(store_path)
+else:
+    with open(dump_pickle_path, "rb") as f:
+        unpickled = pickle.load(f)
 
 with open("model\\DeepDanbooru\\tags.txt", "r") as tag_file:
     tags = np.array([x.strip() for x in tag_file.readlines()])
@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+
+class prefetch_loader:
+    """Decode and resize files on a worker pool ahead of the model loop
+
+    Workers run `load_fn` (usually `danbooru_recognizer.load_arrays`) and the
+    pending results sit in a bounded queue. When the queue is full the producer
+    blocks, so at most `queue_depth + 1` decoded files are held in memory no
+    matter how slow the consumer is. Items come out in input order.
+
+    Usage:
+        ```
+        loader = prefetch_loader(recognizer.load_arrays, file_paths, num_workers=4)
+        for i, file_path, arrays in loader:
+            ...
+        ```
+    """
+    def __init__(self, load_fn: Callable[[str], np.ndarray], file_paths: Iterable[str],
+                 num_workers=4, queue_depth=8) -> None:
+        """
+
+        Args:
+            load_fn (Callable[[str], np.ndarray]): Path to preprocessed rows.
+            file_paths (Iterable[str]): Files to load. Missing files are skipped.
+            num_workers (int, optional): Decode threads. 0 loads serially on the calling thread. Defaults to 4.
+            queue_depth (int, optional): Max decoded files waiting for the consumer. Defaults to 8.
+        """
+        self.load_fn = load_fn
+        self.file_paths = file_paths
+        self.num_workers = num_workers
+        self.queue_depth = max(1, queue_depth)
+        self._stop = threading.Event()
+
+    def __iter__(self) -> Iterator[tuple[int, str, np.ndarray]]:
+        if self.num_workers <= 0:
+            for i, file_path in enumerate(self.file_paths):
+                if os.path.exists(file_path):
+                    yield i, file_path, self.load_fn(file_path)
+            return
+        yield from self._iter_pool()
+
+    def _iter_pool(self) -> Iterator[tuple[int, str, np.ndarray]]:
+        pending: queue.Queue[tuple[int, str, Future] | BaseException | None] = queue.Queue(maxsize=self.queue_depth)
+        self._stop.clear()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            producer = threading.Thread(target=self._produce, args=(pool, pending), daemon=True)
+            producer.start()
+            try:
+                while (item := pending.get()) is not None:
+                    if isinstance(item, BaseException):
+                        # The file_paths iterator raised on the producer thread
+                        raise item
+                    i, file_path, future = item
+                    yield i, file_path, future.result()
+            finally:
+                self._stop.set()
+                self._drain(pending)
+                producer.join()
+
+    def _produce(self, pool: ThreadPoolExecutor, pending: queue.Queue) -> None:
+        try:
+            for i, file_path in enumerate(self.file_paths):
+                if self._stop.is_set():
+                    break
+                if not os.path.exists(file_path):
+                    continue
+                item = (i, file_path, pool.submit(self.load_fn, file_path))
+                if not self._put(pending, item):
+                    item[2].cancel()
+                    break
+        except BaseException as e:
+            self._put(pending, e)
+        finally:
+            self._put(pending, None)
+
+    def _put(self, pending: queue.Queue, item) -> bool:
+        # Blocking put that still notices the consumer going away
+        while not self._stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, pending: queue.Queue) -> None:
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple):
+                item[2].cancel()
@@ -1,5 +1,7 @@
 import pickle
 from recognizer import danbooru_recognizer
+from embedding_cache import embedding_cache
+from embedding_store import embedding_store
 
 test_folder = "public_test/"
 test_files = [
@@ -29,9 +31,14 @@ with open(raw_test_file, "r", encoding="utf8") as f:
 
 danbooru = danbooru_recognizer()
 danbooru.load()
-res = danbooru.inference_gpu(["test/raw/" + y.strip() for y in file_paths], output_dump="")
-dump_pickle_path = 'private_animated.pickle'
+cache = embedding_cache("danbooru_cache.sqlite")
+store = embedding_store("private_animated_store", dtype="float16")
+res = danbooru.inference_gpu(["test/raw/" + y.strip() for y in file_paths], output_dump="",
+                             cache=cache, store=store)
+cache.evict_missing()
+cache.close()
+# dump_pickle_path = 'private_animated.pickle'
 # for result, res_dict in res:
 #     print(result, res_dict)
-danbooru.dump_pickle(res, dump_pickle_path)
+# danbooru.dump_pickle(res, dump_pickle_path)
     
\ No newline at end of file
@@ -1,40 +1,58 @@
 from PIL import Image
 import numpy as np
-import torch
-import TorchDeepDanbooru.deep_danbooru_model as deep_danbooru_model
-from torch.amp.autocast_mode import autocast
 import os
-from typing import Optional
+import itertools
+from typing import Callable, Iterable, Iterator, Optional, TYPE_CHECKING
+from functools import partial
 import json
 import time
 from util import check_file
-import imageio.v3 as iio
-import cv2
+from prefetch import prefetch_loader
+from embedding_cache import embedding_cache
+from embedding_store import embedding_store
+from sparse_results import sparse_results
+from sinks import result_sink, store_sink, text_sink
+import frames
+import metrics
+from frames import get_video_info
+from media_probe import media_prober
 
-from tqdm import tqdm
-import subprocess
+if TYPE_CHECKING:
+    import torch
 
-def get_video_info(video_path: str):
-    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', video_path]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    info = json.loads(result.stdout)
-    duration_str = info['streams'][0]['tags']['DURATION']
-    hours, minutes, seconds = map(float, duration_str.split(':'))
-    total_seconds = hours * 3600 + minutes * 60 + seconds
-    fps = eval(info['streams'][0]['avg_frame_rate'])
-    return total_seconds, fps
 
 model_path = "model\\DeepDanbooru\\model-resnet_custom_v3.pt"
+BACKENDS = ("torch", "onnx")
 
 
-def set_device():
-    if torch.cuda.is_available():
-        print("CUDA IS AVAILABLE. GPU MODE")
-        return "cuda"
-    else:
-        print("CUDA NOT AVAILABLE. CPU MODE")
-        return "cpu"
+def tag_agreement(reference: list[tuple[np.ndarray, dict]], candidate: list[tuple[np.ndarray, dict]]) -> dict:
+    """How closely `candidate` results match `reference` results of the same files
 
+    Returns:
+        dict: {identical (files with the same tags and rating), files, jaccard (mean over
+        General + Character tags), max_diff (largest probability difference), changed
+        [(Filepath, missing tags, extra tags)]}
+    """
+    identical = 0
+    jaccards = []
+    max_diff = 0.0
+    changed = []
+    for (a, a_dict), (b, b_dict) in zip(reference, candidate):
+        tags_a = set(a_dict["General"]) | set(a_dict["Character"])
+        tags_b = set(b_dict["General"]) | set(b_dict["Character"])
+        jaccards.append(len(tags_a & tags_b) / max(len(tags_a | tags_b), 1))
+        max_diff = max(max_diff, float(np.max(np.abs(a.astype(np.float32) - b.astype(np.float32)))))
+        if tags_a == tags_b and a_dict["Rating"] == b_dict["Rating"]:
+            identical += 1
+        else:
+            changed.append((a_dict["Filepath"], sorted(tags_a - tags_b), sorted(tags_b - tags_a)))
+    return {
+        "identical": identical,
+        "files": len(jaccards),
+        "jaccard": float(np.mean(jaccards)) if jaccards else 1.0,
+        "max_diff": max_diff,
+        "changed": changed
+    }
 
         
 class danbooru_recognizer:
@@ -44,33 +62,61 @@ class danbooru_recognizer:
         ```
         recognizer = danbooru_recognizer()
         recognizer.load()
-        res = danbooru.inference_gpu([])
+        res = danbooru.inference_gpu([], batch_size=16)
         recognizer.dump_pickle(res, 'test.pickle')
         ```
     """
     SIZE = 512
     def __init__(self, model_path: Optional[str] = None,
                  general_thres=0.9, char_thres=0.5,
-                 config_path: Optional[str] = None) -> None:
+                 config_path: Optional[str] = None,
+                 prober: Optional[media_prober] = None,
+                 reduced_decode=True, max_decode_pixels=100_000_000,
+                 precision: Optional[str] = None, num_threads: Optional[int] = None,
+                 channels_last: Optional[bool] = None, backend="torch") -> None:
         """
 
         Args:
-            model_path (Optional[str], optional): Defaults to `model\\DeepDanbooru\\model-resnet_custom_v3.pt`.
+            model_path (Optional[str], optional): Defaults to `model\\DeepDanbooru\\model-resnet_custom_v3.pt`,
+                or `model\\DeepDanbooru\\model-resnet_custom_v3.onnx` for the onnx backend.
             general_thres (float, optional): Threshold for general tags (index 0-6890). Defaults to 0.9 (90% confidence).
             char_thres (float, optional): Threshold for character tags (index 6891-9172). Defaults to 0.5 (50% confidence).
             config_path (Optional[str], optional): Defaults to `model\\DeepDanbooru\\categories.json`.
+            prober (Optional[media_prober], optional): Video duration/fps lookups. Pass one with a
+                cache path to keep probes across runs. Defaults to the shared in-memory `frames.prober`.
+            reduced_decode (bool, optional): Decode JPEGs at the smallest DCT scale still at least
+                SIZE x SIZE instead of at native resolution. Defaults to True.
+            max_decode_pixels (int, optional): Decoded pixels held at once across loader threads.
+                Defaults to 100_000_000 (~300MB of RGB).
+            precision, num_threads, channels_last: See `torch_backend`. The onnx backend only
+                takes num_threads and always runs fp32.
+            backend (str, optional): "torch" (TorchDeepDanbooru) or "onnx" (ONNX Runtime on CPU,
+                without importing torch). Defaults to "torch".
         """
-        self.model = deep_danbooru_model.DeepDanbooruModel()
-        self.device = set_device()
-        
+        assert backend in BACKENDS, f"Unknown backend {backend}, expected one of {BACKENDS}"
         if model_path is None:
-            model_path = "model\\DeepDanbooru\\model-resnet_custom_v3.pt"
+            if backend == "onnx":
+                model_path = "model\\DeepDanbooru\\model-resnet_custom_v3.onnx"
+            else:
+                model_path = "model\\DeepDanbooru\\model-resnet_custom_v3.pt"
             assert os.path.isfile(model_path), "Model file not found"
-            
+        
+        if backend == "onnx":
+            from onnx_backend import onnx_backend
+            self.backend = onnx_backend(model_path, num_threads)
+        else:
+            from torch_backend import torch_backend
+            self.backend = torch_backend(model_path, precision, num_threads, channels_last)
+        self.device = self.backend.device
+        self.precision = self.backend.precision
+        
         self.model_path = model_path
         self.general_thres = general_thres
         self.char_thres = char_thres
         self.video_ext = ("webm", "mp4", "mov")
+        self.prober = prober if prober is not None else frames.prober
+        self.reduced_decode = reduced_decode
+        self.decode_budget = frames.pixel_budget(max_decode_pixels)
         
         self.unsupported_ext = {
             "blacklist": ("part")
@@ -79,103 +125,250 @@ class danbooru_recognizer:
         
         if config_path is None:
             config_path = "model\\DeepDanbooru\\categories.json"
-            assert os.path.isfile(config_path), "Config file not found"
+        assert os.path.isfile(config_path), "Config file not found"
             
-            with open(config_path, "r") as config:
-                categories = json.load(config)
-                self.char_index = categories[1]["start_index"]
-                self.rating_index = categories[2]["start_index"]
+        with open(config_path, "r") as config:
+            categories = json.load(config)
+            self.char_index = categories[1]["start_index"]
+            self.rating_index = categories[2]["start_index"]
+        self.general_slice = slice(0, self.char_index)
+        self.char_slice = slice(self.char_index, self.rating_index)
+        self.rating_slice = slice(self.rating_index, None)
+        self._tag_array: Optional[np.ndarray] = None
 
     
-    def load(self, is_eval = True):
-        st = time.time()
-        self.model.load_state_dict(torch.load(self.model_path))
-        if is_eval:
-            self.model.eval()
-            self.model.half()
-            if self.device == "cuda":
-                self.model.cuda()
-        print(f"Model loaded in {time.time() - st:.2f}s")
+    def load(self, is_eval = True, calibration_paths: Optional[list[str]] = None):
+        """
+        Args:
+            calibration_paths (Optional[list[str]], optional): Files run through the model to set
+                activation ranges for static "int8" quantization. A few dozen typical files are enough.
+        """
+        calibration_arrays = None
+        if calibration_paths:
+            calibration_arrays = (self.load_arrays(file_path) for file_path in calibration_paths)
+        self.backend.load(is_eval, calibration_arrays)
                    
     def preprocess_image(self, image: Image.Image, size: tuple[int, int]) -> Image.Image:
         return image.convert("RGB").resize(size)
     
-    def image_to_array(self, image: Image.Image) -> np.ndarray:
+    def image_to_array(self, image: Image.Image | np.ndarray) -> np.ndarray:
         return np.expand_dims(np.array(image, dtype=np.float32), 0) / 255
     
-    def array_to_tensor(self, array: np.ndarray) -> torch.Tensor:
-        return torch.from_numpy(array).cuda()
+    def array_to_tensor(self, array: np.ndarray) -> "torch.Tensor":
+        return self.backend.to_tensor(array)
         
-    def image_to_tensor(self, image: Image.Image) -> torch.Tensor:
+    def image_to_tensor(self, image: Image.Image) -> "torch.Tensor":
         image = self.preprocess_image(image, (self.SIZE, self.SIZE))
         img_to_array = self.image_to_array(image)
         array_to_tensor = self.array_to_tensor(img_to_array)
         return array_to_tensor
             
-    def extract_frames_iio(self, video_path: str, n=5, duration=None, fps=None) -> list[torch.Tensor]:
-        if duration is None or fps is None:
-            duration, fps = get_video_info(video_path)
-        frames = []
-        for i in tqdm(range(n), desc=f'IIO: Reading frames from {os.path.basename(video_path)}'):
-            t = (i+1) * duration / (n+1)
-            frame_idx = int(t * fps)
-            frame = iio.imread(video_path, index=frame_idx)
-            frame = Image.fromarray(frame)
-            frame = self.image_to_tensor(frame)
-            frames.append(frame)
-        return frames
-        
-    def extract_frames(self, video_path: str, n=5) -> list[torch.Tensor]:
-        duration, fps = get_video_info(video_path)
-        cap = cv2.VideoCapture(video_path)
-        frames = []
-        for i in tqdm(range(n), desc=f'CV2: Reading frames from {os.path.basename(video_path)}'):
-            t = (i + 1) * duration / (n + 1)
-            frame_idx = int(t * fps)
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = cap.read()
-            if ret:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frame = cv2.resize(frame, (self.SIZE, self.SIZE))
-                frame = np.expand_dims(frame.astype(np.float32), 0) / 255
-                frames.append(frame)
-            else:
-                print(f"CV2 Error. {duration=}, {fps=}  Switching to ImageIO-ffmpeg")
-                break
+    def extract_frames_iio_arrays(self, video_path: str, n=5, duration=None, fps=None) -> list[np.ndarray]:
+        rgb_frames = frames.extract_frames_iio(video_path, n, (self.SIZE, self.SIZE), duration, fps)
+        return [self.image_to_array(frame) for frame in rgb_frames]
 
-        cap.release()
-        if frames:
-            frames = self.arrays_to_tensors(frames)
-            return frames
-        return self.extract_frames_iio(video_path, duration=duration, fps=fps)
+    def extract_frames_iio(self, video_path: str, n=5, duration=None, fps=None) -> list["torch.Tensor"]:
+        return self.arrays_to_tensors(self.extract_frames_iio_arrays(video_path, n, duration, fps))
         
+    def extract_frames_arrays(self, video_path: str, n=5) -> list[np.ndarray]:
+        rgb_frames = frames.extract_frames(video_path, n, (self.SIZE, self.SIZE))
+        return [self.image_to_array(frame) for frame in rgb_frames]
+
+    def extract_frames(self, video_path: str, n=5) -> list["torch.Tensor"]:
+        return self.arrays_to_tensors(self.extract_frames_arrays(video_path, n))
     
-    def extract_frames_gif(self, gif_path: str, n=5) -> list[torch.Tensor]:
-        frames = []
-        with Image.open(gif_path) as im:
-            for i in tqdm(range(n), desc=f'PIL: Reading frames from {os.path.basename(gif_path)}'):
-                im.seek(im.n_frames // n * i)
-                frame = self.image_to_tensor(im)
-                frames.append(frame)
-        return frames
+    def extract_frames_gif_arrays(self, gif_path: str, n=5) -> list[np.ndarray]:
+        rgb_frames = frames.extract_frames_gif(gif_path, n, (self.SIZE, self.SIZE))
+        return [self.image_to_array(frame) for frame in rgb_frames]
+
+    def extract_frames_gif(self, gif_path: str, n=5) -> list["torch.Tensor"]:
+        return self.arrays_to_tensors(self.extract_frames_gif_arrays(gif_path, n))
+
+    def load_arrays(self, file_path: str) -> np.ndarray:
+        """Preprocessed input rows for one file
+
+        Returns:
+            np.ndarray: (frames, SIZE, SIZE, 3) float32. Images give a single row,
+            gifs and videos give one row per sampled frame.
+        """
+        if file_path.endswith("gif") or any(file_path.endswith(ext) for ext in self.video_ext):
+            duration = None if file_path.endswith("gif") else self.prober.get(file_path)[0]
+            rgb_frames = frames.sample_frames(file_path, size=(self.SIZE, self.SIZE), duration=duration)
+            return rgb_frames.astype(np.float32) / 255
+        image = frames.load_image(file_path, (self.SIZE, self.SIZE), self.decode_budget, self.reduced_decode)
+        return self.image_to_array(image)
     
-    def _predict(self, tensor: torch.Tensor) -> np.ndarray:
-        result = self.model(tensor)[0].detach().cpu().numpy()
-        return result
+    def _predict(self, tensor: "torch.Tensor") -> np.ndarray:
+        return self.backend.predict_tensor(tensor)[0]
     
-    def arrays_to_tensors(self, arrays: list[np.ndarray]) -> list[torch.Tensor]:
-        tensors = [torch.from_numpy(array).cuda() for array in arrays]
+    def _predict_batch(self, array: np.ndarray) -> np.ndarray:
+        """One forward pass over a stacked (N, SIZE, SIZE, 3) array, returns (N, tags)"""
+        return self.backend.predict(array)
+    
+    def arrays_to_tensors(self, arrays: list[np.ndarray]) -> list["torch.Tensor"]:
+        tensors = [self.array_to_tensor(array) for array in arrays]
         return tensors
         
-    def _predict_multi_avg(self, tensors: list[torch.Tensor]) -> np.ndarray:
+    def _predict_multi_avg(self, tensors: list["torch.Tensor"]) -> np.ndarray:
         results = [self._predict(tensor) for tensor in tensors]
         result = np.mean(results, axis=0)
         return result
     
+    def _predict_files(self, batch: list[tuple[int, str, Optional[np.ndarray], Optional[np.ndarray]]]
+                       ) -> list[tuple[int, str, np.ndarray]]:
+        """Run every row of a file batch in one forward pass and split the output back per file
+
+        Args:
+            batch (list[tuple[int, str, Optional[np.ndarray], Optional[np.ndarray]]]):
+                (index, file path, rows from `load_arrays`, cached result). Entries with a cached
+                result are passed through without touching the model.
+
+        Returns:
+            list[tuple[int, str, np.ndarray]]: (index, file path, result). Multi-frame files are averaged.
+        """
+        rows = [arrays for _, _, arrays, cached in batch if cached is None]
+        results = self._predict_batch(np.concatenate(rows, axis=0)) if rows else None
+        out = []
+        start = 0
+        for i, file_path, arrays, cached in batch:
+            if cached is not None:
+                out.append((i, file_path, cached))
+                continue
+            end = start + len(arrays)
+            if len(arrays) == 1:
+                result = results[start]
+            else:
+                result = np.mean(results[start:end], axis=0)
+            out.append((i, file_path, result))
+            start = end
+        return out
+    
+    def _load_with_cache(self, cache: Optional[embedding_cache], file_path: str
+                         ) -> tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        if cache is not None:
+            cached = cache.get(file_path)
+            if cached is not None:
+                metrics.count("cache_hits_total")
+                return None, cached
+        with metrics.timer("load_file"):
+            return self.load_arrays(file_path), None
+    
+    def _load_or_error(self, cache: Optional[embedding_cache], file_path: str
+                       ) -> tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[Exception]]:
+        try:
+            return *self._load_with_cache(cache, file_path), None
+        except Exception as e:
+            metrics.count("failures_total", stage="load_file", type=type(e).__name__)
+            return None, None, e
+    
+    def _probe_ahead(self, file_paths: Iterable[str], chunk_size=256) -> Iterator[str]:
+        """Pass paths through, probing the videos of each chunk concurrently before it is handed on"""
+        file_paths = iter(file_paths)
+        while chunk := list(itertools.islice(file_paths, chunk_size)):
+            videos = [file_path for file_path in chunk
+                      if any(file_path.endswith(ext) for ext in self.video_ext) and os.path.exists(file_path)]
+            if videos:
+                self.prober.probe_many(videos)
+            yield from chunk
+    
+    def inference_stream(self, file_paths: Iterable[str],
+                         batch_size=1, num_workers=0, queue_depth=8,
+                         cache: Optional[embedding_cache] = None,
+                         sinks: Iterable[result_sink] = (),
+                         on_error: Optional[Callable[[int, str, Exception], None]] = None
+                         ) -> Iterator[tuple[int, np.ndarray, dict]]:
+        """Danbooru tags yielded as they are produced, with constant memory
+
+        Nothing is accumulated: `file_paths` can be a lazy iterable, at most one
+        batch plus the prefetch queue is held at a time, and each parsed batch is
+        handed to every sink before its results are yielded. Sinks are closed
+        when the stream ends.
+
+        Usage:
+            ```
+            sinks = [jsonl_sink("tags.jsonl"), store_sink(embedding_store("private_store"))]
+            for i, result, res_dict in recognizer.inference_stream(iter_files(folder), sinks=sinks):
+                ...
+            ```
+
+        Args:
+            batch_size, num_workers, queue_depth, cache: See `inference_gpu`.
+            sinks (Iterable[result_sink], optional): Written to batch by batch, see `sinks.py`.
+            on_error (Optional[Callable[[int, str, Exception], None]], optional): Called with
+                (input index, file path, exception) for a file that fails to decode, which is then
+                skipped. Without it the exception ends the stream.
+
+        Yields:
+            tuple[int, np.ndarray, dict]: (input index, result, result_dict)
+        """
+        sinks = list(sinks)
+        try:
+            with self.backend.inference_context():
+                batch = []
+                batch_rows = 0
+                loader = prefetch_loader(partial(self._load_or_error, cache), self._probe_ahead(file_paths),
+                                         num_workers, queue_depth)
+                for i, file_path, (arrays, cached, error) in loader:
+                    print(file_path)
+                    if error is not None:
+                        if on_error is None:
+                            raise error
+                        on_error(i, file_path, error)
+                        continue
+                    batch.append((i, file_path, arrays, cached))
+                    if arrays is not None:
+                        batch_rows += len(arrays)
+                    # Cache hits add no rows, so they count by file or a cached run would never flush
+                    if batch_rows >= batch_size or len(batch) >= batch_size:
+                        yield from self._flush(batch, cache, sinks)
+                        batch = []
+                        batch_rows = 0
+                if batch:
+                    yield from self._flush(batch, cache, sinks)
+        finally:
+            if cache is not None:
+                cache.commit()
+            for sink in sinks:
+                sink.close()
+    
+    def _flush(self, batch: list[tuple[int, str, Optional[np.ndarray], Optional[np.ndarray]]],
+               cache: Optional[embedding_cache], sinks: list[result_sink]
+               ) -> list[tuple[int, np.ndarray, dict]]:
+        predicted = self._predict_files(batch)
+        if cache is not None:
+            for (_, file_path, _, cached), (_, _, result) in zip(batch, predicted):
+                if cached is None:
+                    cache.put(file_path, result)
+        with metrics.timer("parse"):
+            res_dicts = self.parse_results_to_dicts(np.stack([result for _, _, result in predicted]),
+                                                    [file_path for _, file_path, _ in predicted])
+        parsed = [(i, result, res_dict) for (i, _, result), res_dict in zip(predicted, res_dicts)]
+        for sink in sinks:
+            with metrics.timer("sink_write", sink=type(sink).__name__):
+                sink.write(parsed)
+        metrics.count("files_total", len(parsed))
+        metrics.count("rows_total", sum(len(arrays) for _, _, arrays, _ in batch if arrays is not None))
+        return parsed
+    
     def inference_gpu(self, file_paths: list[str],
-                      verbose=True, output_dump="output_dump_danbooru.txt"
+                      verbose=True, output_dump="output_dump_danbooru.txt",
+                      batch_size=1, num_workers=0, queue_depth=8,
+                      cache: Optional[embedding_cache] = None,
+                      store: Optional[embedding_store] = None
                       ) -> list[tuple[np.ndarray, dict]]:
-        """Danbooru tags from list of image paths
+        """Danbooru tags from list of image paths, collected from `inference_stream`
+
+        Args:
+            batch_size (int, optional): Number of rows (images or sampled gif/video frames) stacked
+                into one forward pass. Files are never split across passes. Defaults to 1.
+            num_workers (int, optional): Threads decoding and resizing ahead of the model.
+                0 decodes on the model thread. Defaults to 0.
+            queue_depth (int, optional): Max decoded files waiting for the model when
+                `num_workers` > 0. Bounds memory use. Defaults to 8.
+            cache (Optional[embedding_cache], optional): Results of unchanged files are read
+                from the cache instead of running the model, new results are written to it.
+            store (Optional[embedding_store], optional): Results are appended to the store
+                batch by batch as they are produced.
 
         Returns:
             list[tuple[np.ndarray, dict]]: list of pairs of
@@ -185,9 +378,7 @@ class danbooru_recognizer:
                 result_dict [{Filepath, Character (tags), General (tags), Rating}]
         """
         st = time.time()
-        res = []
-        i = 0
-        output_dump_file = None
+        sinks = []
         if output_dump:
             if os.path.isfile(output_dump):
                 if check_file(output_dump):
@@ -196,68 +387,141 @@ class danbooru_recognizer:
                     tmp = output_dump.split(".")
                     output_dump = tmp[0] + f"_new.{tmp[-1]}"
             print(f"Dumping to {output_dump}")
-            output_dump_file = open(output_dump, "a", encoding=self.encoding)
-            
-        with torch.no_grad(), autocast(self.device):
-            print(f"Processing {len(file_paths)} files")
-            for i, file_path in enumerate(file_paths):
-                print(file_path)
-                if os.path.exists(file_path):
-                    if file_path.endswith("gif"):
-                        image_arrays = self.extract_frames_gif(file_path)
-                        result = self._predict_multi_avg(image_arrays)
-                    elif any(file_path.endswith(ext) for ext in self.video_ext): 
-                        image_arrays = self.extract_frames(file_path)
-                        result = self._predict_multi_avg(image_arrays)
-                            
-                    else:
-                        img = Image.open(file_path)
-                        image_tensor = self.image_to_tensor(img)
-                        result = self._predict(image_tensor)
-
-                    res_dict = self.parse_result_to_dict(result, file_path)
-                    res.append((result, res_dict))
-                    
-                    if verbose:
-                        print(f"{i:<3}| {res_dict}")
-                    
-                    if output_dump_file:
-                        output_dump_file.write(f"{i:<3}| {res_dict}\n")
-                        output_dump_file.flush()
-                                 
-            print(f"{len(file_paths)} images done in {time.time() - st:.2f}s")
-            
-        if output_dump_file is not None:
-            output_dump_file.close()
+            sinks.append(text_sink(output_dump, self.encoding))
+        if store is not None:
+            sinks.append(store_sink(store))
+        
+        print(f"Processing {len(file_paths)} files")
+        res = []
+        for i, result, res_dict in self.inference_stream(file_paths, batch_size, num_workers, queue_depth,
+                                                         cache, sinks):
+            if verbose:
+                print(f"{i:<3}| {res_dict}")
+            res.append((result, res_dict))
+        print(f"{len(file_paths)} images done in {time.time() - st:.2f}s")
+        metrics.print_summary()
         return res
     
     def get_tag_from_index(self, index: int) -> str:
-        return self.model.tags[index]
+        return self.backend.tags[index]
     
-    def parse_result_to_dict(self, result: np.ndarray, filepath: str) -> dict:
-        char_tags = []
-        gen_tags = []
-        ratings = []
+    @property
+    def tag_array(self) -> np.ndarray:
+        if self._tag_array is None or len(self._tag_array) != len(self.backend.tags):
+            self._tag_array = np.array(self.backend.tags, dtype=object)
+        return self._tag_array
+    
+    def _select_tags(self, probabilities: np.ndarray, threshold: float, offset: int) -> list[list[str]]:
+        """Per row, tags at or above `threshold` ordered by probability descending
         
-        for index, probability in enumerate(result):
-            tag = self.get_tag_from_index(index)
-            if index < self.char_index:
-                if probability >= self.general_thres:
-                    gen_tags.append((tag, probability))
-                continue
-            elif index < self.rating_index:
-                if probability >= self.char_thres:
-                    char_tags.append((tag, probability))
-                continue
-            else:
-                ratings.append((tag, probability))
-               
-        return {
+        Only the selected cells are sorted: one lexsort by (row, -probability),
+        stable so equal probabilities keep index order, then split by row counts.
+        """
+        rows, cols = np.nonzero(probabilities >= threshold)
+        return self._split_tags(rows, cols + offset, probabilities[rows, cols], len(probabilities))
+    
+    def _split_tags(self, rows: np.ndarray, cols: np.ndarray, probabilities: np.ndarray, n: int) -> list[list[str]]:
+        """Selected (row, tag index, probability) cells to per-row tag lists, by probability descending"""
+        order = np.lexsort((-probabilities, rows))
+        names = self.tag_array[cols[order]]
+        counts = np.bincount(rows, minlength=n)
+        return [x.tolist() for x in np.split(names, np.cumsum(counts)[:-1])]
+    
+    def parse_sparse_to_dicts(self, sparse: sparse_results, start=0, stop: Optional[int] = None,
+                              general_thres: Optional[float] = None,
+                              char_thres: Optional[float] = None) -> list[dict]:
+        """`parse_results_to_dicts` for rows [start, stop) of a `sparse_results`, read from its CSR arrays
+
+        Dropped entries count as 0, so a threshold below the sparse floor can only
+        find the entries that were kept. Rows without kept rating entries get the
+        first rating, keep them with `always=recognizer.rating_slice`.
+        """
+        if general_thres is None:
+            general_thres = self.general_thres
+        if char_thres is None:
+            char_thres = self.char_thres
+        stop = len(sparse) if stop is None else min(stop, len(sparse))
+        rows, cols, values = sparse.coo(start, stop)
+        n = stop - start
+        tags = []
+        for tag_slice, threshold in ((self.general_slice, general_thres), (self.char_slice, char_thres)):
+            mask = (cols >= tag_slice.start) & (cols < tag_slice.stop) & (values >= threshold)
+            tags.append(self._split_tags(rows[mask], cols[mask], values[mask], n))
+        general, char = tags
+        in_rating = cols >= self.rating_index
+        rating_block = np.zeros((n, sparse.dim - self.rating_index), dtype=np.float32)
+        rating_block[rows[in_rating], cols[in_rating] - self.rating_index] = values[in_rating]
+        ratings = self.tag_array[np.argmax(rating_block, axis=1) + self.rating_index]
+        return [{
+            "Filepath" : filepath,
+            "Character": char[i],
+            "General"  : general[i],
+            "Rating"  : ratings[i]
+        } for i, filepath in enumerate(record.get("Filepath") for record in sparse.records()[start:stop])]
+    
+    def parse_results_to_dicts(self, results: np.ndarray, filepaths: list[str],
+                               general_thres: Optional[float] = None,
+                               char_thres: Optional[float] = None) -> list[dict]:
+        """`parse_result_to_dict` over a (N, tags) result matrix at once
+
+        Args:
+            general_thres (Optional[float], optional): Defaults to `self.general_thres`.
+            char_thres (Optional[float], optional): Defaults to `self.char_thres`.
+        """
+        if general_thres is None:
+            general_thres = self.general_thres
+        if char_thres is None:
+            char_thres = self.char_thres
+        results = np.asarray(results)
+        general = self._select_tags(results[:, self.general_slice], general_thres, self.general_slice.start)
+        char = self._select_tags(results[:, self.char_slice], char_thres, self.char_slice.start)
+        ratings = self.tag_array[np.argmax(results[:, self.rating_slice], axis=1) + self.rating_index]
+        return [{
             "Filepath" : filepath,
-            "Character": self.extract_strings(self.sort_by_probability_descending(char_tags)),
-            "General"  : self.extract_strings(self.sort_by_probability_descending(gen_tags)),
-            "Rating"  : self.get_max_probability_item(ratings)[0]
-        }    
+            "Character": char[i],
+            "General"  : general[i],
+            "Rating"  : ratings[i]
+        } for i, filepath in enumerate(filepaths)]
+    
+    def parse_result_to_dict(self, result: np.ndarray, filepath: str) -> dict:
+        return self.parse_results_to_dicts(result[None], [filepath])[0]
+    
+    def rethreshold(self, results: list[tuple[np.ndarray, dict]] | embedding_store | sparse_results,
+                    general_thres: Optional[float] = None, char_thres: Optional[float] = None,
+                    chunk_size=65536) -> list[dict]:
+        """Re-apply thresholds to stored results without running the model
+
+        Usage:
+            ```
+            res_dicts = recognizer.rethreshold(embedding_store("public_test_store"), general_thres=0.7)
+            ```
+
+        Args:
+            results (list[tuple[np.ndarray, dict]] | embedding_store | sparse_results): Output of
+                `inference_gpu`, a store, or sparse results, which are thresholded without densifying.
+            chunk_size (int, optional): Rows parsed at once, bounds memory on large stores.
+
+        Returns:
+            list[dict]: New result_dict for every row, in order.
+        """
+        if isinstance(results, sparse_results):
+            res_dicts = []
+            for start in range(0, len(results), chunk_size):
+                res_dicts.extend(self.parse_sparse_to_dicts(results, start, start + chunk_size,
+                                                            general_thres, char_thres))
+            return res_dicts
+        if isinstance(results, embedding_store):
+            matrix = results.matrix()
+            filepaths = results.file_paths()
+        else:
+            matrix = np.stack([result for result, _ in results]) if results else np.empty((0, 0))
+            filepaths = [res_dict["Filepath"] for _, res_dict in results]
+        res_dicts = []
+        for start in range(0, len(filepaths), chunk_size):
+            res_dicts.extend(self.parse_results_to_dicts(
+                matrix[start:start + chunk_size], filepaths[start:start + chunk_size],
+                general_thres, char_thres))
+        return res_dicts
                                 
     def get_max_probability_item(self, lst: list[tuple[str, float]]) -> tuple[str, float]:
         max_item = max(lst, key=lambda x: x[1])
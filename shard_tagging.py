@@ -0,0 +1,224 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import time
+from collections import deque
+from typing import Optional
+
+from embedding_store import embedding_store
+from sinks import store_sink
+
+
+def _tag_worker(worker_id: int, shard_dir: str, tasks, events,
+                recognizer_kwargs: dict, batch_size: int, num_workers: int, store_dtype: str):
+    """Loads the model once, then tags every unit it is sent into its own shard until it gets None"""
+    from recognizer import danbooru_recognizer
+
+    recognizer = danbooru_recognizer(**recognizer_kwargs)
+    recognizer.load()
+    store = embedding_store(shard_dir, dtype=store_dtype)
+    events.put(("ready", worker_id, None))
+    while (unit := tasks.get()) is not None:
+        unit_id, file_paths = unit
+        try:
+            for _ in recognizer.inference_stream(file_paths, batch_size, num_workers, sinks=[store_sink(store)]):
+                pass
+        except Exception as e:
+            events.put(("failed", worker_id, (unit_id, f"{type(e).__name__}: {e}")))
+        else:
+            events.put(("done", worker_id, unit_id))
+
+
+class shard_tagger:
+    """Tags a file list with several model processes, one result shard each
+
+    The list is cut into units of `unit_size` files. Every worker process loads
+    the model once with `threads_per_worker` intra-op threads and is sent one
+    unit at a time, writing its results to its own `embedding_store` shard under
+    `out_dir/shards`. When a worker dies or a unit raises, only the files of that
+    unit missing from its shard are queued again, split in half each time so a
+    file that keeps failing ends up alone and is given up on after `max_attempts`.
+    A dead worker is replaced by a new process with a new shard. The shards are
+    merged into one store at `out_dir/merged` in input order.
+
+    `run` starts from empty shards, clearing what an earlier run left in
+    `out_dir`. With `resume=True` the earlier shards are kept, the files they
+    already hold are skipped and new workers get new shards. `merged` is
+    rebuilt from the shards every time.
+
+    Usage:
+        ```
+        if __name__ == "__main__":
+            tagger = shard_tagger("private_store", workers=8, recognizer_kwargs={"backend": "onnx"})
+            store = tagger.run(file_paths)
+            store = tagger.run(file_paths, resume=True)  # after an interrupted run
+        ```
+    """
+    SHARDS = "shards"
+    MERGED = "merged"
+    FAILED = "failed.txt"
+    def __init__(self, out_dir: str, workers=4, threads_per_worker: Optional[int] = None,
+                 unit_size=256, batch_size=8, loader_threads=2, max_attempts=2,
+                 store_dtype="float16", recognizer_kwargs: Optional[dict] = None) -> None:
+        """
+
+        Args:
+            threads_per_worker (Optional[int], optional): Intra-op threads per model.
+                Defaults to cpu_count // workers.
+            loader_threads (int, optional): Decode threads per worker, see `inference_gpu` num_workers.
+            max_attempts (int, optional): Failures of a single file before it is given up on.
+            recognizer_kwargs (Optional[dict], optional): Passed to `danbooru_recognizer` in every worker.
+        """
+        self.out_dir = out_dir
+        self.shard_root = os.path.join(out_dir, self.SHARDS)
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.unit_size = unit_size
+        self.batch_size = batch_size
+        self.loader_threads = loader_threads
+        self.max_attempts = max_attempts
+        self.store_dtype = store_dtype
+        self.recognizer_kwargs = dict(recognizer_kwargs or {})
+        self.recognizer_kwargs.setdefault("num_threads", self.threads_per_worker)
+
+        self._ctx = mp.get_context("spawn")
+        self._events = self._ctx.Queue()
+        self._procs: dict[int, tuple] = {}  # worker id: (process, task queue, shard dir)
+        self._assigned: dict[int, Optional[int]] = {}
+        self._ready: set[int] = set()
+        self._next_worker = 0
+
+    def _spawn(self) -> int:
+        worker_id = self._next_worker
+        self._next_worker += 1
+        shard_dir = os.path.join(self.shard_root, f"shard_{worker_id:03}")
+        tasks = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_tag_worker, daemon=True,
+            args=(worker_id, shard_dir, tasks, self._events, self.recognizer_kwargs,
+                  self.batch_size, self.loader_threads, self.store_dtype))
+        proc.start()
+        self._procs[worker_id] = (proc, tasks, shard_dir)
+        self._assigned[worker_id] = None
+        return worker_id
+
+    def _unfinished(self, worker_id: int, file_paths: list[str]) -> list[str]:
+        finished = set(embedding_store(self._procs[worker_id][2]).file_paths())
+        return [file_path for file_path in file_paths if file_path not in finished and os.path.exists(file_path)]
+
+    def _prepare(self, file_paths: list[str], resume: bool) -> list[str]:
+        """Clear or reuse the output of an earlier run, returns the files still to tag"""
+        merged_dir = os.path.join(self.out_dir, self.MERGED)
+        if os.path.isdir(merged_dir):
+            shutil.rmtree(merged_dir)
+        failed_path = os.path.join(self.out_dir, self.FAILED)
+        if os.path.isfile(failed_path):
+            os.remove(failed_path)
+        shard_dirs = sorted(os.listdir(self.shard_root)) if os.path.isdir(self.shard_root) else []
+        if not resume:
+            if shard_dirs:
+                print(f"Clearing {len(shard_dirs)} shards of an earlier run in {self.shard_root}")
+                shutil.rmtree(self.shard_root)
+            os.makedirs(self.shard_root, exist_ok=True)
+            return file_paths
+        finished = set()
+        for shard in shard_dirs:
+            finished.update(embedding_store(os.path.join(self.shard_root, shard)).file_paths())
+        # New workers must not append to a shard of the earlier run
+        self._next_worker = max((int(shard.rsplit("_", 1)[1]) + 1 for shard in shard_dirs), default=0)
+        todo = [file_path for file_path in file_paths if file_path not in finished]
+        print(f"Resuming: {len(file_paths) - len(todo)} files already in {len(shard_dirs)} shards")
+        return todo
+
+    def run(self, file_paths: list[str], resume=False) -> embedding_store:
+        st = time.time()
+        todo = self._prepare(file_paths, resume)
+        units: dict[int, tuple[list[str], int]] = {}  # unit id: (file paths, attempts)
+        for start in range(0, len(todo), self.unit_size):
+            units[len(units)] = (todo[start:start + self.unit_size], 0)
+        pending: deque[int] = deque(units)
+        unit_ids = itertools.count(len(units))
+        failed: list[tuple[str, str]] = []
+        done = 0
+
+        def requeue(worker_id: int, unit_id: int, reason: str):
+            unit_paths, attempts = units.pop(unit_id)
+            remaining = self._unfinished(worker_id, unit_paths)
+            print(f"Unit {unit_id} failed on worker {worker_id} ({reason}), "
+                  f"{len(remaining)}/{len(unit_paths)} files left")
+            if len(remaining) == 1 and attempts + 1 >= self.max_attempts:
+                failed.append((remaining[0], reason))
+                return
+            middle = (len(remaining) + 1) // 2
+            for part in (remaining[:middle], remaining[middle:]):
+                if part:
+                    new_id = next(unit_ids)
+                    units[new_id] = (part, attempts + 1)
+                    pending.appendleft(new_id)
+
+        def reap():
+            for worker_id, (proc, _, _) in list(self._procs.items()):
+                if proc.is_alive():
+                    continue
+                if worker_id not in self._ready:
+                    raise RuntimeError(f"Worker {worker_id} exited with {proc.exitcode} while loading the model")
+                unit_id = self._assigned.pop(worker_id)
+                if unit_id is not None and unit_id in units:
+                    requeue(worker_id, unit_id, f"worker exited with {proc.exitcode}")
+                del self._procs[worker_id]
+                if units:
+                    self._spawn()
+
+        for _ in range(min(self.workers, len(units))):
+            self._spawn()
+        print(f"Tagging {len(todo)} files in {len(units)} units with {len(self._procs)} workers "
+              f"x {self.threads_per_worker} threads")
+
+        while units:
+            try:
+                kind, worker_id, payload = self._events.get(timeout=1)
+            except queue.Empty:
+                kind = None
+            if kind is not None and worker_id in self._procs:
+                if kind == "ready":
+                    self._ready.add(worker_id)
+                elif kind == "done":
+                    done += len(units.pop(self._assigned[worker_id])[0])
+                    self._assigned[worker_id] = None
+                    print(f"{done}/{len(todo)} files, {done / (time.time() - st):.1f} files/s")
+                elif kind == "failed":
+                    unit_id, reason = payload
+                    self._assigned[worker_id] = None
+                    requeue(worker_id, unit_id, reason)
+            reap()
+            for worker_id in self._ready & self._procs.keys():
+                if pending and self._assigned[worker_id] is None:
+                    unit_id = pending.popleft()
+                    self._assigned[worker_id] = unit_id
+                    self._procs[worker_id][1].put((unit_id, units[unit_id][0]))
+
+        for proc, tasks, _ in self._procs.values():
+            tasks.put(None)
+        for proc, _, _ in self._procs.values():
+            proc.join()
+
+        if failed:
+            with open(os.path.join(self.out_dir, self.FAILED), "w", encoding="utf8") as f:
+                f.writelines(f"{file_path}\t{reason}\n" for file_path, reason in failed)
+            print(f"{len(failed)} files failed, see {os.path.join(self.out_dir, self.FAILED)}")
+
+        shard_dirs = sorted(os.path.join(self.shard_root, x) for x in os.listdir(self.shard_root))
+        store = embedding_store.merge(shard_dirs, os.path.join(self.out_dir, self.MERGED), order=file_paths)
+        print(f"{len(store)} results merged in {time.time() - st:.2f}s")
+        return store
+
+
+if __name__ == "__main__":
+    # raw_test_file = "dump_files\\file_path_dump.txt"
+    raw_test_file = "private_animated_dump.txt"
+    with open(raw_test_file, "r", encoding="utf8") as f:
+        file_paths = ["test/raw/" + x.strip() for x in f.readlines()]
+    tagger = shard_tagger("private_animated_sharded", workers=4)
+    tagger.run(file_paths)
@@ -5,11 +5,21 @@ import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os
+from embedding_store import embedding_store
+from similarity_engine import most_similar
 
 
 dump_pickle_path = 'public_test.pickle'
-with open(dump_pickle_path, "rb") as f:
-    unpickled = pickle.load(f)
+store_path = 'public_test_store'
+if os.path.isdir(store_path):
+    # Rows are memmap views, nothing is read until compared
+    store = embedding_store(store_path)
+    unpickled = list(store.items())
+    matrix = store.matrix()
+else:
+    with open(dump_pickle_path, "rb") as f:
+        unpickled = pickle.load(f)
+    matrix = np.stack([x[0] for x in unpickled])
     
 
 
@@ -47,6 +57,16 @@ def run(function, reverse=False):
     print(f"{function.__name__}. Time taken: {time.time() - st} s")
     return res_dict, most_list
 
+def run_vectorized(metric="cosine", k=1, memory_budget_mb=512):
+    """Blocked matrix-multiply version of `run`. res_dict only keeps the k closest per file"""
+    st = time.time()
+    file_paths = [x[1]["Filepath"] for x in unpickled]
+    res_dict, most_list = most_similar(matrix, file_paths, k, metric, memory_budget_mb)
+    for i, (first_name, second_name, score) in enumerate(most_list):
+        print(f"{i}.\tMost similar with {first_name}: {(second_name, score)}")
+    print(f"{metric} (vectorized). Time taken: {time.time() - st} s")
+    return res_dict, most_list
+
 
 def create_collage(image_a_path, image_b_path, text):
     # Open the images
@@ -92,7 +112,8 @@ def create_collage(image_a_path, image_b_path, text):
     output_image.save('output.jpg')
         
 # create_image_table(most_list)
-res_dict, most_list = run(cosine_similarity, True)
+# res_dict, most_list = run(cosine_similarity, True)
+res_dict, most_list = run_vectorized("cosine")
 index = 9
 create_collage(most_list[index][0], most_list[index][1], f"Distance: {most_list[index][2]}")
 
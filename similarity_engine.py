@@ -0,0 +1,213 @@
+import math
+from typing import Iterator
+
+import numpy as np
+
+METRICS = ("cosine", "dot", "euclidean")
+
+
+def _blocks(n: int, size: int) -> Iterator[tuple[int, int]]:
+    for start in range(0, n, size):
+        yield start, min(start + size, n)
+
+
+def block_size(dim: int, memory_budget_mb=512) -> int:
+    """Rows per tile so that everything allocated per tile fits the budget
+
+    A row block and a column block (b x dim float32 each), their (b x b)
+    float32 product and the (b x b) int64 indices `_keep_best` partitions it
+    with. Solves 4 * (2 * b * dim + 3 * b * b) <= budget for b.
+    """
+    budget = memory_budget_mb * 1024 * 1024 / 4
+    return max(1, int((math.sqrt(dim * dim + 3 * budget) - dim) / 3))
+
+
+def squared_norms(matrix: np.ndarray, block=4096) -> np.ndarray:
+    """Squared L2 norm of every row, streamed so a memmap is never fully loaded"""
+    norms = np.empty(matrix.shape[0], dtype=np.float32)
+    for start, stop in _blocks(matrix.shape[0], block):
+        rows = np.asarray(matrix[start:stop], dtype=np.float32)
+        norms[start:stop] = np.einsum("ij,ij->i", rows, rows)
+    return norms
+
+
+def top_k_similar(matrix: np.ndarray, k=1, metric="cosine", memory_budget_mb=512
+                  ) -> tuple[np.ndarray, np.ndarray]:
+    """Exact k nearest neighbours of every row against every other row
+
+    The matrix is processed in (b x b) tiles computed with one matrix multiply
+    each, so the peak memory is about `memory_budget_mb` rather than set by N. Norms
+    are computed once up front. Each tile only keeps its k best candidates per
+    row through `np.argpartition`, nothing is fully sorted except the final k.
+
+    Args:
+        matrix (np.ndarray): (N x dim) embeddings. Any float dtype, memmaps are fine.
+        k (int, optional): Neighbours per row, excluding the row itself. Defaults to 1.
+        metric (str, optional): "cosine" or "dot" (larger is closer) or "euclidean"
+            (smaller is closer). Defaults to "cosine".
+        memory_budget_mb (int, optional): Approximate working memory per tile. Defaults to 512.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (N x k) neighbour indices and their scores,
+            best first.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+    n, dim = matrix.shape
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int64), np.empty((n, 0), dtype=np.float32)
+
+    block = block_size(dim, memory_budget_mb)
+    sq_norms = squared_norms(matrix, block)
+    inv_norms = _inverse_norms(sq_norms)
+
+    best_idx = np.empty((n, k), dtype=np.int64)
+    best_key = np.empty((n, k), dtype=np.float32)
+    for r0, r1 in _blocks(n, block):
+        rows = np.asarray(matrix[r0:r1], dtype=np.float32)
+        cand_idx = np.empty((r1 - r0, 0), dtype=np.int64)
+        cand_key = np.empty((r1 - r0, 0), dtype=np.float32)
+        for c0, c1 in _blocks(n, block):
+            cols = rows if c0 == r0 else np.asarray(matrix[c0:c1], dtype=np.float32)
+            key = _score_tile(rows @ cols.T, metric, r0, r1, c0, c1, sq_norms, inv_norms)
+            cand_key, cand_idx = _keep_best(cand_key, cand_idx, key, c0, c1, k)
+
+        order = np.argsort(-cand_key, axis=1, kind="stable")
+        best_key[r0:r1] = np.take_along_axis(cand_key, order, axis=1)
+        best_idx[r0:r1] = np.take_along_axis(cand_idx, order, axis=1)
+
+    if metric == "euclidean":
+        return best_idx, np.sqrt(-best_key)
+    return best_idx, best_key
+
+
+def _inverse_norms(sq_norms: np.ndarray) -> np.ndarray:
+    inv_norms = np.zeros_like(sq_norms)
+    np.divide(1, np.sqrt(sq_norms), out=inv_norms, where=sq_norms > 0)
+    return inv_norms
+
+
+def _score_tile(key: np.ndarray, metric: str, r0: int, r1: int, c0: int, c1: int,
+                sq_norms: np.ndarray, inv_norms: np.ndarray) -> np.ndarray:
+    """Turn a tile of dot products into keys where larger is always better, in place
+
+    Euclidean keys are negated squared distances. Self pairs get -inf.
+    """
+    if metric == "cosine":
+        key *= inv_norms[r0:r1, None]
+        key *= inv_norms[None, c0:c1]
+    elif metric == "euclidean":
+        key *= 2
+        key -= sq_norms[r0:r1, None]
+        key -= sq_norms[None, c0:c1]
+        np.minimum(key, 0, out=key)
+
+    lo, hi = max(r0, c0), min(r1, c1)
+    if lo < hi:
+        diag = np.arange(lo, hi)
+        key[diag - r0, diag - c0] = -np.inf
+    return key
+
+
+def _keep_best(cand_key: np.ndarray, cand_idx: np.ndarray, key: np.ndarray, c0: int, c1: int, k: int
+               ) -> tuple[np.ndarray, np.ndarray]:
+    """Add a tile of columns [c0, c1) to the candidates, keeping the k best per row unsorted
+
+    The tile is cut to its own k best first, without copying or negating it, so
+    the only (rows x tile) allocation here is the int64 `argpartition` output.
+    """
+    if key.shape[1] > k:
+        part = np.argpartition(key, key.shape[1] - k, axis=1)[:, -k:]
+        tile_key = np.take_along_axis(key, part, axis=1)
+        tile_idx = part + c0
+    else:
+        tile_key = key
+        tile_idx = np.broadcast_to(np.arange(c0, c1), key.shape)
+    cand_key = np.concatenate((cand_key, tile_key), axis=1)
+    cand_idx = np.concatenate((cand_idx, tile_idx), axis=1)
+    if cand_key.shape[1] > k:
+        part = np.argpartition(-cand_key, k - 1, axis=1)[:, :k]
+        cand_key = np.take_along_axis(cand_key, part, axis=1)
+        cand_idx = np.take_along_axis(cand_idx, part, axis=1)
+    return cand_key, cand_idx
+
+
+def most_similar(matrix: np.ndarray, file_paths: list[str], k=1, metric="cosine",
+                 memory_budget_mb=512) -> tuple[dict, list[tuple[str, str, float]]]:
+    """`top_k_similar` shaped like `similarity.run`
+
+    Returns:
+        tuple[dict, list[tuple[str, str, float]]]: {file path: [(other path, score), ...k]}
+            and the most_list of (file path, closest path, score).
+    """
+    indices, scores = top_k_similar(matrix, k, metric, memory_budget_mb)
+    res_dict = dict()
+    most_list = list()
+    for row, file_path in enumerate(file_paths):
+        neighbours = [(file_paths[j], float(score)) for j, score in zip(indices[row], scores[row])]
+        res_dict[file_path] = neighbours
+        if neighbours:
+            most_list.append((file_path, neighbours[0][0], neighbours[0][1]))
+    return res_dict, most_list
+
+
+
+def top_k_similar_sparse(sparse, k=1, metric="cosine", memory_budget_mb=512, row_block=1024
+                         ) -> tuple[np.ndarray, np.ndarray]:
+    """`top_k_similar` over a `sparse_results` without densifying it
+
+    Each block of `row_block` query rows only has a few tag columns with kept
+    entries, and every other column adds 0 to its dot products. So the block is
+    expanded to dense over just those columns, each column block is expanded
+    over the same columns, and the tile is one matrix multiply on
+    (rows x used tags) instead of (rows x 9176). Dropped entries count as 0,
+    so scores are those of the sparsified vectors.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (N x k) neighbour indices and their scores, best first.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+    n = len(sparse)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int64), np.empty((n, 0), dtype=np.float32)
+
+    sq_norms = sparse.squared_norms()
+    inv_norms = _inverse_norms(sq_norms)
+    row_block = max(1, min(row_block, n))
+    position = np.full(sparse.dim, -1, dtype=np.int64)
+
+    best_idx = np.empty((n, k), dtype=np.int64)
+    best_key = np.empty((n, k), dtype=np.float32)
+    for r0, r1 in _blocks(n, row_block):
+        rows_i, cols_i, values_i = sparse.coo(r0, r1)
+        used = np.unique(cols_i)
+        position[used] = np.arange(len(used))
+        rows = np.zeros((r1 - r0, len(used)), dtype=np.float32)
+        rows[rows_i, position[cols_i]] = values_i
+        # 4 * (c * used + 3 * b * c) <= budget besides the row block, see `block_size`
+        col_block = max(1, int(memory_budget_mb * 1024 * 1024 / 4 / (len(used) + 3 * row_block)))
+
+        cand_idx = np.empty((r1 - r0, 0), dtype=np.int64)
+        cand_key = np.empty((r1 - r0, 0), dtype=np.float32)
+        for c0, c1 in _blocks(n, col_block):
+            if c0 == r0 and c1 == r1:
+                cols = rows
+            else:
+                rows_j, cols_j, values_j = sparse.coo(c0, c1)
+                keep = position[cols_j] >= 0
+                cols = np.zeros((c1 - c0, len(used)), dtype=np.float32)
+                cols[rows_j[keep], position[cols_j[keep]]] = values_j[keep]
+            key = _score_tile(rows @ cols.T, metric, r0, r1, c0, c1, sq_norms, inv_norms)
+            cand_key, cand_idx = _keep_best(cand_key, cand_idx, key, c0, c1, k)
+        position[used] = -1
+
+        order = np.argsort(-cand_key, axis=1, kind="stable")
+        best_key[r0:r1] = np.take_along_axis(cand_key, order, axis=1)
+        best_idx[r0:r1] = np.take_along_axis(cand_idx, order, axis=1)
+
+    if metric == "euclidean":
+        return best_idx, np.sqrt(-best_key)
+    return best_idx, best_key
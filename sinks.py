@@ -0,0 +1,103 @@
+import json
+import sqlite3
+from typing import Optional
+
+import numpy as np
+
+from embedding_store import embedding_store
+
+
+class result_sink:
+    """Receives results from `danbooru_recognizer.inference_stream` batch by batch
+
+    `write` gets a list of (index, result, result_dict) as soon as a batch is
+    parsed. `close` is called once when the stream ends, even on errors.
+    """
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class text_sink(result_sink):
+    """`{index}| {result_dict}` lines, the format of `inference_gpu`'s output_dump"""
+    def __init__(self, path: str, encoding="utf8", mode="a") -> None:
+        self.file = open(path, mode, encoding=encoding)
+
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        self.file.write("".join(f"{i:<3}| {res_dict}\n" for i, _, res_dict in batch))
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class jsonl_sink(result_sink):
+    """One JSON object per result: the result_dict, plus the probabilities with `with_result`"""
+    def __init__(self, path: str, with_result=False, mode="a") -> None:
+        self.file = open(path, mode, encoding="utf8")
+        self.with_result = with_result
+
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        lines = []
+        for _, result, res_dict in batch:
+            if self.with_result:
+                res_dict = {**res_dict, "Result": np.asarray(result, dtype=np.float32).round(4).tolist()}
+            lines.append(json.dumps(res_dict, ensure_ascii=False) + "\n")
+        self.file.write("".join(lines))
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class store_sink(result_sink):
+    """Appends to an `embedding_store`, which stays open for the caller"""
+    def __init__(self, store: embedding_store) -> None:
+        self.store = store
+
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        self.store.extend((result, res_dict) for _, result, res_dict in batch)
+
+
+class sqlite_sink(result_sink):
+    """Tags per file in an SQLite table, one transaction per batch
+
+    Usage:
+        ```
+        sink = sqlite_sink("tags.sqlite")
+        for result, res_dict in recognizer.inference_stream(file_paths, sinks=[sink]):
+            ...
+        ```
+    """
+    def __init__(self, db_path: str, table="tags", with_result=False,
+                 dtype="float16", conn: Optional[sqlite3.Connection] = None) -> None:
+        self.table = table
+        self.with_result = with_result
+        self.dtype = np.dtype(dtype)
+        self._owns_conn = conn is None
+        self._conn = conn if conn is not None else sqlite3.connect(db_path)
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                path      TEXT PRIMARY KEY,
+                rating    TEXT,
+                general   TEXT NOT NULL,
+                character TEXT NOT NULL,
+                result    BLOB
+            )
+        """)
+        self._conn.commit()
+
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        rows = [(res_dict["Filepath"], res_dict["Rating"],
+                 json.dumps(res_dict["General"], ensure_ascii=False),
+                 json.dumps(res_dict["Character"], ensure_ascii=False),
+                 np.asarray(result, dtype=self.dtype).tobytes() if self.with_result else None)
+                for _, result, res_dict in batch]
+        with self._conn:
+            self._conn.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self) -> None:
+        if self._owns_conn:
+            self._conn.close()
@@ -1,11 +1,21 @@
 import os
 import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
 
 from tqdm import tqdm
 from extractor import *
+from classifier import compiled_classifier
+from catalog import catalog
+import metrics
 from util import get_file_paths, extract_file_names, get_file_paths_non_rec
 import shutil
 
+UNKNOWN = "is_unknown"
+
 def init_extractors() -> list[is_gallery_type]:
     is_tagged = is_tagged_string()
     is_4chan = is_4chan_timestamp()
@@ -53,39 +63,210 @@ def create_folder(directory: str, folder_name: str):
         print(f"Folder '{folder_name}' already exists at '{directory}'.")
 
 
-directory = input("Enter folder path: ")
-verbose = False
-if os.path.isdir(directory):
-    print(f"Working at {directory}")
-    extractors = init_extractors()
-    for extr in extractors:
-        extr_name = extr.gallery_type
-        create_folder(directory, extr_name)
-    create_folder(directory, "is_unknown")
-    file_lists = get_file_paths_non_rec(directory, True)
-    print(f"Total files: {len(file_lists)}")
-    st = time.time()
+def classify_detail(classifier: compiled_classifier, file_path: str) -> tuple[str, dict]:
+    """(folder name, extractor result) of the first extractor matching the file name"""
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    extr, result = classifier.match(filename)
+    return (extr.gallery_type if extr is not None else UNKNOWN), result
+
+
+def classify(classifier: compiled_classifier, file_path: str) -> str:
+    """Folder name of the first extractor matching the file name, `UNKNOWN` if none does"""
+    return classify_detail(classifier, file_path)[0]
+
+
+_worker_classifier: Optional[compiled_classifier] = None
+
+def _init_worker():
+    global _worker_classifier
+    _worker_classifier = compiled_classifier(init_extractors())
+
+def _classify_chunk(file_paths: list[str], details=False) -> list[tuple]:
+    if details:
+        return [(file_path, *classify_detail(_worker_classifier, file_path)) for file_path in file_paths]
+    return [(file_path, classify(_worker_classifier, file_path)) for file_path in file_paths]
+
+
+def iter_files(directory: str) -> Iterator[str]:
+    """Absolute paths of the files directly in `directory`, streamed with `os.scandir`"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield os.path.abspath(entry.path)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def classify_stream(file_paths: Iterable[str], workers=os.cpu_count(), chunk_size=512,
+                    max_pending=None, details=False) -> Iterator[tuple]:
+    """(file path, folder name) for every path, in input order
+
+    Classification runs on a process pool (the extractors are pure Python and
+    hold the GIL). At most `max_pending` chunks are in flight, so the listing is
+    consumed as a stream and never held in memory. With `details`, the extractor
+    result is yielded as a third item.
+    """
+    if not workers or workers <= 1:
+        global _worker_classifier
+        if _worker_classifier is None:
+            _init_worker()
+        for chunk in chunked(file_paths, chunk_size):
+            # Pool workers have their own metrics, so chunks are only timed here
+            with metrics.timer("classify_chunk"):
+                classified = _classify_chunk(chunk, details)
+            yield from classified
+        return
+    max_pending = max_pending or workers * 4
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in chunked(file_paths, chunk_size):
+            pending.append(pool.submit(_classify_chunk, chunk, details))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _move_batch(directory: str, moves: list[tuple]) -> tuple[list[tuple[tuple, str, os.stat_result]], list[tuple[str, str]]]:
+    """Move one batch of (file path, folder, ...) plan entries
 
-    for i, file_path in enumerate(tqdm(file_lists, desc="Processing files", unit="file")):
-        file_raw = os.path.basename(file_path)
-        file_raws = os.path.splitext(file_raw)
-        filename = file_raws[0]
-        # print(filename, file_raw, file_path)
-        # print(file_raw)
-        for extr in extractors:
-            if tmp:= extr.test(filename):
-                if verbose:
-                    print(f"{i:<3}| Match {extr.gallery_type} {tmp}")
-                dir_path = os.path.join(directory, extr.gallery_type)
-                shutil.move(file_path, dir_path)
-                break
+    Returns:
+        tuple: ([(plan entry, new path, stat before the move)], [(file path, error)])
+    """
+    moved = []
+    failed = []
+    with metrics.timer("move_batch"):
+        for entry in moves:
+            file_path, folder = entry[0], entry[1]
+            try:
+                stat = os.stat(file_path)
+                final_path = shutil.move(file_path, os.path.join(directory, folder))
+            except (OSError, shutil.Error) as e:
+                failed.append((file_path, f"{type(e).__name__}: {e}"))
+                metrics.count("failures_total", stage="move", error=type(e).__name__)
+                continue
+            moved.append((entry, final_path, stat))
+    return moved, failed
+
+
+def move_stream(directory: str, plan: Iterable[tuple], movers=16, batch_size=256, progress=None,
+                on_moved: Optional[Callable[[list[tuple[tuple, str, os.stat_result]]], None]] = None) -> Counter:
+    """Apply (file path, folder name, ...) moves in batches on a thread pool
+
+    Moves are bound by filesystem latency rather than CPU, so threads overlap
+    the waiting. Pending batches are bounded to `movers * 2`. A file that
+    cannot be moved (destination exists, file vanished) is reported and
+    skipped, and only completed moves are counted. `on_moved` is called on
+    this thread with the (plan entry, new path, stat) of each batch's
+    completed moves.
+    """
+    counts = Counter()
+    failures = []
+
+    def collect(future):
+        moved, failed = future.result()
+        counts.update(entry[1] for entry, _, _ in moved)
+        failures.extend(failed)
+        if on_moved is not None and moved:
+            on_moved(moved)
+        if progress is not None:
+            progress.update(len(moved) + len(failed))
+
+    with ThreadPoolExecutor(movers) as pool:
+        pending = deque()
+        for batch in chunked(plan, batch_size):
+            pending.append(pool.submit(_move_batch, directory, batch))
+            if len(pending) >= movers * 2:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    if failures:
+        print(f"{len(failures)} files could not be moved:")
+        for file_path, error in failures:
+            print(f"    {file_path}: {error}")
+    return counts
+
+
+def write_plan(plan: Iterable[tuple[str, str]], output_path: str, progress=None) -> Counter:
+    """Dry run: write `folder<TAB>file path` lines without touching the files"""
+    counts = Counter()
+    with open(output_path, "w", encoding="utf8") as f:
+        for file_path, folder in plan:
+            f.write(f"{folder}\t{file_path}\n")
+            counts[folder] += 1
+            if progress is not None:
+                progress.update(1)
+    return counts
+
+
+def record_plan(db: catalog, plan: Iterable[tuple[str, str, dict]], batch_size=5000) -> Iterator[tuple[str, str]]:
+    """Dry run: pass (file path, folder name) through, writing each classification to `db` in batches
+
+    Files are recorded where they are. Files that vanished since the listing are skipped.
+    """
+    entries = []
+    for file_path, folder, result in plan:
+        if not os.path.exists(file_path):
+            print(f"Skipped {file_path}: no longer exists")
+            continue
+        entries.append((file_path, folder, result))
+        yield file_path, folder
+        if len(entries) >= batch_size:
+            with metrics.timer("catalog_write"):
+                db.add_classifications(entries)
+            entries = []
+    with metrics.timer("catalog_write"):
+        db.add_classifications(entries)
+
+
+def record_moves(db: catalog, moved: list[tuple[tuple, str, os.stat_result]]) -> None:
+    """`move_stream` callback writing the classifications of completed moves at their new paths"""
+    with metrics.timer("catalog_write"):
+        db.add_classifications([(final_path, entry[1], entry[2]) for entry, final_path, _ in moved],
+                               {final_path: (stat.st_size, stat.st_mtime_ns) for _, final_path, stat in moved})
+
+
+def sort_folder(directory: str, dry_run=False, plan_path="sort_plan.txt",
+                workers=os.cpu_count(), movers=16, catalog_path: Optional[str] = None):
+    st = time.time()
+    plan = classify_stream(iter_files(directory), workers, details=catalog_path is not None)
+    db = None
+    if catalog_path is not None:
+        db = catalog(catalog_path)
+        if dry_run:
+            plan = record_plan(db, plan)
+    with tqdm(desc="Processing files", unit="file") as progress:
+        if dry_run:
+            counts = write_plan(plan, plan_path, progress)
         else:
-            shutil.move(file_path, os.path.join(directory, "is_unknown"))
-    print(f"Time taken: {time.time() - st:.2f} s")
-
-        
-    
-    
-    
-    
-    
\ No newline at end of file
+            for folder_name in {extr.gallery_type for extr in init_extractors()} | {UNKNOWN}:
+                create_folder(directory, folder_name)
+            counts = move_stream(directory, plan, movers, progress=progress,
+                                 on_moved=None if db is None else partial(record_moves, db))
+    if db is not None:
+        db.close()
+        print(f"Classifications recorded in {catalog_path}")
+    elapsed = time.time() - st
+    total = sum(counts.values())
+    for folder_name, count in counts.most_common():
+        print(f"{folder_name:<20} {count}")
+        if not dry_run:
+            metrics.count("files_sorted_total", count, folder=folder_name)
+    if dry_run:
+        print(f"Plan written to {plan_path}")
+    print(f"Total files: {total}. Time taken: {elapsed:.2f} s ({total / max(elapsed, 1e-9):.0f} files/s)")
+    metrics.print_summary()
+    return counts
+
+
+if __name__ == "__main__":
+    directory = input("Enter folder path: ")
+    if os.path.isdir(directory):
+        print(f"Working at {directory}")
+        dry_run = input("Dry run? (Only write the plan) (y/n): ").lower() == "y"
+        catalog_path = input("Catalog database (empty to skip): ") or None
+        sort_folder(directory, dry_run, catalog_path=catalog_path)
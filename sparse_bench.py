@@ -0,0 +1,58 @@
+import os
+import time
+
+import numpy as np
+
+import synthetic
+from embedding_store import embedding_store
+from recognizer import danbooru_recognizer
+from similarity_engine import top_k_similar, top_k_similar_sparse
+from sparse_results import sparse_results
+
+# Dense vs sparse results: storage, tag agreement after thresholding, and
+# agreement of the nearest neighbours with the dense exact ones
+store_path = "public_test_store"
+synthetic_n = 10_000  # used when store_path does not exist
+recognizer_kwargs = {}  # e.g. {"backend": "onnx"}, only the tag list and thresholds are used
+k = 5
+settings = (  # (floor, top_k)
+    (0.01, None),
+    (0.05, None),
+    (None, 64),
+    (None, 32),
+    (0.01, 64),
+)
+
+recognizer = danbooru_recognizer(**recognizer_kwargs)
+recognizer.load()
+if os.path.isdir(store_path):
+    store = embedding_store(store_path)
+    matrix = store.matrix()
+    records = store.records()
+else:
+    matrix = synthetic.synthetic_probabilities(synthetic_n, len(recognizer.backend.tags))
+    records = [{"Filepath": f"synthetic_{i}"} for i in range(synthetic_n)]
+n, dim = matrix.shape
+print(f"{n} results, dim {dim}, dense float32 {n * dim * 4 / 2**20:.1f} MB, float16 {n * dim * 2 / 2**20:.1f} MB")
+
+# float16 is what stores and sparse values hold, so compare tags against that
+reference = np.asarray(matrix, dtype=np.float16).astype(np.float32)
+dense_tags = recognizer.rethreshold([(row, record) for row, record in zip(reference, records)])
+st = time.time()
+dense_idx, _ = top_k_similar(matrix, k, "cosine")
+dense_time = time.time() - st
+print(f"dense top-{k} cosine: {dense_time:.2f}s")
+
+print(f"{'floor':>6} {'top_k':>6} {'nnz/row':>8} {'MB':>8} {'smaller':>8} {'tags same':>10} "
+      f"{'recall@' + str(k):>9} {'top-1':>6} {'time':>7}")
+for floor, top_k in settings:
+    sparse = sparse_results.from_dense(matrix, records, floor, top_k, always=recognizer.rating_slice)
+    sparse_tags = recognizer.rethreshold(sparse)
+    same = sum(a == b for a, b in zip(dense_tags, sparse_tags))
+    st = time.time()
+    sparse_idx, _ = top_k_similar_sparse(sparse, k, "cosine")
+    sparse_time = time.time() - st
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(dense_idx, sparse_idx)])
+    top1 = np.mean(dense_idx[:, 0] == sparse_idx[:, 0])
+    print(f"{str(floor):>6} {str(top_k):>6} {sparse.nnz / n:>8.1f} {sparse.nbytes / 2**20:>8.2f} "
+          f"{n * dim * 2 / sparse.nbytes:>7.1f}x {same / n:>10.4f} {recall:>9.4f} {top1:>6.4f} {sparse_time:>6.2f}s")
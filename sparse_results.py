@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+from typing import Optional
+
+import numpy as np
+
+from embedding_store import embedding_store
+
+
+class sparse_results:
+    """Recognizer results with only their largest probabilities kept, in CSR layout
+
+    Almost all of the 9176 DeepDanbooru probabilities of an image are close to
+    zero. This keeps, per row, the entries at or above `floor` and/or the
+    `top_k` largest, as uint16 tag indices and float16 values. Row `i` is
+    `indices[indptr[i]:indptr[i + 1]]` and the matching `values`, with indices
+    ascending. Dropped entries read as 0.
+
+    Layout of `out_dir`:
+        meta.json       {"dim", "rows", "nnz", "floor", "top_k"}
+        indptr.npy      (rows + 1) int64
+        indices.npy     (nnz) uint16
+        values.npy      (nnz) float16
+        index.jsonl     one result dict per row, as in `embedding_store`
+
+    Usage:
+        ```
+        sparse = sparse_results.from_store(embedding_store("private_store"), top_k=64, floor=0.01,
+                                           always=recognizer.rating_slice)
+        sparse.save("private_sparse")
+        sparse = sparse_results.load("private_sparse")
+        res_dicts = recognizer.rethreshold(sparse, general_thres=0.7)
+        indices, scores = top_k_similar_sparse(sparse, k=5)
+        ```
+    """
+    META = "meta.json"
+    INDPTR = "indptr.npy"
+    INDICES = "indices.npy"
+    VALUES = "values.npy"
+    INDEX = "index.jsonl"
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, values: np.ndarray, dim: int,
+                 records: Optional[list[dict]] = None, floor: Optional[float] = None,
+                 top_k: Optional[int] = None) -> None:
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.dim = dim
+        self._records = records
+        self._index_path: Optional[str] = None
+        self.floor = floor
+        self.top_k = top_k
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[-1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+    @classmethod
+    def from_dense(cls, matrix: np.ndarray, records: Optional[list[dict]] = None, floor: Optional[float] = None,
+                   top_k: Optional[int] = None, always: Optional[slice] = None, chunk_rows=8192) -> "sparse_results":
+        """Sparsify a (N x dim) result matrix, memmaps are read `chunk_rows` at a time
+
+        Args:
+            floor (Optional[float], optional): Keep entries >= floor.
+            top_k (Optional[int], optional): Keep the `top_k` largest entries of each row.
+                With `floor` too, an entry must pass both.
+            always (Optional[slice], optional): Columns kept whatever their value, e.g. the
+                rating columns so the rating argmax stays exact.
+        """
+        n, dim = matrix.shape
+        if dim > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f"{dim} columns do not fit uint16 indices")
+        if floor is None and top_k is None:
+            raise ValueError("Set floor, top_k or both")
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indices, values = [], []
+        for start in range(0, n, chunk_rows):
+            block = np.asarray(matrix[start:start + chunk_rows], dtype=np.float32)
+            if top_k is not None and top_k < dim:
+                mask = np.zeros(block.shape, dtype=bool)
+                top = np.argpartition(-block, top_k - 1, axis=1)[:, :top_k]
+                np.put_along_axis(mask, top, True, axis=1)
+                if floor is not None:
+                    mask &= block >= floor
+            else:
+                mask = block >= floor if floor is not None else np.ones(block.shape, dtype=bool)
+            if always is not None:
+                mask[:, always] = True
+            rows, cols = np.nonzero(mask)
+            indices.append(cols.astype(np.uint16))
+            values.append(block[rows, cols].astype(np.float16))
+            indptr[start + 1:start + len(block) + 1] = np.bincount(rows, minlength=len(block))
+        np.cumsum(indptr, out=indptr)
+        return cls(indptr,
+                   np.concatenate(indices) if indices else np.empty(0, dtype=np.uint16),
+                   np.concatenate(values) if values else np.empty(0, dtype=np.float16),
+                   dim, records, floor, top_k)
+
+    @classmethod
+    def from_store(cls, store: embedding_store, floor: Optional[float] = None, top_k: Optional[int] = None,
+                   always: Optional[slice] = None, chunk_rows=8192) -> "sparse_results":
+        sparse = cls.from_dense(store.matrix(), None, floor, top_k, always, chunk_rows)
+        sparse._index_path = store.index_path
+        return sparse
+
+    def save(self, out_dir: str) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, self.INDPTR), self.indptr)
+        np.save(os.path.join(out_dir, self.INDICES), self.indices)
+        np.save(os.path.join(out_dir, self.VALUES), self.values)
+        index_path = os.path.join(out_dir, self.INDEX)
+        if self._records is None and self._index_path is not None:
+            if os.path.abspath(self._index_path) != os.path.abspath(index_path):
+                shutil.copyfile(self._index_path, index_path)
+        else:
+            with open(index_path, "w", encoding="utf8") as f:
+                f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in self.records())
+        with open(os.path.join(out_dir, self.META), "w") as f:
+            json.dump({"dim": self.dim, "rows": len(self), "nnz": self.nnz,
+                       "floor": self.floor, "top_k": self.top_k}, f)
+
+    @classmethod
+    def load(cls, out_dir: str, mmap=True) -> "sparse_results":
+        """Open a saved set, with `mmap` the arrays are memory mapped instead of read"""
+        with open(os.path.join(out_dir, cls.META), "r") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        sparse = cls(np.load(os.path.join(out_dir, cls.INDPTR), mmap_mode=mode),
+                     np.load(os.path.join(out_dir, cls.INDICES), mmap_mode=mode),
+                     np.load(os.path.join(out_dir, cls.VALUES), mmap_mode=mode),
+                     meta["dim"], floor=meta["floor"], top_k=meta["top_k"])
+        sparse._index_path = os.path.join(out_dir, cls.INDEX)
+        return sparse
+
+    def records(self) -> list[dict]:
+        if self._records is None:
+            if self._index_path is None or not os.path.isfile(self._index_path):
+                self._records = [{} for _ in range(len(self))]
+            else:
+                with open(self._index_path, "r", encoding="utf8") as f:
+                    self._records = [json.loads(line) for _, line in zip(range(len(self)), f)]
+        return self._records
+
+    def file_paths(self) -> list[str]:
+        return [record.get("Filepath") for record in self.records()]
+
+    def row(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        """(tag indices, values) kept for row `i`"""
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return np.asarray(self.indices[start:stop]), np.asarray(self.values[start:stop])
+
+    def coo(self, start=0, stop: Optional[int] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(row - start, tag index, value as float32) of every kept entry of rows [start, stop)"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        ptr = np.asarray(self.indptr[start:stop + 1])
+        rows = np.repeat(np.arange(stop - start), np.diff(ptr))
+        cols = np.asarray(self.indices[ptr[0]:ptr[-1]], dtype=np.int64)
+        return rows, cols, np.asarray(self.values[ptr[0]:ptr[-1]], dtype=np.float32)
+
+    def to_dense(self, start=0, stop: Optional[int] = None) -> np.ndarray:
+        """Rows [start, stop) as a float32 (rows x dim) matrix, dropped entries as 0"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        out = np.zeros((stop - start, self.dim), dtype=np.float32)
+        rows, cols, values = self.coo(start, stop)
+        out[rows, cols] = values
+        return out
+
+    def squared_norms(self, chunk_rows=65536) -> np.ndarray:
+        norms = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), chunk_rows):
+            rows, _, values = self.coo(start, start + chunk_rows)
+            norms[start:start + chunk_rows] = np.bincount(rows, weights=values * values,
+                                                          minlength=min(chunk_rows, len(self) - start))
+        return norms
@@ -0,0 +1,131 @@
+import os
+import random
+import string
+import uuid
+import numpy as np
+from PIL import Image
+
+# Synthetic inputs for the benchmarks, so none of them need private data
+
+IMAGE_SIZES = ((512, 512), (1200, 1800), (2480, 3508), (4000, 3000))
+# Animated gifs are rarely large, and quantizing big frames is what takes time here
+GIF_SIZES = ((320, 240), (512, 512), (800, 600))
+IMAGE_KINDS = {"jpg": IMAGE_SIZES, "png": IMAGE_SIZES, "webp": IMAGE_SIZES, "gif": GIF_SIZES}
+
+
+def synthetic_names(n: int, seed=0) -> list[str]:
+    """Names shaped like each extractor's pattern, plus random and hash-like noise"""
+    rng = random.Random(seed)
+    digits = string.digits
+    alnum = string.ascii_letters + string.digits
+    words = ("hatsune", "miku", "sky", "school", "uniform", "long_hair", "smile", "cat")
+
+    def rand(chars, k):
+        return "".join(rng.choices(chars, k=k))
+
+    templates = (
+        lambda: str(rng.randint(1_500_000_000_000, 1_690_000_000_000)),
+        lambda: rand(alnum + "-_", 15),
+        lambda: f"{rng.randint(10_000_000, 110_000_000)}_p{rng.randint(0, 40)}",
+        lambda: f"illust_{rng.randint(10_000_000, 110_000_000)}_2022{rand(digits, 4)}_{rand(digits, 6)}",
+        lambda: f"__{'_'.join(rng.sample(words, 3))}_drawn_by_{rand(string.ascii_lowercase, 8)}__{rand('0123456789abcdef', 32)}",
+        lambda: f"yande.re {rng.randint(1, 999_999)} {' '.join(rng.sample(words, 4))}",
+        lambda: f"gelbooru_{rng.randint(1, 9_999_999)}_{rand('0123456789abcdef', 32)}",
+        lambda: str(uuid.UUID(int=rng.getrandbits(128))),
+        lambda: f"[SubGroup] Show - {rng.randint(1, 24):02} [1080p].mkv_snapshot_{rand(digits, 2)}.{rand(digits, 2)}",
+        lambda: f"Screenshot_{rng.randint(2015, 2023)}{rand(digits, 4)}-{rand(digits, 6)}",
+        lambda: f"vlcsnap-2021-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}-{rand(digits, 2)}h{rand(digits, 2)}m{rand(digits, 2)}s{rand(digits, 3)}",
+        lambda: f"IMG_2021{rand(digits, 4)}_{rand(digits, 6)}",
+        lambda: f"{rng.randint(2015, 2023)}{rand(digits, 4)}_{rand(digits, 6)}",
+        lambda: f"{rng.randint(2015, 2023)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}"
+                f"{rng.choice(' _-')}{rng.randint(0, 23):02}_{rng.randint(0, 59):02}_{rng.randint(0, 59):02}",
+        lambda: f"{rng.randint(2015, 2023)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}-{rand(digits, 6)}",
+        lambda: f"{' '.join(rng.sample(words, 2))}[sound=files.catbox.moe%2F{rand(string.ascii_lowercase + digits, 6)}.mp3]",
+        lambda: f"tumblr_{rand(alnum, 19)}_1280",
+        lambda: f"image_{rand(digits, 3)}",
+        lambda: f"Vol.{rng.randint(1, 20)} Ch.{rng.randint(1, 200)} Page {rng.randint(1, 40)}",
+        lambda: rand(string.ascii_lowercase, rng.randint(3, 12)) + " " + rng.choice(words),
+        lambda: rand("0123456789abcdef", 32),
+        lambda: rand(alnum, rng.randint(4, 30)),
+        lambda: "ファイル" + rand(digits, 3),
+    )
+    return [rng.choice(templates)() for _ in range(n)]
+
+
+def synthetic_image(rng: np.random.Generator, size: tuple[int, int]) -> Image.Image:
+    """Smooth gradients, a few flat shapes and grain, which compresses like an illustration rather than noise"""
+    width, height = size
+    image = np.empty((height, width, 3), dtype=np.int16)
+    for channel in range(3):
+        fx, fy, phase = rng.random(3) * (4, 4, 6.28)
+        wave_x = np.sin(np.linspace(0, fx * 6.28, width, dtype=np.float32) + phase)
+        wave_y = np.cos(np.linspace(0, fy * 6.28, height, dtype=np.float32))
+        image[..., channel] = 127 + 100 * np.outer(wave_y, wave_x)
+    for _ in range(rng.integers(3, 8)):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        x1, y1 = x0 + rng.integers(width // 10, width // 3), y0 + rng.integers(height // 10, height // 3)
+        image[y0:y1, x0:x1] = rng.integers(0, 256, 3)
+    image += rng.integers(-8, 9, image.shape, dtype=np.int16)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def write_images(out_dir: str, count_per_kind=4, kinds: dict[str, tuple] = IMAGE_KINDS,
+                 seed=0) -> dict[tuple[str, tuple[int, int]], list[str]]:
+    """`count_per_kind` images for every format and size in `kinds`, reused if already written
+
+    Returns:
+        dict[tuple[str, tuple[int, int]], list[str]]: {(format, size): file paths}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    written = {}
+    for fmt, sizes in kinds.items():
+        for size in sizes:
+            paths = []
+            for i in range(count_per_kind):
+                path = os.path.join(out_dir, f"{fmt}_{size[0]}x{size[1]}_{i}.{fmt}")
+                if not os.path.isfile(path):
+                    image = synthetic_image(rng, size)
+                    if fmt == "gif":
+                        frames = [image] + [synthetic_image(rng, size) for _ in range(3)]
+                        frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+                    elif fmt == "jpg":
+                        image.save(path, quality=90)
+                    else:
+                        image.save(path)
+                paths.append(path)
+            written[(fmt, size)] = paths
+    return written
+
+
+def synthetic_results(n: int, dim=9176, clusters=None, seed=0) -> np.ndarray:
+    """(n, dim) float32 rows shaped like tag probabilities: mostly near zero, grouped around `clusters` centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.random((clusters or max(1, n // 100), dim), dtype=np.float32) ** 8
+    matrix = centers[rng.integers(0, len(centers), n)]
+    matrix += 0.05 * rng.random(matrix.shape, dtype=np.float32)
+    return matrix
+
+
+def synthetic_probabilities(n: int, dim=9176, tags_per_image=30, clusters=None, seed=0) -> np.ndarray:
+    """(n, dim) float32 rows shaped like DeepDanbooru output
+
+    Around `tags_per_image` tags per row get high probabilities, drawn by a Zipf
+    popularity so a few tags are in most images. Rows share most of their tags
+    with one of `clusters` prototypes. Everything else is a sigmoid tail of 1e-5 to 1e-2.
+    """
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, dim + 1) ** 1.1
+    popularity = popularity[rng.permutation(dim)]
+    popularity /= popularity.sum()
+    clusters = clusters or max(1, n // 50)
+    prototypes = [rng.choice(dim, tags_per_image, replace=False, p=popularity) for _ in range(clusters)]
+    matrix = (10 ** rng.uniform(-5, -2, (n, dim))).astype(np.float32)
+    for row in range(n):
+        tags = prototypes[rng.integers(clusters)].copy()
+        swapped = rng.random(tags_per_image) < 0.2
+        tags[swapped] = rng.choice(dim, swapped.sum(), p=popularity)
+        matrix[row, tags] = rng.beta(4, 1.5, tags_per_image)
+        extra = rng.choice(dim, tags_per_image, p=popularity)
+        matrix[row, extra] = np.maximum(matrix[row, extra], rng.uniform(0.01, 0.4, tags_per_image))
+    return matrix
@@ -0,0 +1,285 @@
+import os
+import pickle
+from typing import Iterable, Optional
+
+import numpy as np
+from pyroaring import BitMap
+
+from sinks import result_sink
+
+# Extractor result fields indexed as "namespace:value" terms
+FIELD_NAMESPACES = ("artist", "site")
+SOURCES = ("tags", "filename")
+
+
+def normalize(term: str) -> str:
+    return term.strip().lower().replace(" ", "_")
+
+
+def field_value(value) -> str:
+    """Extractor field as text, lists joined with "_" as in the catalog's promoted columns"""
+    if isinstance(value, (list, tuple)):
+        return "_".join(map(str, value))
+    return str(value)
+
+
+def unquote(token: str) -> str:
+    """A token in double quotes is a literal term, e.g. "-_-" or "OR" """
+    if len(token) >= 2 and token.startswith('"') and token.endswith('"'):
+        return token[1:-1]
+    return token
+
+
+def tokenize(query: str) -> list[str]:
+    """Split on whitespace, peeling grouping parentheses off terms
+
+    Tag names can contain parentheses (`hatsune_miku_(cosplay)`), so only a
+    leading "(" and a trailing ")" without a matching "(" inside the term are
+    treated as grouping.
+    """
+    tokens = []
+    for word in query.split():
+        while word.startswith("("):
+            tokens.append("(")
+            word = word[1:]
+        closing = 0
+        while word.endswith(")") and word.count(")") > word.count("("):
+            closing += 1
+            word = word[:-1]
+        if word:
+            tokens.append(word)
+        tokens.extend(")" * closing)
+    return tokens
+
+
+class tag_index:
+    """Inverted index from tags and filename fields to roaring bitmaps of image ids
+
+    Every image gets a dense integer id. Each term maps to a compressed
+    `pyroaring.BitMap` of the ids carrying it, so boolean queries are bitmap
+    AND/OR/ANDNOT and never look at the images themselves. Terms:
+
+        1girl, hatsune_miku         DeepDanbooru General and Character tags
+        rating:safe                 DeepDanbooru rating
+        type:pixiv_id               matched `is_gallery_type`
+        artist:mineori, site:tumblr fields parsed from the file name
+
+    Updates are incremental: re-adding a file replaces the terms of the same
+    source (recognizer tags or file name) for that id, in one bitmap difference
+    per term for the whole batch.
+
+    Usage:
+        ```
+        index = tag_index()
+        index.add_results(res_dicts)
+        index.add_classifications((path, gallery_type, result) for ...)
+        index.search("1girl (hatsune_miku OR kagamine_rin) -rating:explicit")
+        index.save("tag_index.pickle")
+        ```
+    Query syntax: whitespace or AND intersects, OR unions, NOT or a leading "-"
+    excludes, parentheses group. NOT binds tighter than AND, AND tighter than OR.
+    A term in double quotes is taken literally, so `"-_-"` finds the tag -_-
+    and `-"-_-"` excludes it.
+    """
+    def __init__(self) -> None:
+        self.paths: list[str] = []
+        self.ids: dict[str, int] = {}
+        self.terms: dict[str, BitMap] = {}
+        self.source_terms: dict[str, set[str]] = {source: set() for source in SOURCES}
+        self.live = BitMap()
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    def _id(self, path: str) -> int:
+        image_id = self.ids.get(path)
+        if image_id is None:
+            image_id = len(self.paths)
+            self.paths.append(path)
+            self.ids[path] = image_id
+        return image_id
+
+    def _replace(self, source: str, entries: Iterable[tuple[str, Iterable[str]]]) -> int:
+        postings: dict[str, list[int]] = {}
+        updated = BitMap()
+        for path, terms in entries:
+            image_id = self._id(path)
+            updated.add(image_id)
+            for term in terms:
+                postings.setdefault(term, []).append(image_id)
+        if not updated:
+            return 0
+        for term in self.source_terms[source]:
+            bitmap = self.terms[term]
+            if bitmap.intersect(updated):
+                bitmap.difference_update(updated)
+        for term, image_ids in postings.items():
+            if term not in self.terms:
+                self.terms[term] = BitMap()
+            self.terms[term].update(image_ids)
+            self.source_terms[source].add(term)
+        self.live |= updated
+        return len(updated)
+
+    def add_results(self, res_dicts: Iterable[dict]) -> int:
+        """Index recognizer result dicts, replacing earlier tags of the same files"""
+        return self._replace("tags", (
+            (res_dict["Filepath"],
+             [normalize(tag) for tag in (*res_dict["General"], *res_dict["Character"])]
+             + ([normalize(res_dict["Rating"])] if res_dict.get("Rating") else []))
+            for res_dict in res_dicts))
+
+    def add_classifications(self, entries: Iterable[tuple[str, Optional[str], dict]]) -> int:
+        """Index (path, gallery type, extractor result), replacing earlier filename terms of the same files"""
+        def terms(gallery_type: Optional[str], result: dict) -> list[str]:
+            found = [f"type:{gallery_type or 'is_unknown'}"]
+            for namespace in FIELD_NAMESPACES:
+                if value := result.get(namespace):
+                    found.append(f"{namespace}:{normalize(field_value(value))}")
+            return found
+        return self._replace("filename", ((path, terms(gallery_type, result))
+                                          for path, gallery_type, result in entries))
+
+    def remove(self, paths: Iterable[str]) -> int:
+        removed = BitMap(self.ids[path] for path in paths if path in self.ids)
+        for bitmap in self.terms.values():
+            if bitmap.intersect(removed):
+                bitmap.difference_update(removed)
+        self.live.difference_update(removed)
+        return len(removed)
+
+    def posting(self, term: str) -> BitMap:
+        return self.terms.get(normalize(term), BitMap())
+
+    def counts(self, namespace: Optional[str] = None) -> list[tuple[str, int]]:
+        """(term, image count) pairs, most common first"""
+        items = [(term, len(bitmap)) for term, bitmap in self.terms.items()
+                 if namespace is None or term.startswith(namespace + ":")]
+        return sorted(items, key=lambda x: x[1], reverse=True)
+
+    # Queries
+
+    def query(self, query: str) -> BitMap:
+        """Ids of the images matching `query`, see the class docstring for the syntax"""
+        tokens = tokenize(query)
+        position = 0
+
+        def peek() -> Optional[str]:
+            return tokens[position] if position < len(tokens) else None
+
+        def take() -> str:
+            nonlocal position
+            position += 1
+            return tokens[position - 1]
+
+        def parse_or() -> BitMap:
+            result = parse_and()
+            while peek() == "OR":
+                take()
+                result = result | parse_and()
+            return result
+
+        def parse_and() -> BitMap:
+            result = parse_not()
+            while peek() not in (None, "OR", ")"):
+                if peek() == "AND":
+                    take()
+                result = result & parse_not()
+            return result
+
+        def parse_not() -> BitMap:
+            token = peek()
+            if token == "NOT":
+                take()
+                return self.live - parse_not()
+            if token is not None and token.startswith("-") and len(token) > 1:
+                take()
+                return self.live - self.posting(unquote(token[1:]))
+            return parse_atom()
+
+        def parse_atom() -> BitMap:
+            if peek() is None:
+                raise ValueError(f"Unexpected end of query {query!r}")
+            token = take()
+            if token == "(":
+                result = parse_or()
+                if peek() != ")":
+                    raise ValueError(f"Missing ) in query {query!r}")
+                take()
+                return result
+            if token in (")", "AND", "OR"):
+                raise ValueError(f"Unexpected {token!r} in query {query!r}")
+            return BitMap(self.posting(unquote(token)))
+
+        if not tokens:
+            return BitMap(self.live)
+        result = parse_or()
+        if position != len(tokens):
+            raise ValueError(f"Unexpected {tokens[position]!r} in query {query!r}")
+        return result
+
+    def search(self, query: str, limit: Optional[int] = None) -> list[str]:
+        """Paths of the images matching `query`, in id order"""
+        image_ids = self.query(query)
+        if limit is not None and len(image_ids) > limit:
+            image_ids = image_ids[:limit]
+        return [self.paths[image_id] for image_id in image_ids]
+
+    # Persistence
+
+    def save(self, index_path: str) -> None:
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "paths": self.paths,
+                "live": self.live.serialize(),
+                "terms": {term: bitmap.serialize() for term, bitmap in self.terms.items()},
+                "source_terms": self.source_terms,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path: str) -> "tag_index":
+        with open(index_path, "rb") as f:
+            data = pickle.load(f)
+        index = cls()
+        index.paths = data["paths"]
+        index.ids = {path: image_id for image_id, path in enumerate(index.paths)}
+        index.live = BitMap.deserialize(data["live"])
+        index.terms = {term: BitMap.deserialize(raw) for term, raw in data["terms"].items()}
+        index.source_terms = data["source_terms"]
+        return index
+
+    @classmethod
+    def from_store(cls, store) -> "tag_index":
+        """Build from the result dicts of an `embedding_store`"""
+        index = cls()
+        index.add_results(store.records())
+        return index
+
+    @classmethod
+    def from_catalog(cls, db) -> "tag_index":
+        """Build from a `catalog.catalog` database"""
+        import json
+        index = cls()
+        rows = db.query("SELECT f.path, c.gallery_type, c.fields FROM classifications c "
+                        "JOIN files f ON f.id = c.file_id")
+        index.add_classifications((path, gallery_type, json.loads(fields)) for path, gallery_type, fields in rows)
+        tags: dict[str, dict] = {}
+        for path, name, category in db.query(
+                "SELECT f.path, t.name, t.category FROM file_tags ft JOIN files f ON f.id = ft.file_id "
+                "JOIN tags t ON t.id = ft.tag_id"):
+            tags.setdefault(path, {"Filepath": path, "General": [], "Character": [], "Rating": None})[category].append(name)
+        for path, rating in db.query("SELECT f.path, r.rating FROM ratings r JOIN files f ON f.id = r.file_id"):
+            tags.setdefault(path, {"Filepath": path, "General": [], "Character": [], "Rating": None})["Rating"] = rating
+        index.add_results(tags.values())
+        return index
+
+
+class tag_index_sink(result_sink):
+    """Adds `inference_stream` results to a tag index as they arrive"""
+    def __init__(self, index: tag_index) -> None:
+        self.index = index
+
+    def write(self, batch: list[tuple[int, np.ndarray, dict]]) -> None:
+        self.index.add_results(res_dict for _, _, res_dict in batch)
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+from embedding_cache import embedding_cache
+from embedding_store import embedding_store
+from sinks import store_sink
+
+
+class tag_job:
+    """Checkpointed tagging run that can be resumed after a crash or Ctrl+C
+
+    Layout of `job_dir`:
+        files.txt       input list, written once when the job is created
+        store/          `embedding_store` with the results
+        progress.log    one JSON line per finished file: {"status": "ok" | "failed", "path", "error"}
+
+    Results are appended to the store as they come. Every `commit_every` files
+    or `commit_seconds`, the store is fsync'd and then the matching progress
+    lines are written and fsync'd. The log is the source of truth, so on resume
+    any store rows past the logged "ok" count are dropped, and files already
+    logged as ok or failed are skipped. A file that fails to decode, or is
+    missing, is logged as failed instead of aborting the run.
+
+    Usage:
+        ```
+        job = tag_job.create("jobs/private", file_paths)
+        job.run(recognizer, batch_size=16, num_workers=4)
+        # after a crash
+        tag_job("jobs/private").run(recognizer, batch_size=16, num_workers=4)
+        ```
+    """
+    FILES = "files.txt"
+    STORE = "store"
+    LOG = "progress.log"
+    def __init__(self, job_dir: str, commit_every=512, commit_seconds=30.0) -> None:
+        self.job_dir = job_dir
+        self.files_path = os.path.join(job_dir, self.FILES)
+        self.store_dir = os.path.join(job_dir, self.STORE)
+        self.log_path = os.path.join(job_dir, self.LOG)
+        assert os.path.isfile(self.files_path), f"No job in {job_dir}, start one with tag_job.create"
+        self.commit_every = commit_every
+        self.commit_seconds = commit_seconds
+
+    @classmethod
+    def create(cls, job_dir: str, file_paths: Iterable[str], store_dtype="float16", **kwargs) -> "tag_job":
+        os.makedirs(job_dir, exist_ok=True)
+        files_path = os.path.join(job_dir, cls.FILES)
+        if os.path.isfile(files_path):
+            raise FileExistsError(f"{job_dir} already has a job, resume it with tag_job({job_dir!r})")
+        embedding_store(os.path.join(job_dir, cls.STORE), dtype=store_dtype)
+        tmp_path = files_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.writelines(f"{file_path}\n" for file_path in file_paths)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, files_path)
+        return cls(job_dir, **kwargs)
+
+    def file_paths(self) -> Iterator[str]:
+        with open(self.files_path, "r", encoding="utf8") as f:
+            for line in f:
+                if line := line.rstrip("\n"):
+                    yield line
+
+    def read_log(self) -> tuple[list[str], dict[str, str]]:
+        """(paths logged ok in store row order, {failed path: error})
+
+        A last line cut off by a crash has no newline and is ignored.
+        """
+        ok: list[str] = []
+        failed: dict[str, str] = {}
+        if not os.path.isfile(self.log_path):
+            return ok, failed
+        with open(self.log_path, "rb") as f:
+            lines = f.read().split(b"\n")[:-1]
+        for line in lines:
+            entry = json.loads(line)
+            if entry["status"] == "ok":
+                ok.append(entry["path"])
+                failed.pop(entry["path"], None)
+            else:
+                failed[entry["path"]] = entry["error"]
+        return ok, failed
+
+    def status(self) -> dict:
+        ok, failed = self.read_log()
+        total = sum(1 for _ in self.file_paths())
+        return {"total": total, "ok": len(ok), "failed": len(failed),
+                "remaining": total - len(set(ok) | failed.keys())}
+
+    def run(self, recognizer, batch_size=1, num_workers=0, queue_depth=8,
+            cache: Optional[embedding_cache] = None, retry_failed=False, verbose=False) -> embedding_store:
+        """Tag every file not logged yet, returns the job's store
+
+        Args:
+            recognizer (danbooru_recognizer): Loaded recognizer.
+            retry_failed (bool, optional): Also run files logged as failed. Defaults to False.
+        """
+        st = time.time()
+        ok, failed = self.read_log()
+        store = embedding_store(self.store_dir)
+        if len(store) > len(ok):
+            print(f"Dropping {len(store) - len(ok)} results written after the last checkpoint")
+            store.truncate(len(ok))
+        skip = set(ok) if retry_failed else set(ok) | failed.keys()
+        total = sum(1 for _ in self.file_paths())
+        print(f"{len(ok)} done, {len(failed)} failed, {total - len(skip)} to go")
+
+        # With num_workers > 0, todo() and so fail() run on the loader's producer thread
+        pending: list[dict] = []
+        pending_lock = threading.Lock()
+        last_commit = time.time()
+        processed = 0
+        log_file = open(self.log_path, "ab")
+
+        def log(entry: dict):
+            with pending_lock:
+                pending.append(entry)
+
+        def commit():
+            nonlocal pending, last_commit
+            store.sync()
+            with pending_lock:
+                entries, pending = pending, []
+            log_file.write(b"".join(json.dumps(entry, ensure_ascii=False).encode("utf8") + b"\n"
+                                    for entry in entries))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            last_commit = time.time()
+
+        def fail(file_path: str, error: str):
+            print(f"Failed {file_path}: {error}")
+            log({"status": "failed", "path": file_path, "error": error})
+
+        def todo() -> Iterator[str]:
+            for file_path in self.file_paths():
+                if file_path in skip:
+                    continue
+                if not os.path.exists(file_path):
+                    fail(file_path, "FileNotFoundError")
+                    continue
+                yield file_path
+
+        try:
+            stream = recognizer.inference_stream(
+                todo(), batch_size, num_workers, queue_depth, cache, sinks=[store_sink(store)],
+                on_error=lambda i, file_path, e: fail(file_path, f"{type(e).__name__}: {e}"))
+            for i, result, res_dict in stream:
+                log({"status": "ok", "path": res_dict["Filepath"]})
+                processed += 1
+                if verbose:
+                    print(f"{i:<3}| {res_dict}")
+                if len(pending) >= self.commit_every or time.time() - last_commit >= self.commit_seconds:
+                    commit()
+                    print(f"Checkpoint: {len(ok) + processed}/{total} files, "
+                          f"{processed / (time.time() - st):.1f} files/s")
+        finally:
+            commit()
+            log_file.close()
+        print(f"{processed} files tagged in {time.time() - st:.2f}s")
+        return store
+
+
+def resume(job_dir: str, recognizer, **kwargs) -> embedding_store:
+    """Continue the job in `job_dir` where it stopped"""
+    return tag_job(job_dir).run(recognizer, **kwargs)
+
+
+if __name__ == "__main__":
+    from recognizer import danbooru_recognizer
+
+    job_dir = input("Job folder: ")
+    if not os.path.isfile(os.path.join(job_dir, tag_job.FILES)):
+        raw_test_file = input("New job, file list: ")
+        with open(raw_test_file, "r", encoding="utf8") as f:
+            tag_job.create(job_dir, [x.strip() for x in f.readlines()])
+    danbooru = danbooru_recognizer()
+    danbooru.load()
+    resume(job_dir, danbooru, batch_size=8, num_workers=4)
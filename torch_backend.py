@@ -0,0 +1,144 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Optional
+
+import numpy as np
+import torch
+import TorchDeepDanbooru.deep_danbooru_model as deep_danbooru_model
+from torch.amp.autocast_mode import autocast
+
+import metrics
+
+
+def set_device():
+    if torch.cuda.is_available():
+        print("CUDA IS AVAILABLE. GPU MODE")
+        return "cuda"
+    else:
+        print("CUDA NOT AVAILABLE. CPU MODE")
+        return "cpu"
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether oneDNN has native bf16 kernels here (AVX512-BF16 / AMX), otherwise bf16 is emulated and slow"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class torch_backend:
+    """TorchDeepDanbooru model on GPU or CPU
+
+    Usage:
+        ```
+        backend = torch_backend("model\\DeepDanbooru\\model-resnet_custom_v3.pt", precision="fp32")
+        backend.load()
+        with backend.inference_context():
+            probabilities = backend.predict(arrays)
+        ```
+    """
+    PRECISIONS = ("fp16", "bf16", "fp32", "int8")
+    def __init__(self, model_path: str, precision: Optional[str] = None,
+                 num_threads: Optional[int] = None, channels_last: Optional[bool] = None) -> None:
+        """
+
+        Args:
+            precision (Optional[str], optional): One of `PRECISIONS`. "fp16" is GPU only, "int8"
+                is CPU only and needs `calibration_arrays` in `load`.
+                Defaults to "fp16" on GPU, "bf16" on CPUs with native bf16 and "fp32" otherwise.
+            num_threads (Optional[int], optional): Intra-op CPU threads. Defaults to torch's choice.
+            channels_last (Optional[bool], optional): Keep conv weights in NHWC layout. The model
+                permutes its NHWC input to NCHW, which is already channels_last in memory, so no
+                copies are made around the first conv. Defaults to True on CPU.
+        """
+        self.model = deep_danbooru_model.DeepDanbooruModel()
+        self.model_path = model_path
+        self.device = set_device()
+
+        if precision is None:
+            if self.device == "cuda":
+                precision = "fp16"
+            else:
+                precision = "bf16" if cpu_supports_bf16() else "fp32"
+        assert precision in self.PRECISIONS, f"Unknown precision {precision}, expected one of {self.PRECISIONS}"
+        if self.device == "cuda":
+            assert precision != "int8", "int8 quantization is CPU only"
+        else:
+            assert precision != "fp16", "fp16 is GPU only, use bf16 or fp32 on CPU"
+        self.precision = precision
+        self.channels_last = self.device == "cpu" if channels_last is None else channels_last
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+    @property
+    def tags(self) -> list[str]:
+        return self.model.tags
+
+    def load(self, is_eval=True, calibration_arrays: Optional[Iterable[np.ndarray]] = None):
+        """
+        Args:
+            calibration_arrays (Optional[Iterable[np.ndarray]], optional): Input rows run through the
+                model to set activation ranges for static "int8" quantization.
+        """
+        st = time.time()
+        self.model.load_state_dict(torch.load(self.model_path, map_location=self.device))
+        if is_eval:
+            self.model.eval()
+            if self.precision == "fp16":
+                self.model.half()
+            else:
+                self.model.float()
+            if self.device == "cuda":
+                self.model.cuda()
+            if self.channels_last:
+                self.model = self.model.to(memory_format=torch.channels_last)
+            if self.precision == "int8":
+                assert calibration_arrays is not None, "Static int8 quantization needs calibration_arrays"
+                self.model = self._quantize_static(self.model, calibration_arrays)
+        print(f"Model loaded in {time.time() - st:.2f}s ({self.device}, {self.precision}, "
+              f"{torch.get_num_threads()} threads)")
+
+    def _quantize_static(self, model: torch.nn.Module, calibration_arrays: Iterable[np.ndarray]) -> torch.nn.Module:
+        """int8 weights and activations for every conv, with ranges observed on `calibration_arrays`"""
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        calibration_arrays = iter(calibration_arrays)
+        example = torch.from_numpy(next(calibration_arrays))
+        prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), (example,))
+        with torch.no_grad():
+            prepared(example)
+            for array in calibration_arrays:
+                prepared(torch.from_numpy(array))
+        quantized = convert_fx(prepared)
+        quantized.tags = model.tags
+        return quantized
+
+    def _autocast(self):
+        if self.precision == "fp16":
+            return autocast(self.device, dtype=torch.float16)
+        if self.precision == "bf16":
+            return autocast(self.device, dtype=torch.bfloat16)
+        return nullcontext()
+
+    @contextmanager
+    def inference_context(self):
+        with torch.no_grad(), self._autocast():
+            yield
+
+    def to_tensor(self, array: np.ndarray) -> torch.Tensor:
+        with metrics.timer("to_device"):
+            return torch.from_numpy(array).to(self.device)
+
+    def predict_tensor(self, tensor: torch.Tensor) -> np.ndarray:
+        # .cpu() waits for the GPU, so this also covers the device to host copy
+        with metrics.timer("forward"):
+            result = self.model(tensor).detach().cpu()
+        if result.dtype == torch.bfloat16:
+            result = result.float()
+        return result.numpy()
+
+    def predict(self, array: np.ndarray) -> np.ndarray:
+        """One forward pass over a stacked (N, 512, 512, 3) array, returns (N, tags)"""
+        return self.predict_tensor(self.to_tensor(array))
@@ -1,5 +1,7 @@
 import os
 
+from file_manifest import file_manifest
+
 def check_file(file_path):
     response = input(f"{file_path} already exists. Do you want to replace it? (y/n): ")
     return response.lower() == 'y'
@@ -9,10 +11,18 @@ def user_continue():
     return response.lower() == 'y'
 
 
-def get_file_paths(directory_path, absolute=False):
+def get_file_paths(directory_path, absolute=False, manifest_path=None):
     if not os.path.isdir(directory_path):
         raise ValueError("Invalid directory path")
 
+    if manifest_path is not None:
+        # Only re-lists directories that changed since the last call, see file_manifest
+        manifest = file_manifest(directory_path, manifest_path)
+        manifest.refresh()
+        file_paths = list(manifest.file_paths(absolute))
+        manifest.close()
+        return file_paths
+
     file_paths = []
     
     for root, dirs, files in os.walk(directory_path):
@@ -63,14 +73,14 @@ def extract_file_names(file_paths: list) -> list:
     
     return file_names
 
-def dump_file_paths(input_folder: str, output_file: str):
-    file_paths = get_file_paths(input_folder)
+def dump_file_paths(input_folder: str, output_file: str, manifest_path=None):
+    file_paths = get_file_paths(input_folder, manifest_path=manifest_path)
     with open(output_file, "w", encoding="utf8") as f:
         for file_path in file_paths:
             f.write(f"{file_path}\n")
 
-def dump_file_paths_ext_cond(input_folder: str, output_file: str, exts: list[str]):
-    file_paths = get_file_paths(input_folder)
+def dump_file_paths_ext_cond(input_folder: str, output_file: str, exts: list[str], manifest_path=None):
+    file_paths = get_file_paths(input_folder, manifest_path=manifest_path)
     with open(output_file, "w", encoding="utf8") as f:
         for file_path in file_paths:
             file_path: str